@@ -1,5 +1,5 @@
 ## develop your flask app here ##
-from typing import Dict, List, Union, Any
+from typing import Dict, Iterator, List, Union, Any
 from flask import (
     Flask,
     render_template,
@@ -9,10 +9,28 @@ from flask import (
     session,
     jsonify,
     Response,
+    send_file,
 )
-from user_data.user_profile import UserProfile, UsersData
+from user_data.user_profile import UserProfile
+from user_data.storage import create_users_data
+from meal_data import MealsData, RecipeCache, RecipeQueryEngine, nutrient_summary
+from meal_data.query_engine import NUTRIENT_PARAM
 from dotenv import load_dotenv
 from forms import SearchForm
+from spoonacular import SpoonacularClient
+from quota_limiter import QuotaLimiter, BACKGROUND
+from search_cache import SearchCache
+from single_flight import SingleFlight
+from image_cache import ImageCache, is_allowed
+from intake_targets import IntakeTargets
+from symptom_analysis import (
+    SymptomAnalyses,
+    STRUCTURED,
+    SymptomVocabulary,
+    profile_fingerprint,
+)
+from models.input_output_models import SymptomAnalysis
+from pydantic import ValidationError
 from groq import Groq
 import os
 import json
@@ -28,13 +46,209 @@ app = Flask(
 )
 app.secret_key = "VerySupersecretKey"  # A secret key for the sessions.
 
+# The caches of recipes, searches and images default to this directory, wherever the app is started from
+MEAL_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "meal_data")
+
 # Retrieves the spoonacular API key from the .env file
 spoonacular_api_key: str = os.getenv("API_KEY")
 
-client: str = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+# All Spoonacular calls go through one client, which reuses connections and has timeouts and retries.
+# SPOONACULAR_BASE_URL can point the app to another server, for example the local stand-in (see stand_in.py).
+# The client spends at most SPOONACULAR_DAILY_QUOTA points a day, and background work (like adding images
+# to a meal plan) leaves the last SPOONACULAR_BACKGROUND_RESERVE part of the quota to page loads.
+# When the quota runs low, pages are served from the caches or with partial results.
+spoonacular = SpoonacularClient(
+    spoonacular_api_key,
+    os.getenv("SPOONACULAR_BASE_URL", "https://api.spoonacular.com"),
+    limiter=QuotaLimiter(
+        float(os.getenv("SPOONACULAR_DAILY_QUOTA", 150)),
+        float(os.getenv("SPOONACULAR_BACKGROUND_RESERVE", 0.25)),
+    ),
+)
+
+# GROQ_BASE_URL can point the Groq calls to another server, for example the local stand-in (see stand_in.py).
+client: str = Groq(
+    api_key=os.environ.get("GROQ_API_KEY"), base_url=os.getenv("GROQ_BASE_URL")
+)
+
+# Identical Groq calls that run at the same time (for example a double submitted form) are made once.
+groq_flight = SingleFlight()
+
+
+def groq_chat(**request: Any) -> Any:
+    """
+    Creates a Groq chat completion, shared with the identical calls that are in flight.
+
+    :param request: The arguments of client.chat.completions.create.
+    :return: The chat completion.
+    """
+    key = json.dumps(request, sort_keys=True, default=str)
+    return groq_flight.do(key, client.chat.completions.create, **request)
+
+
+# Initializes the UsersData object where all the user profiles will be stored.
+# The storage engine is picked with USERS_STORAGE in the .env file (json, journal, sqlite or indexed), json is the default.
+# With USERS_BLOB_DIR set, meal plans and analyses are stored in that directory and only loaded when a page needs them.
+# With USERS_WRITE_DELAY set (in seconds), saves return immediately and are written in the background.
+# STORAGE_CODEC picks the file format (json, compact, records or msgpack), existing files are read in any format.
+users_data = create_users_data(
+    os.getenv("USERS_STORAGE", "json"),
+    os.getenv("USERS_FILE"),
+    os.getenv("USERS_BLOB_DIR"),
+    float(os.getenv("USERS_WRITE_DELAY", 0)),
+    os.getenv("STORAGE_CODEC"),
+    float(os.getenv("USERS_WRITE_MAX_DELAY", 0)),
+)
+
+
+def fetch_recipe_information(
+    recipe_id: str, include_nutrition: bool = False
+) -> Union[Dict[str, Any], None]:
+    """
+    Fetches the information of a recipe from the Spoonacular API.
+
+    :param recipe_id: The ID of the recipe.
+    :param include_nutrition: Whether the nutrition of the recipe should be included.
+    :return: The recipe information, or None if the request failed.
+    """
+    try:
+        response = spoonacular.recipe_information(recipe_id, include_nutrition)
+    except requests.RequestException as e:
+        print(f"Error fetching recipe {recipe_id}:", e)
+        return None
+    if not response.ok:
+        return None
+    return response.json()
+
+
+def fetch_recipe_information_bulk(
+    recipe_ids: List[int], include_nutrition: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Fetches the information of several recipes from the Spoonacular API in one call.
+
+    :param recipe_ids: The IDs of the recipes.
+    :param include_nutrition: Whether the nutrition of the recipes should be included.
+    :return: The information of the recipes that were found, an empty list if the request failed.
+    """
+    try:
+        response = spoonacular.recipe_information_bulk(recipe_ids, include_nutrition)
+    except requests.RequestException as e:
+        print(f"Error fetching recipes {recipe_ids}:", e)
+        return []
+    if not response.ok:
+        return []
+    recipes = response.json()
+    return recipes if isinstance(recipes, list) else []
+
+
+# Recipe information is served from the meals database while it is fresh and only fetched from Spoonacular otherwise.
+# Pages that need several recipes fetch the missing ones together with informationBulk.
+# RECIPE_CACHE_TTL (in seconds) and RECIPE_CACHE_SIZE (number of recipes) can be set in the .env file.
+recipe_cache = RecipeCache(
+    MealsData(os.getenv("MEALS_FILE", os.path.join(MEAL_DATA_DIR, "recipe_cache.json"))),
+    fetch_recipe_information,
+    ttl=float(os.getenv("RECIPE_CACHE_TTL", 7 * 24 * 3600)),
+    max_size=int(os.getenv("RECIPE_CACHE_SIZE", 5000)),
+    fetch_bulk=fetch_recipe_information_bulk,
+)
+
+
+# Searches that enough stored recipes match are answered from the recipe cache, without Spoonacular.
+query_engine = RecipeQueryEngine(recipe_cache.meals_data)
+
+
+# Recipe search results are shared by all users with the same search parameters.
+# SEARCH_CACHE_FILE, SEARCH_CACHE_TTL (in seconds) and SEARCH_CACHE_SIZE (number of searches) can be set in the .env file.
+search_cache = SearchCache(
+    os.getenv("SEARCH_CACHE_FILE", os.path.join(MEAL_DATA_DIR, "search_cache.json")),
+    ttl=float(os.getenv("SEARCH_CACHE_TTL", 24 * 3600)),
+    max_size=int(os.getenv("SEARCH_CACHE_SIZE", 1000)),
+)
+
+# The minimum nutrient amounts of the recommendation searches, per age band and sex (data/intake_targets.json)
+intake_targets = IntakeTargets()
+
+
+# Recipe images are fetched once per size from Spoonacular and then served from this directory.
+# IMAGE_CACHE_DIR and IMAGE_CACHE_BYTES (the maximum total size) can be set in the .env file.
+image_cache = ImageCache(
+    os.getenv("IMAGE_CACHE_DIR", os.path.join(MEAL_DATA_DIR, "images")),
+    max_bytes=int(os.getenv("IMAGE_CACHE_BYTES", 200 * 1024 * 1024)),
+)
+# Browsers keep a proxied image for a month, a cached size of an image never changes
+IMAGE_MAX_AGE = 30 * 24 * 3600
+
+
+@app.template_filter("thumbnail")
+def thumbnail(url: str, size: str = "312x231") -> str:
+    """
+    Returns the URL of the proxied thumbnail of a Spoonacular image, for use in the templates.
+    Images of other hosts are used as they are.
 
-# Initializes the UsersData object where all the user profiles will be stored in a json file.
-users_data = UsersData()
+    :param url: The image URL.
+    :param size: The thumbnail size, one of image_cache.SIZES.
+    :return: The URL of the image to use in the page.
+    """
+    if not url or not is_allowed(url):
+        return url
+    return url_for("image_proxy", url=url, size=size)
+
+
+def run_searches(
+    searches: List[Dict[str, Any]],
+) -> List[Union[Dict[str, Any], Exception]]:
+    """
+    Runs several complexSearch calls at the same time.
+
+    :param searches: The parameters of every search.
+    :return: The JSON result of every search in the same order, or the exception if the search failed.
+    """
+    results = []
+    for response in spoonacular.search_many(searches):
+        try:
+            if isinstance(response, Exception):
+                raise response
+            response.raise_for_status()
+            data = response.json()
+            if not isinstance(data, dict):
+                raise ValueError(f"Unexpected search result: {data}")
+            results.append(data)
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def run_nutrition_searches(
+    searches: List[Dict[str, Any]],
+) -> List[Union[Dict[str, Any], Exception]]:
+    """
+    Runs several complexSearch calls with the nutrition of the recipes inline (addRecipeNutrition).
+    Every recipe is cut down to its nutrient summary, and the summaries are stored in the recipe cache,
+    so the meal planner can add up the nutrition of these recipes without calling Spoonacular again.
+
+    :param searches: The parameters of every search, with addRecipeNutrition set.
+    :return: The slim result of every search in the same order, or the exception if the search failed.
+    """
+    results = run_searches(searches)
+    for params, data in zip(searches, results):
+        if isinstance(data, Exception):
+            continue
+        # Besides calories and the macros, keep the nutrients that the search filtered on
+        nutrients = [match.group(2) for match in map(NUTRIENT_PARAM.match, params) if match]
+        data["results"] = [
+            nutrient_summary(recipe, nutrients) for recipe in data.get("results", [])
+        ]
+        recipe_cache.store_summaries(data["results"], nutrients)
+    return results
+
+
+@app.before_request
+def refresh_users_data() -> None:
+    """
+    Picks up the user profiles that other worker processes changed, before the request uses them.
+    """
+    users_data.refresh()
 
 
 def userAuthHelper() -> UserProfile:
@@ -228,31 +442,74 @@ def home() -> Union[str, Response]:
     return render_template("homepage.html", response=user_name, form=form)
 
 
+# "Hair loss,fatigue" and "tired, hair loss" are the same symptoms, so they share their stored analysis.
+symptom_vocabulary = SymptomVocabulary()
+
+
+def requested_symptoms() -> str:
+    """
+    Returns the canonical key of the symptoms in the query parameters, the key of the stored analyses.
+
+    :return: The symptoms, sorted and joined by ", ".
+    """
+    return symptom_vocabulary.canonical(request.args.get("symptoms", ""))
+
+
 # function to analyze symptoms
-def analyze_symptoms() -> str:
+def analyze_symptoms(user: UserProfile = None) -> str:
     """
-    Sends the user's profile and symptoms to the Groq API and returns a text response.
+    Returns the analysis of the symptoms in the query parameters for the logged-in user.
 
     The result includes possible deficiencies, explanations, food suggestions, and tips.
     Other functions can parse this text to extract vitamins or recommended foods.
-    :return: Textual analysis from Groq LLM based on symptoms and user profile.
+    Every route gets the analysis from here, so Groq is asked at most once per symptoms and profile.
+    :param user: The user profile, the logged-in user if not given.
+    :return: Textual analysis from Groq LLM based on symptoms and user profile, or None if Groq failed.
     """
     # Get the currently logged-in user
-    username = session["username"]
-    user = users_data.get_user(username)
+    if user is None:
+        user = users_data.get_user(session["username"])
 
-    # Get raw symptom input from query parameters
-    raw_symptoms = request.args.get("symptoms", "").strip()
-
-    # Normalize input: split by comma, strip extra spaces, and join back with proper formatting
-    symptom_list = [s.strip() for s in raw_symptoms.split(",") if s.strip()]
-    symptoms = ", ".join(symptom_list)
+    # Canonical input: lowercase, without duplicates, sorted and with synonyms replaced
+    symptoms = requested_symptoms()
 
     # Save to session for reuse
     session["last_symptoms"] = symptoms
 
-    # Create the prompt to send to Groq LLM
-    ai_prompt = f"""
+    return symptom_analyses.get(user, symptoms)
+
+
+def symptom_prompt(user: UserProfile, symptoms: str, structured: bool = False) -> str:
+    """
+    Returns the prompt that asks Groq for the analysis of the user's profile and symptoms.
+
+    :param user: The user profile.
+    :param symptoms: The normalized symptoms.
+    :param structured: Asks for the analysis as JSON.
+    :return: The prompt.
+    """
+    if structured:
+        answer_format = """return the analysis ONLY as a JSON object in this format:
+        {
+            "deficiencies": [
+                {
+                    "nutrient": "[vitamin/mineral name]",
+                    "why": "[explanation]",
+                    "foods": ["[food]", "[food]", "[food]"],
+                    "tip": "[actionable advice]"
+                }
+            ],
+            "urgency_note": "[urgent medical concerns]" or null
+        }"""
+    else:
+        answer_format = """return the analysis ONLY in this format:
+        [vitamin/mineral name] (no extra stuff):
+        - Why: [explanation]
+        - Foods: [comma-separated list]
+        - Tip: [actionable advice]
+
+        [Urgency Note]: (optional)"""
+    return f"""
         user profile:
         - name: {user.name}
         - age: {user.age}
@@ -275,23 +532,32 @@ def analyze_symptoms() -> str:
         - 1 lifestyle tip, that aligns with the user's profile
         3. flag any urgent medical concerns, including the user's medication, existing conditions and allergies
 
-        return the analysis ONLY in this format:
-        [vitamin/mineral name] (no extra stuff):
-        - Why: [explanation]
-        - Foods: [comma-separated list]
-        - Tip: [actionable advice]
+        {answer_format}
+    """
+
+
+# The settings of the symptom analysis calls
+ANALYSIS_REQUEST = {
+    "model": "meta-llama/llama-4-scout-17b-16e-instruct",
+    "temperature": 0.7,
+    "max_completion_tokens": 1024,
+    "top_p": 1,
+    "stop": None,
+}
+
 
-        [Urgency Note]: (optional)
+def groq_symptom_analysis(user: UserProfile, symptoms: str) -> str:
     """
+    Sends the user's profile and symptoms to the Groq API and returns a text response.
 
+    :param user: The user profile.
+    :param symptoms: The normalized symptoms.
+    :return: Textual analysis from Groq LLM, or None if the call failed.
+    """
     try:
-        response = client.chat.completions.create(
-            model="meta-llama/llama-4-scout-17b-16e-instruct",
-            messages=[{"role": "user", "content": ai_prompt}],
-            temperature=0.7,
-            max_completion_tokens=1024,
-            top_p=1,
-            stop=None,
+        response = groq_chat(
+            messages=[{"role": "user", "content": symptom_prompt(user, symptoms)}],
+            **ANALYSIS_REQUEST,
         )
         print(response.choices[0].message.content)
         return response.choices[0].message.content
@@ -299,6 +565,88 @@ def analyze_symptoms() -> str:
         print("Groq API failed:", e)
 
 
+def groq_symptom_analysis_stream(user: UserProfile, symptoms: str) -> Iterator[str]:
+    """
+    Sends the user's profile and symptoms to the Groq API as a streamed completion,
+    and yields the text of the analysis while the model writes it.
+
+    :param user: The user profile.
+    :param symptoms: The normalized symptoms.
+    :return: The parts of the analysis. An error of the Groq call is raised.
+    """
+    # A stream belongs to one caller, so it does not go through groq_chat
+    stream = client.chat.completions.create(
+        messages=[{"role": "user", "content": symptom_prompt(user, symptoms)}],
+        stream=True,
+        **ANALYSIS_REQUEST,
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def groq_structured_analysis(user: UserProfile, symptoms: str) -> Dict[str, Any]:
+    """
+    Asks Groq in JSON mode for the analysis of the user's profile and symptoms,
+    so the recommendations get the deficiencies without scraping text.
+
+    :param user: The user profile.
+    :param symptoms: The normalized symptoms.
+    :return: The analysis as validated by SymptomAnalysis, or None if the call failed or the answer is not valid.
+    """
+    try:
+        response = groq_chat(
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are a nutrition analysis API that responds strictly in JSON.",
+                },
+                {"role": "user", "content": symptom_prompt(user, symptoms, structured=True)},
+            ],
+            response_format={"type": "json_object"},
+            **ANALYSIS_REQUEST,
+        )
+        analysis = SymptomAnalysis.model_validate_json(response.choices[0].message.content)
+        return analysis.model_dump()
+    except ValidationError as e:
+        print("Groq answered an invalid analysis:", e)
+    except Exception as e:
+        print("Groq API failed:", e)
+
+
+def structured_symptom_analysis(user: UserProfile) -> SymptomAnalysis:
+    """
+    Returns the structured analysis of the symptoms in the query parameters for the user,
+    asked from Groq at most once per symptoms and profile. Its text is kept for the results page.
+
+    :param user: The user profile.
+    :return: The analysis, or None if Groq failed.
+    """
+    symptoms = requested_symptoms()
+    session["last_symptoms"] = symptoms
+    structured = symptom_analyses.get(user, symptoms, STRUCTURED)
+    if structured is None:
+        return None
+    analysis = SymptomAnalysis.model_validate(structured)
+    if symptom_analyses.cached(user, symptoms) is None:
+        symptom_analyses.put(user, symptoms, analysis.to_text())
+    return analysis
+
+
+# The analyses are kept per (symptoms, profile fingerprint) in memory and in the user profiles.
+# profile() forgets them when a field of the prompt changes.
+symptom_analyses = SymptomAnalyses(
+    groq_symptom_analysis,
+    lambda user: users_data.save_user(user),
+    analyze_stream=groq_symptom_analysis_stream,
+    analyze_structured=groq_structured_analysis,
+)
+
+# With STREAM_ANALYSIS on (the default), a new analysis is streamed to the results page while Groq writes it,
+# instead of the page waiting for the complete analysis. STREAM_ANALYSIS=0 turns this off.
+app.config["STREAM_ANALYSIS"] = os.getenv("STREAM_ANALYSIS", "1") != "0"
+
+
 def extract_deficiency_keywords(text: str) -> List[str]:
     """
     Returns a list of nutrient or vitamin names found at the start of lines in the LLM response.
@@ -349,68 +697,23 @@ def extract_deficiency_keywords(text: str) -> List[str]:
     return deficiencies
 
 
-def vitamin_intake(deficiencies: List[str]) -> Dict[str, Dict[str, int]]:
+def vitamin_intake(
+    deficiencies: List[str], user: UserProfile = None
+) -> Dict[str, Dict[str, Union[int, float]]]:
     """
-    Asks the Groq LLM for recommended minimum daily intake (in mg) for given nutrient deficiencies.
+    Returns the minimum amount a recommended recipe should have of every deficient nutrient,
+    from the intake target table (data/intake_targets.json) for the user's age and sex.
 
-    The result is structured in JSON with key-value pairs like:
+    The result has key-value pairs like:
     { "vitamin_a": { "minVitaminA": 10 }, ... }
 
-    :param deficiencies: List of nutrient names to query.
-    :return: Dictionary mapping each nutrient to its recommended intake.
+    :param deficiencies: List of nutrient names.
+    :param user: The user profile, adult targets are used without one.
+    :return: Dictionary mapping each nutrient to its search parameter, nutrients without a target are left out.
     """
-
-    if not deficiencies:
-        return {}
-
-    # Construct prompt for nutrient intake suggestion
-    prompt = f"""
-    for each of the following nutrients/vitamins, suggest a minimum daily amount (in mg) to consume when mildly lacking it. the maximum amount cannot exceed 100 mg,
-    in this JSON format: 
-    {{
-        "vitamin_a": {{ "minVitaminA": 5 }},
-        "zinc": {{ "minZinc": 10 }}
-    }}
-
-    nutrients/vitamins: {", ".join(str(d) for d in deficiencies)}
-    rule: only do it in the exameple format provided above.
-
-    """
-    try:
-        response = client.chat.completions.create(
-            model="meta-llama/llama-4-scout-17b-16e-instruct",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a nutrition analysis API that responds strictly in JSON.",
-                },
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.7,
-            max_completion_tokens=1024,
-            top_p=1,
-            stop=None,
-            response_format={"type": "json_object"},
-        )
-
-        # Parse and sanitize output from LLM
-        uncleaned_data = json.loads(response.choices[0].message.content)
-
-        cleaned = {
-            nutrient_name: {
-                min_amount_key: int(val)
-                for min_amount_key, val in nutrient_data.items()
-                if isinstance(val, (int, float, str)) and str(val).isdigit()
-            }
-            for nutrient_name, nutrient_data in uncleaned_data.items()
-            if isinstance(nutrient_data, dict)
-        }
-
-        return cleaned
-
-    except Exception as e:
-        print("Groq API failed:", e)
-        return {}
+    return intake_targets.lookup(
+        deficiencies, getattr(user, "age", None), getattr(user, "sex", None)
+    )
 
 
 # helper to function extract foods from the groq response
@@ -423,6 +726,8 @@ def extract_food_recs() -> List[str]:
         analysis_text = analyze_symptoms()
     except Exception as e:
         print("Groq API failed:", e)
+        analysis_text = None
+    if not analysis_text:
         # fallback: use common vitamins and foods
         return ["vitamin c", "iron"], ["broccoli", "spinach", "orange"]
 
@@ -450,29 +755,62 @@ def display_results() -> Union[str, Response]:
     if not user:
         return redirect(url_for("auth_page"))
     form = SearchForm()
-    analysis = analyze_symptoms()
-    # if we already analyzed the symptom previously, then no need to call groq again
-    # just serve the result from the database
-    symptoms = request.args.get("symptoms")
-    past_analysis = user.symptom_analysis
-    if symptoms in past_analysis:
+    # if we already analyzed the symptoms previously, the analysis is served from memory or the database,
+    # otherwise groq is asked once and the analysis is stored for later use
+    symptoms = requested_symptoms()
+    streaming = app.config["STREAM_ANALYSIS"] and request.args.get("stream") != "0"
+    if streaming and symptom_analyses.cached(user, symptoms) is None:
+        # the page is sent right away and fetches the analysis from /results/stream while groq writes it
+        session["last_symptoms"] = symptoms
         return render_template(
-            "results.html",
-            symptoms=symptoms,
-            analysis=past_analysis[symptoms]["analyse"],
-            form=form,
+            "results.html", symptoms=symptoms, analysis="", streaming=True, form=form
         )
-    analysis = analyze_symptoms()
-
-    # store the analysis result to database for later use
-    # we don't want to call groq over and over again for the same symptoms
-    user.symptom_analysis[symptoms] = {"analyse": analysis}
-    users_data.save_to_file()
+    # a failed analysis is shown as an empty page and asked again on the next view
+    analysis = analyze_symptoms(user) or ""
     return render_template(
         "results.html", symptoms=symptoms, analysis=analysis, form=form
     )
 
 
+@app.route("/results/stream")
+def stream_results() -> Response:
+    """
+    Streams the groq llm analysis of the symptoms as server-sent events while groq writes it.
+    Every "message" event holds the next part of the text as a JSON string, and the stream ends with a
+    "done" event, or an "error" event if groq failed. The complete analysis is stored like the one of /results.
+
+    :return: The event stream, or a 401 response if the user is not logged in.
+    """
+    user = userAuthHelper()
+    if not user:
+        return Response("Not logged in", status=401)
+    symptoms = requested_symptoms()
+    session["last_symptoms"] = symptoms
+
+    def events() -> Iterator[str]:
+        failed = json.dumps("The analysis failed, please try again.")
+        empty = True
+        try:
+            for part in symptom_analyses.stream(user, symptoms):
+                empty = False
+                yield f"data: {json.dumps(part)}\n\n"
+        except Exception as e:
+            print("Groq API failed:", e)
+            empty = True
+        # the page loads the stored analysis after "done", so an empty analysis is an error
+        if empty:
+            yield f"event: error\ndata: {failed}\n\n"
+        else:
+            yield "event: done\ndata: {}\n\n"
+
+    # no-cache and X-Accel-Buffering keep proxies from holding the events back
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/recommendations")
 def recommendations() -> Union[str, Response]:
     """
@@ -491,26 +829,25 @@ def recommendations() -> Union[str, Response]:
 
     # return early if we already had meal recommendations for the given symptom
     # this allows us to reduce the spoonacular usage, which should allow us to not run out of daily request limits
-    symptoms = request.args.get("symptoms")
+    symptoms = requested_symptoms()
     previously_analyzed_symptoms = logged_in_user.symptom_analysis
-    found_symptom = {}
-    if symptoms in previously_analyzed_symptoms:
-        found_symptom = previously_analyzed_symptoms[symptoms]
+    found_symptom = previously_analyzed_symptoms.get(symptoms, {})
 
     if "recommended_meals" in found_symptom:
-        meal_recipes = previously_analyzed_symptoms[symptoms]["recommended_meals"][
-            "meals"
-        ]
+        meal_recipes = found_symptom["recommended_meals"]["meals"]
         return render_template("recipes.html", recipes_by_meal=meal_recipes, form=form)
 
+    # one groq call gives the deficiencies, and their minimum amounts come from the intake target table
     try:
-        analysis_text = analyze_symptoms()
+        analysis = structured_symptom_analysis(logged_in_user)
     except Exception as e:
         print("Error analyzing symptoms:", e)
-        analysis_text = ""
+        analysis = None
 
-    deficiencies = extract_deficiency_keywords(analysis_text)
-    min_nutrients: Dict[str, Dict[str, int]] = vitamin_intake(deficiencies)
+    deficiencies = [d.nutrient for d in analysis.deficiencies] if analysis else []
+    min_nutrients: Dict[str, Dict[str, int]] = vitamin_intake(
+        deficiencies, logged_in_user
+    )
 
     diet = logged_in_user.diet
     intolerance = ",".join(logged_in_user.allergies)
@@ -522,17 +859,15 @@ def recommendations() -> Union[str, Response]:
         "dinner": ["main course", "side dish", "appetizer"],
     }
 
-    meal_recipes = {}
-
     min_nutrient_params = []
     for nutrient_dict in min_nutrients.values():
         min_nutrient_params.append(nutrient_dict)
 
     nutrient_index = 0
 
-    # Loop through each meal category and fetch recipes
+    # Build the search of every meal category and dish type, rotating through the nutrient parameters
+    searches = []
     for category in category_to_types:
-        collected_recipes = []
         types = category_to_types.get(category, [category])
 
         for t in types:
@@ -541,50 +876,88 @@ def recommendations() -> Union[str, Response]:
                 "excludeIngredients": intolerance,
                 "type": t,
                 "number": 3,
-                "apiKey": spoonacular_api_key,
+                # The nutrition comes with the results, so the meal planner needs no extra calls
+                "addRecipeNutrition": True,
             }
             if min_nutrient_params:
                 nutrient_params = min_nutrient_params[nutrient_index]
                 nutrient_index = (nutrient_index + 1) % len(min_nutrient_params)
                 params.update(nutrient_params)
-            else:
-                nutrient_params = {}
 
-            try:
-                response = requests.get(
-                    "https://api.spoonacular.com/recipes/complexSearch", params=params
-                )
-                data = response.json()
-                collected_recipes.extend(data.get("results", []))
+            searches.append((category, t, params))
+
+    # Searches that the stored recipes can answer are answered locally. Of the others, the searches that
+    # any user ran recently come from the search cache, and the rest run at the same time.
+    # The results come back in the order of the searches
+    results = [query_engine.search(params) for _, _, params in searches]
+    remote = [i for i, result in enumerate(results) if result is None]
+    if remote:
+        fetched = search_cache.get_many(
+            [searches[i][2] for i in remote], run_nutrition_searches
+        )
+        for i, result in zip(remote, fetched):
+            results[i] = result
 
-            except Exception as e:
-                print(f"Error fetching {category} ({t}):", e)
+    collected_recipes = {category: [] for category in category_to_types}
+    for (category, t, _), data in zip(searches, results):
+        if isinstance(data, Exception):
+            print(f"Error fetching {category} ({t}):", data)
+            continue
+        collected_recipes[category].extend(data.get("results", []))
 
-        # fallback logic removed to avoid unrelated random recipes
-        unique = {r["id"]: r for r in collected_recipes}
+    # fallback logic removed to avoid unrelated random recipes
+    meal_recipes = {}
+    for category, recipes in collected_recipes.items():
+        unique = {r["id"]: r for r in recipes}
         meal_recipes[category] = list(unique.values())
 
+    # stored next to the analysis of the same symptoms, which analyze_symptoms may have just added
+    found_symptom = logged_in_user.symptom_analysis.setdefault(symptoms, {})
     found_symptom["recommended_meals"] = {"meals": meal_recipes}
-    logged_in_user.symptom_analysis[symptoms] = found_symptom
-    users_data.save_to_file()
+    users_data.save_user(logged_in_user)
 
     return render_template("recipes.html", recipes_by_meal=meal_recipes)
 
 
+@app.route("/image")
+def image_proxy() -> Response:
+    """
+    Serves a Spoonacular recipe image in a smaller size from the image cache,
+    with a long cache lifetime and an ETag so browsers can revalidate it cheaply.
+
+    :return: The image, a 400 response for images that are not proxied,
+        or a redirect to the original image if it could not be fetched.
+    """
+    url = request.args.get("url", "")
+    size = request.args.get("size", "312x231")
+    try:
+        cached = image_cache.get(url, size)
+    except ValueError as e:
+        return str(e), 400
+    if cached is None:
+        return redirect(url)
+    path, content_type = cached
+    return send_file(
+        os.path.abspath(path),
+        mimetype=content_type,
+        max_age=IMAGE_MAX_AGE,
+        conditional=True,
+        etag=True,
+    )
+
+
 # display recipe details
 @app.route("/recipe/<recipe_id>")
 def recipe_details(recipe_id) -> str:
     """
-    Fetches and displays detailed recipe information from the Spoonacular API.
+    Fetches and displays detailed recipe information from the recipe cache or the Spoonacular API.
 
     :param recipe_id: The ID of the recipe to display
     :return: Rendered HTML with full recipe info including nutrition
     """
-    response = requests.get(
-        f"https://api.spoonacular.com/recipes/{recipe_id}/information",
-        params={"apiKey": spoonacular_api_key, "includeNutrition": True},
-    )
-    recipe_info = response.json()
+    recipe_info = recipe_cache.get(recipe_id, include_nutrition=True)
+    if recipe_info is None:
+        return "Recipe not found", 404
     return render_template("recipe_details.html", recipe=recipe_info)
 
 
@@ -612,7 +985,6 @@ def spoonacular_builtin_mealplanner() -> Union[str, Response]:
 
         # Base parameters
         params = {
-            "apiKey": spoonacular_api_key,
             "timeFrame": time_frame,
             "diet": user.diet,
             "exclude": ",".join(user.allergies),
@@ -633,41 +1005,35 @@ def spoonacular_builtin_mealplanner() -> Union[str, Response]:
             params["targetCalories"] = calories
 
         # Make API call
-        response = requests.get(
-            "https://api.spoonacular.com/mealplanner/generate", params=params
-        )
-        if response.status_code == 200:
+        try:
+            response = spoonacular.generate_mealplan(params)
+        except requests.RequestException as e:
+            print("Error generating meal plan:", e)
+            response = None
+        if response is not None and response.status_code == 200:
             mealplan = response.json()
-            # Add images and readyInMinutes for each meal
+            # Add images and readyInMinutes for each meal, fetched together for the whole plan.
+            # The plan is usable without them, so they are fetched as background work.
             if "meals" in mealplan:
                 # Day plan
-                for meal in mealplan["meals"]:
-                    recipe_id = meal["id"]
-                    info_resp = requests.get(
-                        f"https://api.spoonacular.com/recipes/{recipe_id}/information",
-                        params={"apiKey": spoonacular_api_key},
-                    )
-                    if info_resp.status_code == 200:
-                        info = info_resp.json()
-                        meal["image"] = info.get("image")
-                        meal["readyInMinutes"] = info.get("readyInMinutes")
+                meals = mealplan["meals"]
             elif "week" in mealplan:
                 # Week plan
-                for day, data in mealplan["week"].items():
-                    for meal in data["meals"]:
-                        recipe_id = meal["id"]
-                        info_resp = requests.get(
-                            f"https://api.spoonacular.com/recipes/{recipe_id}/information",
-                            params={"apiKey": spoonacular_api_key},
-                        )
-                        if info_resp.status_code == 200:
-                            info = info_resp.json()
-                            meal["image"] = info.get("image")
-                            meal["readyInMinutes"] = info.get("readyInMinutes")
+                meals = [
+                    meal for data in mealplan["week"].values() for meal in data["meals"]
+                ]
+            else:
+                meals = []
+            with spoonacular.limiter.prioritized(BACKGROUND):
+                infos = recipe_cache.get_many([meal["id"] for meal in meals])
+            for meal, info in zip(meals, infos):
+                if info is not None:
+                    meal["image"] = info.get("image")
+                    meal["readyInMinutes"] = info.get("readyInMinutes")
             user.mealplan = mealplan
             print("spoonacular response mealplan")
             print(user.mealplan)
-            users_data.save_to_file()
+            users_data.save_user(user)
             return redirect(url_for("edit_meal_planner"))
 
         else:
@@ -736,20 +1102,22 @@ def meal_planner() -> Union[str, Response]:
         print("selected_meals")
         print(selected_meals)
 
-        # Loop through selected recipe IDs and fetch their details
-        for recipe_id in selected_meals:
+        # Recipes from the recommendations have their nutrient summary stored already,
+        # the details of the other selected recipes are fetched together
+        recipe_infos = recipe_cache.get_many(
+            selected_meals, include_nutrition=True, summary_ok=True
+        )
+        for recipe_id, recipe_info in zip(selected_meals, recipe_infos):
             print(f"id = {recipe_id}")
-            response = requests.get(
-                f"https://api.spoonacular.com/recipes/{recipe_id}/information",
-                params={"apiKey": spoonacular_api_key, "includeNutrition": True},
-            )
-            recipe_info = response.json()
+            # Recipes whose nutrition could not be fetched can not be added up
+            if recipe_info is None or not isinstance(recipe_info.get("nutrition"), dict):
+                continue
             print("recipe_info")
             print(recipe_info)
             meal_plan["meals"].append(recipe_info)
 
             # Sum nutritional values for calories, protein, fat
-            for nutrient in recipe_info["nutrition"]["nutrients"]:
+            for nutrient in recipe_info["nutrition"].get("nutrients", []):
                 if nutrient["name"].lower() in nutrients_to_check:
                     meal_plan["nutrients"][nutrient["name"].lower()] += nutrient[
                         "amount"
@@ -757,7 +1125,7 @@ def meal_planner() -> Union[str, Response]:
 
         # Save plan to user's profile
         user.mealplan = meal_plan
-        users_data.save_to_file()
+        users_data.save_user(user)
 
         return redirect(url_for("edit_meal_planner"))
 
@@ -818,7 +1186,7 @@ def save_favorite(recipe_id: str) -> Union[str, Response]:
     else:
         # Save and persist to file
         user.saved_recipes.append(recipe_id)
-        users_data.save_to_file()
+        users_data.save_user(user)
         # return redirect(request.referrer or url_for("recommendations"))
         return "OK", 200
 
@@ -838,7 +1206,7 @@ def remove_favorite(recipe_id: str) -> Union[str, Response]:
     recipe_id = int(recipe_id)
     if recipe_id in user.saved_recipes:
         user.saved_recipes.remove(recipe_id)
-        users_data.save_to_file()
+        users_data.save_user(user)
         return "OK", 200
     return "Not exists", 401
 
@@ -856,15 +1224,12 @@ def show_favorites() -> Union[str, Response]:
 
     form = SearchForm()
 
-    recipes = []
-    # Fetch recipe details for each saved ID
-    for recipe_id in user.saved_recipes:
-        response = requests.get(
-            f"https://api.spoonacular.com/recipes/{recipe_id}/information",
-            params={"apiKey": spoonacular_api_key},
-        )
-        if response.ok:
-            recipes.append(response.json())
+    # Fetch the details of all saved recipes together
+    recipes = [
+        recipe_info
+        for recipe_info in recipe_cache.get_many(user.saved_recipes)
+        if recipe_info is not None
+    ]
 
     return render_template("favorites.html", recipes=recipes, form=form)
 
@@ -887,6 +1252,33 @@ def show_history() -> Union[str, Response]:
     )
 
 
+@app.route("/metrics")
+def metrics() -> Response:
+    """
+    Shows the internal counters of the app, for example how many saves were merged into one write.
+    Only logged in users can see them, like the other pages with data of the app.
+
+    :return: JSON response with the counters, or a redirect to the login page.
+    """
+    if not userAuthHelper():
+        return redirect(url_for("auth_page"))
+    return jsonify(
+        {
+            "users_data": getattr(users_data, "stats", {}),
+            "recipe_cache": recipe_cache.stats,
+            "search_cache": search_cache.stats,
+            "query_engine": query_engine.stats,
+            "spoonacular_quota": spoonacular.limiter.stats,
+            "image_cache": image_cache.stats,
+            "symptom_analyses": symptom_analyses.stats,
+            "coalesced_calls": {
+                "spoonacular": spoonacular.flight.stats,
+                "groq": groq_flight.stats,
+            },
+        }
+    )
+
+
 def get_nutrient_info() -> Dict[str, Any]:
     """
     Gets the information from nutrient_info.json file
@@ -988,6 +1380,8 @@ def profile() -> Union[str, Response]:
         if error:
             return render_template("profile.html", user=user, message=error)
 
+        # The analyses made for the old profile are forgotten if a field of the analysis prompt changed
+        old_fingerprint = profile_fingerprint(user)
         user.password = request.form.get("password")
         user.name = request.form.get("name")
         user.age = int(request.form.get("age"))
@@ -1002,9 +1396,10 @@ def profile() -> Union[str, Response]:
             ","
         )
         user.allergies = request.form.get("allergies", "").split(",")
+        symptom_analyses.invalidate(user, old_fingerprint)
 
         # Saves the updated data to the users data file.
-        users_data.save_to_file()
+        users_data.save_user(user)
 
         message: str = "Profile updated!"
         return render_template("profile.html", user=user, message=message, form=form)
@@ -0,0 +1,61 @@
+### benchmark for the storage codecs ###
+# Run from the repository root with: python backend/benchmarks/bench_codecs.py
+# Scales up a copy of users.json and prints the load time, save time and file size of every codec.
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add the backend directory to the Python path, the same way the tests do.
+sys.path.append(str(Path(__file__).parent.parent))
+
+from storage_codec import CODECS, get_codec, read_records
+
+USERS_FILE = Path(__file__).parent.parent / "user_data" / "users.json"
+COPIES = 40
+ROUNDS = 3
+
+
+def scaled_users(copies: int):
+    """
+    Returns the users of users.json, copied under new usernames until there are `copies` times as many.
+    """
+    users = read_records(str(USERS_FILE))
+    return {
+        f"{username}_{copy}": {**record, "username": f"{username}_{copy}"}
+        for copy in range(copies)
+        for username, record in users.items()
+    }
+
+
+def main() -> None:
+    records = scaled_users(COPIES)
+    print(f"{len(records)} users")
+    print(f"{'codec':<10}{'size (KB)':>12}{'save (ms)':>12}{'load (ms)':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name in CODECS:
+            try:
+                codec = get_codec(name)
+            except ValueError:
+                print(f"{name:<10}{'not installed':>36}")
+                continue
+            path = os.path.join(directory, f"users.{name}")
+
+            start = time.perf_counter()
+            for _ in range(ROUNDS):
+                with open(path, "wb") as file:
+                    file.write(codec.encode(records))
+            save_ms = (time.perf_counter() - start) / ROUNDS * 1000
+
+            start = time.perf_counter()
+            for _ in range(ROUNDS):
+                read_records(path)
+            load_ms = (time.perf_counter() - start) / ROUNDS * 1000
+
+            size_kb = os.path.getsize(path) / 1024
+            print(f"{name:<10}{size_kb:>12.0f}{save_ms:>12.1f}{load_ms:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+### benchmark for the cold start of the user storage engines ###
+# Run from the repository root with: python backend/benchmarks/bench_cold_start.py
+# Prints the time to open the storage and look up one user, and the memory that stays allocated afterwards,
+# for the JSON engine and the indexed engine (with the index already saved) for a growing number of users.
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+# Add the backend directory to the Python path, the same way the tests do.
+sys.path.append(str(Path(__file__).parent.parent))
+
+from storage_codec import get_codec
+from user_data.user_profile import UsersData
+from user_data.indexed_store import IndexedUsersData
+from bench_users_storage import make_user
+
+USER_COUNTS = [1000, 10000, 20000]
+
+
+def cold_start(storage_class, file_path: str):
+    """
+    Opens the storage and looks up a single user.
+    :return: (milliseconds, bytes still allocated by the storage)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    storage = storage_class(file_path)
+    storage.get_user("user0").saved_recipes
+    elapsed = time.perf_counter() - start
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    if hasattr(storage, "close"):
+        storage.close()
+    return elapsed * 1000, allocated
+
+
+def main() -> None:
+    print(f"{'engine':<20}{'codec':<9}{'users':>8}{'start (ms)':>12}{'memory (MB)':>13}")
+    with tempfile.TemporaryDirectory() as directory:
+        for user_count in USER_COUNTS:
+            records = {f"user{i}": make_user(i).to_dict() for i in range(user_count)}
+            for codec in ("json", "records"):
+                file_path = os.path.join(directory, f"users_{user_count}.{codec}")
+                with open(file_path, "wb") as file:
+                    file.write(get_codec(codec).encode(records))
+                # Builds and saves the index, the measured start reuses it
+                IndexedUsersData(file_path).close()
+                for storage_class in (UsersData, IndexedUsersData):
+                    ms, allocated = cold_start(storage_class, file_path)
+                    print(
+                        f"{storage_class.__name__:<20}{codec:<9}{user_count:>8}{ms:>12.1f}{allocated / 1e6:>13.1f}"
+                    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+### benchmark for loading recipes into MealsData ###
+# Run from the repository root with: python backend/benchmarks/bench_meals_bulk.py
+# Loads several thousand recipes one by one with add_meal and in one batch with add_meals,
+# and prints the bytes written and the time it took.
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add the backend directory to the Python path, the same way the tests do.
+sys.path.append(str(Path(__file__).parent.parent))
+
+from storage_codec import read_records
+from meal_data import Meal, MealsData
+
+MEALS_FILE = Path(__file__).parent.parent / "meal_data" / "meals_database.json"
+RECIPE_COUNTS = [200, 500, 5000]
+# Adding recipes one by one rewrites the whole file every time, so it is only measured for the smaller counts
+ONE_BY_ONE_MAX = 500
+
+
+def make_meals(count: int):
+    """
+    Returns `count` meals, copies of the meals in meals_database.json with new ids.
+    """
+    records = list(read_records(str(MEALS_FILE)).values())
+    return [
+        Meal(**{**records[i % len(records)], "id": 1_000_000 + i}) for i in range(count)
+    ]
+
+
+def one_by_one(meals_data: MealsData, meals):
+    """
+    Adds the meals with add_meal. :return: the number of bytes written.
+    """
+    written = 0
+    for meal in meals:
+        meals_data.add_meal(meal)
+        written += os.path.getsize(meals_data.file_path)
+    return written
+
+
+def in_one_batch(meals_data: MealsData, meals):
+    """
+    Adds the meals with add_meals. :return: the number of bytes written.
+    """
+    meals_data.add_meals(meals)
+    return os.path.getsize(meals_data.file_path)
+
+
+def main() -> None:
+    print(f"{'method':<12}{'recipes':>9}{'written (MB)':>14}{'time (s)':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for count in RECIPE_COUNTS:
+            meals = make_meals(count)
+            for name, load in (("add_meal", one_by_one), ("add_meals", in_one_batch)):
+                if load is one_by_one and count > ONE_BY_ONE_MAX:
+                    continue
+                meals_data = MealsData(os.path.join(directory, f"{name}_{count}.json"))
+                start = time.perf_counter()
+                written = load(meals_data, meals)
+                elapsed = time.perf_counter() - start
+                print(f"{name:<12}{count:>9}{written / 1e6:>14.1f}{elapsed:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+### benchmark for the memory of loaded user profiles and meals ###
+# Run from the repository root with: python backend/benchmarks/bench_memory.py
+# Builds 100k user profiles and 100k meals and prints the memory per object, measured with tracemalloc,
+# next to the same objects with a per-object __dict__ as the classes had before they used slots.
+# The field values are shared between all objects, so only the objects themselves are measured.
+import sys
+import tracemalloc
+from pathlib import Path
+
+# Add the backend directory to the Python path, the same way the tests do.
+sys.path.append(str(Path(__file__).parent.parent))
+
+from storage_codec import read_records
+from user_data import UserProfile
+from meal_data import Meal
+
+USERS_FILE = Path(__file__).parent.parent / "user_data" / "users.json"
+MEALS_FILE = Path(__file__).parent.parent / "meal_data" / "meals_database.json"
+COUNT = 100_000
+
+
+class DictObject:
+    """
+    An object that stores its fields in a per-object __dict__, used for comparison.
+    """
+
+
+def dict_object(record):
+    obj = DictObject()
+    for field, value in record.items():
+        setattr(obj, field, value)
+    return obj
+
+
+def measure(build) -> float:
+    """
+    Returns the number of bytes allocated per object while building COUNT objects.
+    """
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    objects = [build(i) for i in range(COUNT)]
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del objects
+    return used / COUNT
+
+
+def main() -> None:
+    user_record = next(iter(read_records(str(USERS_FILE)).values()))
+    meal_record = next(iter(read_records(str(MEALS_FILE)).values()))
+
+    rows = [
+        ("UserProfile (slots)", lambda i: UserProfile.from_dict(user_record)),
+        ("UserProfile (__dict__)", lambda i: dict_object(user_record)),
+        ("Meal (slots)", lambda i: Meal(**meal_record)),
+        ("Meal (__dict__)", lambda i: dict_object(meal_record)),
+    ]
+    print(f"{COUNT} objects each")
+    print(f"{'object':<24}{'bytes/object':>14}{'total (MB)':>12}")
+    for name, build in rows:
+        per_object = measure(build)
+        print(f"{name:<24}{per_object:>14.0f}{per_object * COUNT / 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
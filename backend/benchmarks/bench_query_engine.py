@@ -0,0 +1,52 @@
+### benchmark for the offline recipe query engine ###
+# Run from the repository root with: python backend/benchmarks/bench_query_engine.py
+# Stores thousands of made up recipes (the ones of the stand-in server), and times building the indexes
+# and answering the nine searches of the recommendations page from them.
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add the backend directory to the Python path, the same way the tests do.
+sys.path.append(str(Path(__file__).parent.parent))
+
+from meal_data import Meal, MealsData, RecipeQueryEngine
+from stand_in import make_recipe
+
+# 5000 is the default maximum size of the recipe cache
+RECIPE_COUNTS = [500, 1000, 5000]
+ROUNDS = 100
+TYPES = ["breakfast", "bread", "snack", "main course", "salad", "soup", "main course", "side dish"]
+
+
+def main() -> None:
+    searches = [
+        {"diet": "vegetarian", "excludeIngredients": "egg", "type": t, "number": 3, "minIron": 5}
+        for t in TYPES
+    ]
+    print(f"{'recipes':<10}{'index build (ms)':>18}{'search (ms)':>14}{'answered':>10}")
+    for count in RECIPE_COUNTS:
+        with tempfile.TemporaryDirectory() as directory:
+            meals_data = MealsData(str(Path(directory) / "meals.json"))
+            meals_data.upsert_meals(
+                Meal.from_information(make_recipe(1000 + i, include_nutrition=True))
+                for i in range(count)
+            )
+            engine = RecipeQueryEngine(meals_data)
+
+            start = time.perf_counter()
+            engine.search(searches[0])
+            build = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            answered = 0
+            for _ in range(ROUNDS):
+                for params in searches:
+                    answered += engine.search(params) is not None
+            search = (time.perf_counter() - start) * 1000 / (ROUNDS * len(searches))
+
+            print(f"{count:<10}{build:>18.2f}{search:>14.3f}{answered // ROUNDS:>7}/{len(searches)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+### benchmark for the concurrent recommendation searches ###
+# Run from the repository root with: python backend/benchmarks/bench_recommendation_fanout.py
+# Starts the stand-in server with a fixed latency, and compares running the nine searches of
+# the recommendations page one after another with running them with search_many.
+import sys
+import time
+from pathlib import Path
+
+# Add the backend directory to the Python path, the same way the tests do.
+sys.path.append(str(Path(__file__).parent.parent))
+
+from spoonacular import SpoonacularClient
+from stand_in import start_server
+
+LATENCIES = [0.05, 0.2, 0.5]
+SEARCHES = 9
+ROUNDS = 3
+
+
+def main() -> None:
+    server = start_server()
+    spoonacular = SpoonacularClient("key", server.url)
+    searches = [{"type": f"type{i}", "number": 3} for i in range(SEARCHES)]
+
+    print(f"{'latency (s)':<13}{'sequential (s)':>16}{'concurrent (s)':>16}")
+    for latency in LATENCIES:
+        server.latency = latency
+
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            for params in searches:
+                spoonacular.search_recipes(params).json()
+        sequential = (time.perf_counter() - start) / ROUNDS
+
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            for response in spoonacular.search_many(searches):
+                response.json()
+        concurrent = (time.perf_counter() - start) / ROUNDS
+
+        print(f"{latency:<13}{sequential:>16.3f}{concurrent:>16.3f}")
+
+    spoonacular.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
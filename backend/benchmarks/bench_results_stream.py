@@ -0,0 +1,92 @@
+### benchmark for streaming the symptom analysis to the results page ###
+# Run from the repository root with: python backend/benchmarks/bench_results_stream.py
+# Points Groq to the stand-in server with a first-token latency and a delay between the streamed parts,
+# and compares the time to the first byte of the analysis with and without streaming.
+import contextlib
+import io
+import os
+import sys
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+# Add the backend directory to the Python path, the same way the tests do.
+sys.path.append(str(Path(__file__).parent.parent))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import app as app_module
+from groq import Groq
+from stand_in import start_server
+from symptom_analysis import SymptomAnalyses
+from user_data.user_profile import UserProfile, UsersData
+
+FIRST_TOKEN_LATENCY = 0.5
+TOKEN_DELAY = 0.02
+ROUNDS = 3
+
+
+def first_byte(client, url: str) -> tuple:
+    """
+    Returns the seconds to the first byte and to the last byte of a response.
+    """
+    # The app prints every analysis, which would hide the table
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        response = client.get(url, buffered=False)
+        chunks = iter(response.response)
+        next(chunks)
+        first = time.perf_counter() - start
+        for _ in chunks:
+            pass
+        response.close()
+    return first, time.perf_counter() - start
+
+
+def main() -> None:
+    server = start_server(latency=FIRST_TOKEN_LATENCY, token_delay=TOKEN_DELAY)
+    users_file = Path("bench_users.json")
+    users_data = UsersData(str(users_file))
+    users_data.add_user(
+        UserProfile("bench", "pw", "Bench", 30, "Female", 170.0, 60.0, "medium", "NL")
+    )
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+        sess["username"] = "bench"
+
+    print(f"{'mode':<12}{'first byte (s)':>16}{'complete (s)':>14}")
+    try:
+        with patch.object(app_module, "users_data", users_data), patch.object(
+            app_module, "client", Groq(api_key="benchmark", base_url=server.url)
+        ):
+            for mode in ("waiting", "streaming"):
+                firsts, totals = [], []
+                for i in range(ROUNDS):
+                    # A fresh memo and new symptoms, so every round asks Groq
+                    analyses = SymptomAnalyses(
+                        app_module.groq_symptom_analysis,
+                        users_data.save_user,
+                        analyze_stream=app_module.groq_symptom_analysis_stream,
+                    )
+                    with patch.object(app_module, "symptom_analyses", analyses):
+                        symptoms = f"tired {mode} {i}"
+                        if mode == "waiting":
+                            first, total = first_byte(
+                                client, f"/results?symptoms={symptoms}&stream=0"
+                            )
+                        else:
+                            first, total = first_byte(
+                                client, f"/results/stream?symptoms={symptoms}"
+                            )
+                    firsts.append(first)
+                    totals.append(total)
+                print(f"{mode:<12}{min(firsts):>16.3f}{min(totals):>14.3f}")
+    finally:
+        server.shutdown()
+        for path in (users_file, Path(str(users_file) + ".lock")):
+            if path.exists():
+                path.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+### benchmark for the user profile storage engines ###
+# Run from the repository root with: python backend/benchmarks/bench_users_storage.py
+# Prints the bytes written and the latency of a single save_favorite-style mutation for a growing number of users.
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add the backend directory to the Python path, the same way the tests do.
+sys.path.append(str(Path(__file__).parent.parent))
+
+from user_data.user_profile import UserProfile, UsersData
+from user_data.journal import JournaledUsersData
+
+USER_COUNTS = [10, 100, 1000, 5000]
+MUTATIONS = 50
+
+
+def make_user(index: int) -> UserProfile:
+    """
+    Creates a synthetic user profile with a small meal plan and analysis history.
+    :param index (int): The number of the user, used to make the username unique.
+    :return (UserProfile): The synthetic user profile.
+    """
+    user = UserProfile(
+        f"user{index}",
+        "password",
+        "Bench User",
+        30,
+        "female",
+        170.0,
+        65.0,
+        "medium",
+        "The Netherlands",
+        [],
+        "vegetarian",
+        [],
+        [],
+    )
+    user.saved_recipes = [index, index + 1]
+    user.mealplan = {"meals": [{"id": i, "title": "meal " * 20} for i in range(20)]}
+    user.symptom_analysis = {"fatigue": {"analyse": "lack of iron " * 100}}
+    return user
+
+
+def disk_bytes(*paths: str) -> int:
+    """
+    Returns the combined size of the given files, missing files count as zero.
+    """
+    return sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+
+
+def bench(storage_class, user_count: int, directory: str):
+    """
+    Fills a storage engine with users and measures single-profile mutations.
+    :return: (bytes written per mutation, milliseconds per mutation)
+    """
+    file_path = os.path.join(directory, f"{storage_class.__name__}_{user_count}.json")
+    users = {f"user{i}": make_user(i) for i in range(user_count)}
+    with open(file_path, "w") as file:
+        json.dump({u: p.to_dict() for u, p in users.items()}, file, indent=2)
+
+    storage = storage_class(file_path)
+    journal_path = getattr(storage, "journal_path", None)
+
+    bytes_written = 0
+    start = time.perf_counter()
+    for i in range(MUTATIONS):
+        user = storage.get_user(f"user{i % user_count}")
+        before = disk_bytes(journal_path) if journal_path else 0
+        user.saved_recipes.append(100000 + i)
+        storage.save_user(user)
+        if journal_path:
+            bytes_written += disk_bytes(journal_path) - before
+        else:
+            bytes_written += disk_bytes(file_path)
+    elapsed = time.perf_counter() - start
+    return bytes_written / MUTATIONS, elapsed / MUTATIONS * 1000
+
+
+def main() -> None:
+    print(f"{'engine':<22}{'users':>8}{'bytes/mutation':>18}{'ms/mutation':>14}")
+    with tempfile.TemporaryDirectory() as directory:
+        for user_count in USER_COUNTS:
+            for storage_class in (UsersData, JournaledUsersData):
+                written, latency = bench(storage_class, user_count, directory)
+                print(
+                    f"{storage_class.__name__:<22}{user_count:>8}{written:>18.0f}{latency:>14.3f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+### on-disk cache of recipe image thumbnails ###
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+import hashlib
+import os
+import re
+import threading
+import time
+
+import requests
+
+from single_flight import SingleFlight
+from user_data.file_lock import write_atomic
+
+# Only images of these hosts are fetched, so the proxy can not be used to fetch other URLs
+ALLOWED_HOSTS = ("img.spoonacular.com", "spoonacular.com")
+# The sizes in which Spoonacular serves every recipe image, from small to large
+SIZES = ("90x90", "240x150", "312x150", "312x231", "480x360", "556x370", "636x393")
+CONTENT_TYPES = {"jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png", "gif": "image/gif"}
+# Recipe images look like https://img.spoonacular.com/recipes/716429-556x370.jpg
+RECIPE_IMAGE = re.compile(r"(?P<prefix>/recipes/\d+)-(?:\d+x\d+)\.(?P<ext>jpg|jpeg|png|gif)$")
+
+
+def is_allowed(url: str) -> bool:
+    """
+    Checks whether an image URL is an https URL of a Spoonacular image host.
+    :param url (str): The image URL.
+    :return (bool): True if the image may be fetched.
+    """
+    parts = urlsplit(url)
+    return parts.scheme == "https" and parts.hostname in ALLOWED_HOSTS
+
+
+def thumbnail_url(url: str, size: str) -> Tuple[str, str]:
+    """
+    Returns the URL of an image in another size, using the sizes in which Spoonacular serves recipe images.
+    Other images are used as they are. Raises ValueError for an unknown size.
+    :param url (str): The image URL.
+    :param size (str): One of SIZES.
+    :return (Tuple[str, str]): The URL of the image in that size, and its file extension.
+    """
+    if size not in SIZES:
+        raise ValueError(f"Unknown image size {size!r}")
+    parts = urlsplit(url)
+    match = RECIPE_IMAGE.search(parts.path)
+    if match is None:
+        extension = os.path.splitext(parts.path)[1].lstrip(".").lower()
+        return url, extension if extension in CONTENT_TYPES else "jpg"
+    path = f"{match.group('prefix')}-{size}.{match.group('ext')}"
+    return f"https://{parts.hostname}{path}", match.group("ext")
+
+
+class ImageCache:
+    """
+    Cache of recipe images on disk. Every image is fetched once per size from Spoonacular and then served from
+    `cache_dir`, which holds at most `max_bytes`; the least recently served images are removed first.
+    A cached file never changes, so its modification time and size make a stable ETag.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = "backend/meal_data/images",
+        max_bytes: int = 200 * 1024 * 1024,
+        max_image_bytes: int = 5 * 1024 * 1024,
+        timeout: Tuple[float, float] = (3.05, 10),
+    ) -> None:
+        """
+        Initializes an ImageCache object.
+        :param cache_dir (str): The directory of the cached images, created when the first image is stored.
+        :param max_bytes (int): The maximum total size of the cached images.
+        :param max_image_bytes (int): Larger images are not cached.
+        :param timeout (Tuple[float, float]): The (connect, read) timeout of fetching an image.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_image_bytes = max_image_bytes
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.flight = SingleFlight()
+        self.lock = threading.Lock()
+        # Path -> last time the image was served. The file times are not changed, they are the ETag of the image
+        self.served: Dict[str, float] = {}
+
+        # Counters to tune the size of the cache
+        self.stats: Dict[str, Any] = {
+            "hits": 0,
+            "misses": 0,
+            "fetch_errors": 0,
+            "evictions": 0,
+        }
+
+    def get(self, url: str, size: str) -> Optional[Tuple[str, str]]:
+        """
+        Returns the cached file of an image in a size, and fetches and stores it first if it is not cached.
+        Raises ValueError if the URL is not a Spoonacular image or the size is unknown.
+        :param url (str): The image URL.
+        :param size (str): One of SIZES.
+        :return (Tuple[str, str]): The path of the file and its content type, or None if the image could not be fetched.
+        """
+        if not is_allowed(url):
+            raise ValueError(f"Images of {urlsplit(url).hostname} are not proxied")
+        source, extension = thumbnail_url(url, size)
+        name = hashlib.sha1(source.encode()).hexdigest()[:20]
+        path = os.path.join(self.cache_dir, f"{name}.{extension}")
+        content_type = CONTENT_TYPES[extension]
+
+        if os.path.exists(path):
+            with self.lock:
+                self.stats["hits"] += 1
+                self.served[path] = time.time()
+            return path, content_type
+
+        with self.lock:
+            self.stats["misses"] += 1
+        # Cards that show the same image at the same time fetch it once
+        if not self.flight.do(path, self._fetch, source, path):
+            with self.lock:
+                self.stats["fetch_errors"] += 1
+            return None
+        return path, content_type
+
+    def _fetch(self, source: str, path: str) -> bool:
+        """
+        Fetches an image and stores it, and removes the least recently served images beyond `max_bytes`.
+        :return (bool): True if the image was stored.
+        """
+        if os.path.exists(path):
+            return True
+        try:
+            response = self.session.get(source, timeout=self.timeout)
+        except requests.RequestException as e:
+            print(f"Error fetching image {source}:", e)
+            return False
+        content = response.content
+        if (
+            response.status_code != 200
+            or not response.headers.get("Content-Type", "").startswith("image/")
+            or len(content) > self.max_image_bytes
+        ):
+            return False
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_atomic(path, content)
+        self._evict()
+        return True
+
+    def _evict(self) -> None:
+        """
+        Removes the least recently served images until the cache holds at most `max_bytes`.
+        """
+        with self.lock:
+            files = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    served = self.served.get(entry.path, stat.st_mtime)
+                    files.append((served, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, file_path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    continue
+                total -= size
+                self.served.pop(file_path, None)
+                self.stats["evictions"] += 1
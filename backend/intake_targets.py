@@ -0,0 +1,85 @@
+### daily intake targets of the recommendation searches ###
+from typing import Any, Dict, Iterable, List, Tuple, Union
+import json
+import os
+
+from models.input_output_models import nutrient_name
+
+TARGETS_FILE = os.path.join(os.path.dirname(__file__), "data", "intake_targets.json")
+SEXES = ("female", "male")
+# Profiles without a usable age get the targets of this band
+DEFAULT_BAND = "19-30"
+
+
+def to_number(value: float) -> Union[int, float]:
+    """
+    Returns a search amount as an int if it is whole, so Iron 4.0 becomes minIron=4.
+    """
+    value = round(value, 1)
+    return int(value) if value.is_integer() else value
+
+
+class IntakeTargets:
+    """
+    Table of the minimum nutrient amount a recommended recipe should have, per nutrient, age band and sex.
+    The amounts are computed once when the table is loaded, so a lookup is a few dict lookups.
+    """
+
+    def __init__(self, path: str = TARGETS_FILE) -> None:
+        """
+        Initializes an IntakeTargets object from a table file (see data/intake_targets.json).
+        :param path (str): The path of the table file.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            table = json.load(f)
+        share = table["meal_share"]
+        self.bands: List[Tuple[str, int]] = [(band, low) for band, low in table["age_bands"]]
+        self.units: Dict[str, str] = {}
+        # (band, sex) -> nutrient -> minimum amount per recipe
+        self.amounts: Dict[Tuple[str, str], Dict[str, Union[int, float]]] = {}
+        for nutrient, row in table["nutrients"].items():
+            self.units[nutrient] = row["unit"]
+            for sex in SEXES:
+                for (band, _), daily in zip(self.bands, row[sex]):
+                    self.amounts.setdefault((band, sex), {})[nutrient] = to_number(daily * share)
+
+    def band(self, age: Any) -> str:
+        """
+        Returns the age band of an age.
+        :param age (Any): The age of the profile, as a number or text.
+        :return (str): The name of the band.
+        """
+        try:
+            age = float(age)
+        except (TypeError, ValueError):
+            return DEFAULT_BAND
+        name = self.bands[0][0]
+        for band, low in self.bands:
+            if age >= low:
+                name = band
+        return name
+
+    def lookup(
+        self, nutrients: Iterable[str], age: Any = None, sex: Any = None
+    ) -> Dict[str, Dict[str, Union[int, float]]]:
+        """
+        Returns the minimum amounts of nutrients as search parameters, like { "iron": { "minIron": 5 } }.
+        Nutrients without a target (for example sodium) are left out. A sex other than female or male
+        gets the higher of both amounts.
+        :param nutrients (Iterable[str]): The nutrient names, like "Iron", "vitamin d" or "VitaminD".
+        :param age (Any): The age of the profile.
+        :param sex (Any): The sex of the profile.
+        :return (Dict[str, Dict[str, Union[int, float]]]): The search parameters per nutrient.
+        """
+        band = self.band(age)
+        sex = str(sex or "").strip().lower()
+        tables = [self.amounts[(band, sex)]] if sex in SEXES else [
+            self.amounts[(band, s)] for s in SEXES
+        ]
+        targets = {}
+        for name in nutrients:
+            nutrient = nutrient_name(name)
+            if nutrient in self.units:
+                amount = max(table[nutrient] for table in tables)
+                targets[nutrient.lower()] = {f"min{nutrient}": amount}
+        return targets
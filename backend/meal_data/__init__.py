@@ -0,0 +1,3 @@
+from .meal_data import Meal, MealsData, meal_key
+from .recipe_cache import RecipeCache, nutrient_summary
+from .query_engine import RecipeQueryEngine
@@ -0,0 +1,246 @@
+from typing import Iterable, List, Dict, Any, Optional
+import threading
+import time
+
+from storage_codec import get_codec, read_records
+from user_data.file_lock import locked, write_atomic
+
+
+def meal_key(meal_id) -> int:
+    """
+    Returns the key under which a meal is stored. Spoonacular ids are numbers, but they arrive as
+    strings from URLs and from the keys of the storage file, so every id is turned into an int.
+    Raises a ValueError if the id is not a number.
+    :param meal_id (int | str): The id of the meal.
+    :return (int): The key of the meal.
+    """
+    return int(meal_id)
+
+
+class Meal:
+    """
+    Class representing a meal (recipe) in the system.
+    """
+
+    # All fields of a meal, in the order they are stored.
+    FIELDS = (
+        "id",
+        "image",
+        "title",
+        "readyInMinutes",
+        "sourceUrl",
+        "nutrition",
+        "summary",
+        "dishTypes",
+        "diets",
+        "spoonacularSourceUrl",
+        "extra",
+        "cached_at",
+    )
+
+    # Slots instead of a per-object __dict__ keep every loaded meal small.
+    __slots__ = FIELDS
+
+    def __init__(
+        self,
+        id: str,
+        title: str,
+        image: str,
+        readyInMinutes: int,
+        sourceUrl: str,
+        nutrition: Dict[str, List[Dict[str, Any]]],
+        summary: str,
+        dishTypes: List[str],
+        diets: List[str],
+        spoonacularSourceUrl: str,
+        extra: Optional[Dict[str, Any]] = None,
+        cached_at: Optional[float] = None
+    ) -> None:
+        """
+        Initializes a Meal object.
+
+        Parameters:
+            id (id): id of the meal
+            title (str): name of the meal.
+            image (str): url to the image of the meal.
+            nutrition (Dict[str, float]): nutritional info
+            summary (str): summary text about the meal
+            readyInMinutes (int): how many minutes does it take to get ready. -1 if not set
+            sourceUrl (str): url to the source of the recipe
+            dishTypes (List[str]): what kind of dish is it (breakfast, drink, lunch, etc)
+            diets (List[str]): which diets this meal is good for
+            spoonacularSourceUrl (str): url to the spoonacular website
+            extra (Dict[str, Any]): the other fields of the Spoonacular recipe information (ingredients, instructions, etc)
+            cached_at (float): unix time when the meal was fetched from Spoonacular, None if it was never fetched
+        """
+        self.id = id
+        self.image = image
+        self.title = title
+        self.readyInMinutes = readyInMinutes
+        self.sourceUrl = sourceUrl
+        self.nutrition = nutrition
+        self.summary = summary
+        self.dishTypes = dishTypes
+        self.diets = diets
+        self.spoonacularSourceUrl = spoonacularSourceUrl
+        self.extra = {} if extra is None else extra
+        self.cached_at = cached_at
+
+    @classmethod
+    def from_information(cls, information: Dict[str, Any]) -> "Meal":
+        """
+        Creates a meal from a Spoonacular /recipes/{id}/information response, fetched now.
+        The fields that the Meal class does not model are kept in `extra`.
+        :param information (Dict[str, Any]): The recipe information.
+        :return (Meal): The meal.
+        """
+        extra = {k: v for k, v in information.items() if k not in cls.FIELDS}
+        return cls(
+            information["id"],
+            information.get("title", ""),
+            information.get("image", ""),
+            information.get("readyInMinutes", -1),
+            information.get("sourceUrl", ""),
+            information.get("nutrition", {}),
+            information.get("summary", ""),
+            information.get("dishTypes", []),
+            information.get("diets", []),
+            information.get("spoonacularSourceUrl", ""),
+            extra,
+            time.time(),
+        )
+
+    def to_information(self) -> Dict[str, Any]:
+        """
+        Returns the meal in the shape of a Spoonacular recipe information response, as the templates expect it.
+        :return (Dict[str, Any]): The recipe information.
+        """
+        information = dict(self.extra)
+        for field in self.FIELDS:
+            if field not in ("extra", "cached_at"):
+                information[field] = getattr(self, field)
+        if not self.nutrition:
+            del information["nutrition"]
+        return information
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+class MealsData:
+    """
+    Class managing the data storage of the meals data.
+    Stores meals in a JSON file.
+    """
+
+    def __init__(self, file_path="backend/meal_data/meals_database.json", codec=None) -> None:
+        """
+        Initializes a MealsData object. Loads meals from the meals_database.json file if it exists.
+        :param file_path (str): The path to the JSON file where meals are stored.
+        :param codec: The format the file is written in (see storage_codec), pretty-printed JSON by default.
+            Files in any supported format are detected and read.
+        """
+        self.meals = {}
+        # Incremented whenever meals are added or replaced, so indexes over the meals know when to rebuild
+        self.version = 0
+        # Held by everything that changes `meals`, and by readers that need a consistent copy of it
+        self.lock = threading.RLock()
+        self.file_path = file_path
+        self.codec = codec or get_codec("json")
+        self.load_from_file()
+
+    def add_meal(self, meal: Meal) -> None:
+        """
+        Add's a new meal to the data file.
+        If the meal id already exists in the database, it raises a ValueError.
+        :param meal (Meal): A meal object that will be added to the storage.
+        """
+        self.add_meals([meal])
+
+    def add_meals(self, meals: Iterable[Meal]) -> None:
+        """
+        Adds several new meals and writes the data file once.
+        If any meal id already exists, or appears twice, it raises a ValueError and nothing is added.
+        :param meals (Iterable[Meal]): The meal objects that will be added to the storage.
+        """
+        new_meals = {}
+        with self.lock:
+            # Checked under the lock, so two callers can not both add the same id
+            for meal in meals:
+                id: int = meal_key(meal.id)
+                if id in self.meals or id in new_meals:
+                    raise ValueError(f"Meal with id '{id}' already exists.")
+                new_meals[id] = meal
+            self.meals.update(new_meals)
+            self.version += 1
+            self.save_to_file()
+
+    def upsert_meals(self, meals: Iterable[Meal]) -> int:
+        """
+        Adds new meals and replaces the meals whose id already exists, then writes the data file once.
+        :param meals (Iterable[Meal]): The meal objects that will be stored.
+        :return (int): The number of meals that were new.
+        """
+        added = 0
+        with self.lock:
+            for meal in meals:
+                id: int = meal_key(meal.id)
+                if id not in self.meals:
+                    added += 1
+                self.meals[id] = meal
+            self.version += 1
+            self.save_to_file()
+        return added
+
+    def remove_meals(self, ids: Iterable[int], save: bool = True) -> int:
+        """
+        Removes meals by their id. Ids that are not stored are ignored.
+        :param ids (Iterable[int]): The ids of the meals to remove.
+        :param save (bool): Whether the data file is written, callers that store other meals right after can skip it.
+        :return (int): The number of meals that were removed.
+        """
+        with self.lock:
+            removed = 0
+            for id in ids:
+                if self.meals.pop(meal_key(id), None) is not None:
+                    removed += 1
+            if removed:
+                self.version += 1
+                if save:
+                    self.save_to_file()
+        return removed
+
+    def save_to_file(self):
+        """
+        Saves meals to the JSON file where the data will be stored.
+        The file is replaced atomically under a file lock, so a crash or another process never leaves it half written.
+        """
+        data = self.codec.encode({u: p.to_dict() for u, p in self.meals.items()})
+        with locked(self.file_path):
+            write_atomic(self.file_path, data)
+
+    def load_from_file(self):
+        """
+        Loads meals from the JSON file, keyed by their id as an int.
+        Nothing is loaded if the file does not exist, or if it can not be read, since the meals can be fetched again."""
+        try:
+            with locked(self.file_path, shared=True):
+                meals_data = read_records(self.file_path)
+            meals = {meal_key(meal_id): Meal(**meal) for meal_id, meal in meals_data.items()}
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Reading meals from {self.file_path} failed, starting without stored meals:", e)
+            return
+        self.meals.update(meals)
+
+    def get_meal(self, id: int) -> Meal:
+        """
+        Returns the meal object for the given id. If no meal is found, it returns None.
+        :param id (int): The id of the meal, an id as a string is found as well.
+        :return (Meal): The meal object for the given id.
+        """
+        try:
+            return self.meals.get(meal_key(id), None)
+        except ValueError:
+            return None
@@ -0,0 +1,264 @@
+from typing import Any, Dict, List, Optional, Set, Tuple
+from bisect import bisect_left, bisect_right
+import heapq
+import re
+import threading
+
+from .meal_data import Meal, MealsData, meal_key
+
+# The recipe diets that satisfy a diet of the profile page, after normalizing (lowercase, no spaces or dashes).
+# A vegan recipe satisfies every vegetarian diet. Diets that are not listed are not answered locally.
+DIET_MATCHES: Dict[str, Set[str]] = {
+    "glutenfree": {"glutenfree"},
+    "ketogenic": {"ketogenic"},
+    "vegetarian": {"vegetarian", "lactoovovegetarian", "vegan"},
+    "lactovegetarian": {"lactovegetarian", "vegan"},
+    "ovovegetarian": {"ovovegetarian", "vegan"},
+    "vegan": {"vegan"},
+    "pescetarian": {"pescetarian", "pescatarian", "lactoovovegetarian", "vegan"},
+    "paleo": {"paleo", "paleolithic"},
+    "primal": {"primal"},
+    "lowfodmap": {"lowfodmap", "fodmapfriendly"},
+    "whole30": {"whole30"},
+}
+# Diet values that mean no diet
+NO_DIET = ("", "none")
+# complexSearch parameters that the engine understands, besides the min and max nutrient amounts.
+# The stored recipes are complete, so asking for the recipe information or nutrition inline changes nothing.
+SUPPORTED_PARAMS = (
+    "diet",
+    "type",
+    "excludeIngredients",
+    "number",
+    "offset",
+    "apiKey",
+    "addRecipeInformation",
+    "addRecipeNutrition",
+)
+NUTRIENT_PARAM = re.compile(r"(min|max)([A-Z][A-Za-z0-9]*)$")
+
+
+def normalize(name: str) -> str:
+    """
+    Returns a diet or nutrient name in lowercase without spaces and dashes, so "Vitamin B12" matches "VitaminB12".
+    """
+    return re.sub(r"[\s_-]+", "", str(name).lower())
+
+
+def listed(value: Any) -> List[Any]:
+    """
+    Returns a list field of a stored recipe, or an empty list if it is missing or not a list.
+    """
+    return value if isinstance(value, list) else []
+
+
+def nutrition_of(meal: Meal) -> List[Dict[str, Any]]:
+    """
+    Returns the nutrients of a stored recipe, or an empty list if its nutrition is not stored.
+    """
+    return meal.nutrition.get("nutrients", []) if isinstance(meal.nutrition, dict) else []
+
+
+class RecipeQueryEngine:
+    """
+    In-memory search over the recipes in MealsData, with the filters of the complexSearch calls of the app:
+    diet, dish type, excluded ingredients and min/max nutrient amounts.
+    The indexes are built from a copy of the MealsData recipes and rebuilt when its recipes change.
+    A search is only answered when enough stored recipes match, otherwise Spoonacular has to be asked.
+    """
+
+    def __init__(self, meals_data: MealsData) -> None:
+        """
+        Initializes a RecipeQueryEngine object, the indexes are built on the first search.
+        :param meals_data (MealsData): The stored recipes.
+        """
+        self.meals_data = meals_data
+        self.lock = threading.Lock()
+        # The MealsData version the indexes were built from, and the copy of its recipes they point into
+        self.version: Optional[int] = None
+        self.meals: Dict[int, Meal] = {}
+
+        # Dish type -> recipe keys, diet of a search (see DIET_MATCHES) -> recipe keys
+        self.by_type: Dict[str, Set[int]] = {}
+        self.by_diet: Dict[str, Set[int]] = {}
+        # Normalized nutrient name -> (sorted amounts, recipe keys in the same order), and -> {recipe key: amount}
+        self.by_nutrient: Dict[str, Tuple[List[float], List[int]]] = {}
+        self.amounts: Dict[str, Dict[int, float]] = {}
+        # Lowercase ingredient name -> recipe keys, and the keys of the recipes whose ingredients are stored
+        self.by_ingredient: Dict[str, Set[int]] = {}
+        self.with_ingredients: Set[int] = set()
+
+        # Counters of the searches that were answered locally
+        self.stats: Dict[str, int] = {"answered": 0, "unanswered": 0, "rebuilds": 0, "errors": 0}
+
+    def search(self, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Answers a complexSearch from the stored recipes.
+        :param params (Dict[str, Any]): The search parameters, like the ones sent to complexSearch.
+        :return (Dict[str, Any]): The result in the format of complexSearch, or None if the search uses
+            filters the engine does not know, fewer than `offset + number` stored recipes match or the search failed.
+        """
+        with self.lock:
+            try:
+                self._refresh()
+                result = self._search(params)
+            except Exception as e:
+                # A search the engine can not answer is left to Spoonacular
+                print("Searching the stored recipes failed:", e)
+                self.stats["errors"] += 1
+                result = None
+            self.stats["unanswered" if result is None else "answered"] += 1
+            return result
+
+    def _search(self, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Runs a search on the indexes. Must be called with the lock held.
+        """
+        ranges: List[Tuple[str, str, float]] = []
+        for name, value in params.items():
+            match = NUTRIENT_PARAM.match(name)
+            if match and value not in (None, ""):
+                try:
+                    ranges.append((match.group(1), normalize(match.group(2)), float(value)))
+                except (TypeError, ValueError):
+                    return None
+            elif name not in SUPPORTED_PARAMS and value not in (None, ""):
+                return None
+
+        # The diet and dish type sets are intersected starting with the smallest one
+        sets: List[Set[int]] = []
+        diet = normalize(params.get("diet") or "")
+        if diet not in NO_DIET:
+            if diet not in DIET_MATCHES:
+                return None
+            sets.append(self.by_diet.get(diet, set()))
+        dish_type = str(params.get("type") or "").strip().lower()
+        if dish_type:
+            sets.append(self.by_type.get(dish_type, set()))
+        sets.sort(key=len)
+        candidates: Optional[Set[int]] = sets[0].intersection(*sets[1:]) if sets else None
+
+        for bound, nutrient, limit in ranges:
+            amounts = self.amounts.get(nutrient, {})
+            if candidates is None:
+                # Without other filters the range is cut from the sorted amounts
+                sorted_amounts, keys = self.by_nutrient.get(nutrient, ([], []))
+                if bound == "min":
+                    candidates = set(keys[bisect_left(sorted_amounts, limit) :])
+                else:
+                    candidates = set(keys[: bisect_right(sorted_amounts, limit)])
+            elif bound == "min":
+                candidates = {key for key in candidates if amounts.get(key, -1) >= limit}
+            else:
+                candidates = {key for key in candidates if 0 <= amounts.get(key, -1) <= limit}
+
+        if candidates is None:
+            candidates = set(self.meals)
+
+        excluded = [
+            item.strip().lower()
+            for item in str(params.get("excludeIngredients") or "").split(",")
+            if item.strip()
+        ]
+        if excluded:
+            # Recipes without stored ingredients can not be checked, so they are left out.
+            # An excluded ingredient matches every ingredient name that contains it, "nut" also matches "peanut"
+            candidates = candidates & self.with_ingredients
+            for name, keys in self.by_ingredient.items():
+                if any(item in name for item in excluded):
+                    candidates -= keys
+
+        number = int(float(params.get("number", 10)))
+        offset = int(float(params.get("offset", 0)))
+        if len(candidates) < offset + number:
+            return None
+
+        # Recipes with the most of the first asked nutrient first, like a search sorted by that nutrient
+        first_min = next((nutrient for bound, nutrient, _ in ranges if bound == "min"), None)
+        if first_min is not None:
+            amounts = self.amounts.get(first_min, {})
+            order = heapq.nlargest(
+                offset + number, candidates, key=lambda key: (amounts.get(key, -1), -key)
+            )
+        else:
+            order = heapq.nsmallest(offset + number, candidates)
+        asked = {nutrient for _, nutrient, _ in ranges}
+        results = [self._result(self.meals[key], asked) for key in order[offset:]]
+        return {
+            "results": results,
+            "offset": offset,
+            "number": number,
+            "totalResults": len(candidates),
+        }
+
+    def _result(self, meal: Meal, nutrients: Set[str]) -> Dict[str, Any]:
+        """
+        Returns a recipe as a complexSearch result, with the amounts of the nutrients that were filtered on.
+        """
+        result = {
+            "id": meal_key(meal.id),
+            "title": meal.title,
+            "image": meal.image,
+            "imageType": meal.extra.get("imageType", "jpg"),
+        }
+        if nutrients:
+            result["nutrition"] = {
+                "nutrients": [
+                    nutrient
+                    for nutrient in nutrition_of(meal)
+                    if normalize(nutrient.get("name", "")) in nutrients
+                ]
+            }
+        return result
+
+    def _refresh(self) -> None:
+        """
+        Rebuilds the indexes if the stored recipes changed since they were built. Must be called with the lock held.
+        The recipes are copied under the lock of MealsData, so the cache can store and evict recipes during a rebuild.
+        """
+        with self.meals_data.lock:
+            if self.version == self.meals_data.version:
+                return
+            meals = dict(self.meals_data.meals)
+            version = self.meals_data.version
+        by_type: Dict[str, Set[int]] = {}
+        recipe_diets: Dict[str, Set[int]] = {}
+        nutrient_amounts: Dict[str, List[Tuple[float, int]]] = {}
+        by_ingredient: Dict[str, Set[int]] = {}
+        with_ingredients: Set[int] = set()
+        for key, meal in meals.items():
+            # Old entries of the meals file can hold these fields as text, they are not indexed
+            for dish_type in listed(meal.dishTypes):
+                by_type.setdefault(str(dish_type).lower(), set()).add(key)
+            for diet in listed(meal.diets):
+                recipe_diets.setdefault(normalize(diet), set()).add(key)
+            for nutrient in nutrition_of(meal):
+                try:
+                    amount = float(nutrient["amount"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                nutrient_amounts.setdefault(normalize(nutrient.get("name", "")), []).append(
+                    (amount, key)
+                )
+            for item in listed(meal.extra.get("extendedIngredients")):
+                name = str(item.get("name") or item.get("original") or "").lower()
+                by_ingredient.setdefault(name, set()).add(key)
+                with_ingredients.add(key)
+
+        self.by_type = by_type
+        # Indexed by the diets of the searches, so a search needs one lookup
+        self.by_diet = {
+            diet: set().union(*(recipe_diets.get(d, set()) for d in matches))
+            for diet, matches in DIET_MATCHES.items()
+        }
+        self.by_nutrient = {}
+        self.amounts = {}
+        for nutrient, pairs in nutrient_amounts.items():
+            pairs.sort()
+            self.by_nutrient[nutrient] = ([a for a, _ in pairs], [k for _, k in pairs])
+            self.amounts[nutrient] = {k: a for a, k in pairs}
+        self.by_ingredient = by_ingredient
+        self.with_ingredients = with_ingredients
+        self.meals = meals
+        self.version = version
+        self.stats["rebuilds"] += 1
@@ -0,0 +1,312 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from collections import OrderedDict
+import time
+
+from .meal_data import Meal, MealsData, meal_key
+from .query_engine import normalize
+
+# The nutrients that are always kept in a nutrient summary, the ones the meal planner adds up
+SUMMARY_NUTRIENTS = ("Calories", "Protein", "Fat", "Carbohydrates")
+# The fields of a search result that are kept with its nutrient summary
+SUMMARY_FIELDS = ("id", "title", "image", "imageType", "readyInMinutes", "servings", "dishTypes", "diets")
+
+
+def nutrient_summary(
+    information: Dict[str, Any], nutrients: Iterable[str] = ()
+) -> Dict[str, Any]:
+    """
+    Returns the slim version of a recipe with nutrition: the fields in SUMMARY_FIELDS and only the
+    nutrients in SUMMARY_NUTRIENTS and `nutrients`.
+    :param information (Dict[str, Any]): The recipe with its nutrition, as complexSearch returns it with addRecipeNutrition.
+    :param nutrients (Iterable[str]): Names of the nutrients to keep besides SUMMARY_NUTRIENTS, in any case.
+    :return (Dict[str, Any]): The slim recipe.
+    """
+    keep = {normalize(name) for name in (*SUMMARY_NUTRIENTS, *nutrients)}
+    summary = {field: information[field] for field in SUMMARY_FIELDS if field in information}
+    if isinstance(information.get("nutrition"), dict):
+        summary["nutrition"] = {
+            "nutrients": [
+                nutrient
+                for nutrient in information["nutrition"].get("nutrients", [])
+                if normalize(nutrient.get("name", "")) in keep
+            ]
+        }
+    return summary
+
+
+class RecipeCache:
+    """
+    Read-through cache of Spoonacular recipe information, stored in MealsData.
+    A recipe is served from MealsData while it is fresh, otherwise it is fetched, stored and returned.
+    When the cache holds more than `max_size` recipes, the least recently used ones are removed.
+    """
+
+    def __init__(
+        self,
+        meals_data: MealsData,
+        fetch: Callable[[Any, bool], Optional[Dict[str, Any]]],
+        ttl: float = 7 * 24 * 3600,
+        max_size: int = 5000,
+        fetch_bulk: Optional[Callable[[List[int], bool], List[Dict[str, Any]]]] = None,
+        chunk_size: int = 50,
+    ) -> None:
+        """
+        Initializes a RecipeCache object.
+        :param meals_data (MealsData): The storage of the cached recipes.
+        :param fetch (Callable): Fetches the information of a recipe id, with or without nutrition.
+            Returns None if the recipe could not be fetched.
+        :param ttl (float): Number of seconds a stored recipe stays fresh.
+        :param max_size (int): Maximum number of recipes that are kept.
+        :param fetch_bulk (Callable): Optional, fetches the information of a list of recipe ids in one call.
+            Returns the recipes that were found, an empty list if the call failed.
+            Without it, get_many fetches the recipes one by one.
+        :param chunk_size (int): Maximum number of recipe ids in one call of `fetch_bulk`.
+        """
+        self.meals_data = meals_data
+        self.fetch = fetch
+        self.fetch_bulk = fetch_bulk
+        self.ttl = ttl
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        # The lock of MealsData, so evictions and writes never run during a copy of the query engine
+        self.lock = meals_data.lock
+
+        # Recipe ids from least to most recently used, stored recipes start in the order they were fetched
+        self.order = OrderedDict(
+            (key, None)
+            for key, meal in sorted(
+                meals_data.meals.items(), key=lambda item: item[1].cached_at or 0
+            )
+        )
+
+        # Counters to tune the time to live and the size of the cache
+        self.stats: Dict[str, int] = {
+            "hits": 0,
+            "misses": 0,
+            "stale": 0,
+            "evictions": 0,
+            "fetch_errors": 0,
+            "bulk_fetches": 0,
+        }
+
+    def get(self, recipe_id, include_nutrition: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Returns the information of a recipe, from the cache if it is fresh and complete, otherwise from `fetch`.
+        If fetching fails, a stale stored copy is returned rather than nothing, if it holds the nutrition when it is needed.
+        :param recipe_id: The Spoonacular id of the recipe.
+        :param include_nutrition (bool): Whether the nutrition of the recipe is needed.
+        :return (Dict[str, Any]): The recipe information, or None if it is not stored and could not be fetched.
+        """
+        try:
+            key = meal_key(recipe_id)
+        except ValueError:
+            return None
+        information = self._lookup(key, include_nutrition)
+        if information is not None:
+            return information
+
+        information = self.fetch(recipe_id, include_nutrition)
+        if information is None:
+            return self._fallback(key, include_nutrition)
+        self._store([Meal.from_information({"id": key, **information})])
+        return information
+
+    def get_many(
+        self, recipe_ids: Iterable, include_nutrition: bool = False, summary_ok: bool = False
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        Returns the information of several recipes. The ids are deduplicated, fresh recipes are served from the
+        cache, and the others are fetched with `fetch_bulk` in chunks of `chunk_size` and stored with one write.
+        :param recipe_ids (Iterable): The Spoonacular ids of the recipes, may contain duplicates.
+        :param include_nutrition (bool): Whether the nutrition of the recipes is needed.
+        :param summary_ok (bool): Whether a fresh nutrient summary (see store_summaries) is enough,
+            for callers that only need the nutrient totals.
+        :return (List[Optional[Dict[str, Any]]]): The information of every recipe id, in the order of the ids.
+            None for the recipes that could not be fetched and have no usable stored copy (see _fallback).
+        """
+        if self.fetch_bulk is None and not summary_ok:
+            return [self.get(recipe_id, include_nutrition) for recipe_id in recipe_ids]
+
+        keys = []
+        for recipe_id in recipe_ids:
+            try:
+                keys.append(meal_key(recipe_id))
+            except ValueError:
+                keys.append(None)
+
+        found: Dict[int, Dict[str, Any]] = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            if key is None:
+                continue
+            information = self._lookup(key, include_nutrition, summary_ok)
+            if information is None:
+                missing.append(key)
+            else:
+                found[key] = information
+
+        fetched = []
+        for start in range(0, len(missing), self.chunk_size):
+            chunk = missing[start : start + self.chunk_size]
+            if self.fetch_bulk is None:
+                fetch_chunk = self._fetch_each
+            else:
+                fetch_chunk = self.fetch_bulk
+                with self.lock:
+                    self.stats["bulk_fetches"] += 1
+            for information in fetch_chunk(chunk, include_nutrition):
+                if information.get("id") in chunk:
+                    fetched.append(information)
+                    found[information["id"]] = information
+        if fetched:
+            self._store([Meal.from_information(information) for information in fetched])
+        for key in missing:
+            if key not in found:
+                fallback = self._fallback(key, include_nutrition, summary_ok)
+                if fallback is not None:
+                    found[key] = fallback
+
+        return [found.get(key) for key in keys]
+
+    def _fetch_each(self, keys: List[int], include_nutrition: bool) -> List[Dict[str, Any]]:
+        """
+        Fetches recipes one by one with `fetch`, for a cache without `fetch_bulk`.
+        :return (List[Dict[str, Any]]): The recipes that were found, each with its id.
+        """
+        informations = []
+        for key in keys:
+            information = self.fetch(key, include_nutrition)
+            if information is not None:
+                informations.append({**information, "id": key})
+        return informations
+
+    def store_summaries(
+        self, informations: Iterable[Dict[str, Any]], nutrients: Iterable[str] = ()
+    ) -> int:
+        """
+        Stores the nutrient summary of recipes that came with their nutrition in search results, so their
+        nutrition totals can be computed without another call. Recipes that are stored in full are kept as they are,
+        even when they are stale, so they can still be served when fetching fails.
+        A summary does not count as a full recipe for `get`, the recipe details are still fetched when needed.
+        :param informations (Iterable[Dict[str, Any]]): Recipes with nutrition, as complexSearch returns them
+            with addRecipeNutrition.
+        :param nutrients (Iterable[str]): Names of the nutrients to keep besides SUMMARY_NUTRIENTS.
+        :return (int): The number of summaries that were stored.
+        """
+        now = time.time()
+        meals = []
+        for information in informations:
+            try:
+                key = meal_key(information.get("id"))
+            except (TypeError, ValueError):
+                continue
+            if not isinstance(information.get("nutrition"), dict):
+                continue
+            with self.lock:
+                stored = self.meals_data.get_meal(key)
+                if stored is not None and (
+                    stored.cached_at is not None or self._summary_fresh(stored)
+                ):
+                    continue
+            meal = Meal.from_information(
+                {**nutrient_summary(information, nutrients), "id": key}
+            )
+            meal.cached_at = None
+            meal.extra["summarized_at"] = now
+            meals.append(meal)
+        if meals:
+            self._store(meals)
+        return len(meals)
+
+    def _lookup(
+        self, key: int, include_nutrition: bool, summary_ok: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Returns a stored recipe if it is fresh and holds the nutrition if it is needed, and counts the hit or miss.
+        :param key (int): The key of the recipe.
+        :param include_nutrition (bool): Whether the nutrition of the recipe is needed.
+        :param summary_ok (bool): Whether a fresh nutrient summary (see store_summaries) is enough.
+        :return (Dict[str, Any]): The recipe information, or None on a miss.
+        """
+        with self.lock:
+            meal = self.meals_data.get_meal(key)
+            if meal is not None and (
+                self._usable(meal, include_nutrition)
+                or (summary_ok and self._summary_fresh(meal))
+            ):
+                self.order.move_to_end(key)
+                self.stats["hits"] += 1
+                return meal.to_information()
+            self.stats["misses"] += 1
+            if meal is not None:
+                self.stats["stale"] += 1
+            return None
+
+    def _fallback(
+        self, key: int, include_nutrition: bool = False, summary_ok: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Counts a failed fetch and returns the stale stored copy of the recipe, if it was fetched in full
+        and holds the nutrition if it is needed. The time to live is ignored.
+        :param key (int): The key of the recipe.
+        :param include_nutrition (bool): Whether the nutrition of the recipe is needed.
+        :param summary_ok (bool): Whether a stored nutrient summary (see store_summaries) is enough.
+        :return (Dict[str, Any]): The stale recipe information, or None if no usable copy is stored.
+        """
+        with self.lock:
+            self.stats["fetch_errors"] += 1
+            meal = self.meals_data.get_meal(key)
+            if meal is None:
+                return None
+            summary = summary_ok and bool(meal.nutrition) and "summarized_at" in meal.extra
+            if not (summary or self._complete(meal, include_nutrition)):
+                return None
+            return meal.to_information()
+
+    def _store(self, meals: List[Meal]) -> None:
+        """
+        Stores recipes with one write, and removes the least recently used recipes beyond `max_size`.
+        :param meals (List[Meal]): The recipes to store.
+        """
+        with self.lock:
+            for meal in meals:
+                key = meal_key(meal.id)
+                self.order[key] = None
+                self.order.move_to_end(key)
+            evicted = []
+            while len(self.order) > self.max_size:
+                evicted.append(self.order.popitem(last=False)[0])
+            self.stats["evictions"] += len(evicted)
+            # The removal is written together with the stored recipes
+            self.meals_data.remove_meals(evicted, save=False)
+            self.meals_data.upsert_meals(meals)
+
+    def _usable(self, meal: Meal, include_nutrition: bool) -> bool:
+        """
+        Checks whether a stored recipe is fresh and holds the nutrition if it is needed.
+        """
+        return self._fresh(meal) and self._complete(meal, include_nutrition)
+
+    def _complete(self, meal: Meal, include_nutrition: bool) -> bool:
+        """
+        Checks whether a stored recipe was fetched in full and holds the nutrition if it is needed, fresh or not.
+        """
+        return meal.cached_at is not None and (bool(meal.nutrition) or not include_nutrition)
+
+    def _fresh(self, meal: Meal) -> bool:
+        """
+        Checks whether a stored recipe was fetched in full within the time to live.
+        Recipes that were never fetched in full (cached_at is None) count as stale.
+        """
+        return meal.cached_at is not None and time.time() - meal.cached_at <= self.ttl
+
+    def _summary_fresh(self, meal: Meal) -> bool:
+        """
+        Checks whether a stored recipe has a nutrient summary from a search within the time to live.
+        """
+        summarized_at = meal.extra.get("summarized_at")
+        return (
+            summarized_at is not None
+            and bool(meal.nutrition)
+            and time.time() - summarized_at <= self.ttl
+        )
@@ -1,5 +1,5 @@
-from typing import List, Dict
-from pydantic import BaseModel
+from typing import List, Dict, Optional
+from pydantic import BaseModel, field_validator
 
 class RecommendationRequest(BaseModel):
     user_id: str
@@ -12,3 +12,65 @@ class FoodSuggestion(BaseModel):
 class FullRecommendationResponse(BaseModel):
     user_id: str
     recommendations: Dict[str, FoodSuggestion]
+
+
+# The nutrients the analysis may name, written like the min/max parameters of a Spoonacular search
+NUTRIENTS = [
+    "Copper", "Calcium", "Choline", "Cholesterol", "Fluoride", "SaturatedFat", "VitaminA", "VitaminC",
+    "VitaminD", "VitaminE", "VitaminK", "VitaminB1", "VitaminB2", "VitaminB3", "VitaminB5", "VitaminB6",
+    "VitaminB12", "Fiber", "Folate", "FolicAcid", "Iodine", "Iron", "Magnesium", "Manganese", "Phosphorus",
+    "Potassium", "Selenium", "Sodium", "Sugar", "Zinc",
+]
+NUTRIENT_NAMES = {nutrient.lower(): nutrient for nutrient in NUTRIENTS}
+
+
+def nutrient_name(name: str) -> str:
+    """
+    Returns the name of a nutrient as in NUTRIENTS ("vitamin d" becomes "VitaminD"), or the name without
+    spaces if it is not one of them.
+    """
+    compact = "".join(str(name).split()).replace("_", "").replace("-", "")
+    return NUTRIENT_NAMES.get(compact.lower(), compact)
+
+
+class Deficiency(BaseModel):
+    """
+    One likely deficiency of a symptom analysis, with its explanation, foods and tip.
+    """
+    nutrient: str
+    why: str = ""
+    foods: List[str] = []
+    tip: str = ""
+
+    @field_validator("nutrient")
+    @classmethod
+    def known_name(cls, value: str) -> str:
+        return nutrient_name(value)
+
+    @field_validator("foods", mode="before")
+    @classmethod
+    def split_foods(cls, value):
+        # Models sometimes answer with one comma-separated string instead of a list
+        if isinstance(value, str):
+            value = value.split(",")
+        return [str(food).strip() for food in value if str(food).strip()]
+
+
+class SymptomAnalysis(BaseModel):
+    """
+    The structured answer of the LLM to a symptom analysis: the deficiencies and an optional urgency note.
+    """
+    deficiencies: List[Deficiency] = []
+    urgency_note: Optional[str] = None
+
+    def to_text(self) -> str:
+        """
+        Returns the analysis in the text format of the results page.
+        """
+        blocks = [
+            f"{d.nutrient}:\n- Why: {d.why}\n- Foods: {', '.join(d.foods)}\n- Tip: {d.tip}"
+            for d in self.deficiencies
+        ]
+        if self.urgency_note:
+            blocks.append(f"[Urgency Note]: {self.urgency_note}")
+        return "\n\n".join(blocks)
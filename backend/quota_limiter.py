@@ -0,0 +1,141 @@
+### token bucket for the daily Spoonacular quota ###
+from typing import Any, Dict, Iterator, Mapping, Optional
+from contextlib import contextmanager
+import threading
+import time
+
+import requests
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+
+class QuotaExceeded(requests.RequestException):
+    """
+    Raised instead of calling Spoonacular when the call would use more of the quota than is left for it.
+    It is a RequestException, so callers handle it like a failed call: they serve from a cache or return partial results.
+    """
+
+
+def header_number(headers: Mapping[str, Any], name: str) -> Optional[float]:
+    """
+    Returns the value of a numeric response header, or None if it is missing or not a number.
+    """
+    value = headers.get(name)
+    if not isinstance(value, str):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class QuotaLimiter:
+    """
+    Token bucket of Spoonacular quota points. The bucket holds one day of quota and refills evenly over the day.
+    Every call takes its estimated points before it is made, and the estimate is corrected with the
+    X-API-Quota-Request and X-API-Quota-Left headers of the response when Spoonacular sends them.
+    Background calls may not use the last `background_reserve` part of the bucket, which is kept for page loads.
+    """
+
+    def __init__(self, daily_quota: float = 150, background_reserve: float = 0.25) -> None:
+        """
+        Initializes a QuotaLimiter object with a full bucket.
+        :param daily_quota (float): The number of quota points per day of the Spoonacular plan.
+        :param background_reserve (float): The part of the quota (0 to 1) that only interactive calls may use.
+        """
+        self.capacity = daily_quota
+        self.tokens = daily_quota
+        self.refill_rate = daily_quota / (24 * 3600)
+        self.reserve = daily_quota * background_reserve
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        self.stats: Dict[str, Any] = {
+            "points_left": daily_quota,
+            "points_spent": 0.0,
+            "denied_interactive": 0,
+            "denied_background": 0,
+            "server_quota_left": None,
+        }
+
+    @property
+    def priority(self) -> str:
+        """
+        The priority of the calls made by the current thread, interactive unless set with `prioritized`.
+        """
+        return getattr(self.local, "priority", INTERACTIVE)
+
+    @contextmanager
+    def prioritized(self, priority: str) -> Iterator[None]:
+        """
+        Sets the priority of the calls that the current thread makes inside the with block.
+        :param priority (str): INTERACTIVE or BACKGROUND.
+        """
+        previous = self.priority
+        self.local.priority = priority
+        try:
+            yield
+        finally:
+            self.local.priority = previous
+
+    def acquire(self, cost: float, priority: Optional[str] = None) -> None:
+        """
+        Takes the estimated points of a call from the bucket.
+        Raises QuotaExceeded if not enough points are left for a call of this priority.
+        :param cost (float): The estimated number of quota points of the call.
+        :param priority (str): The priority of the call, defaults to the priority of the current thread.
+        """
+        priority = priority or self.priority
+        with self.lock:
+            self._refill()
+            floor = self.reserve if priority == BACKGROUND else 0
+            if self.tokens - cost < floor:
+                self.stats[f"denied_{priority}"] += 1
+                raise QuotaExceeded(
+                    f"Spoonacular quota too low for a {priority} call ({self.tokens:.1f} points left)"
+                )
+            self.tokens -= cost
+            self.stats["points_left"] = round(self.tokens, 2)
+
+    def refund(self, cost: float) -> None:
+        """
+        Gives the estimated points of a call back, when the call failed before Spoonacular answered.
+        :param cost (float): The estimated points that were taken for the call.
+        """
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + cost)
+            self.stats["points_left"] = round(self.tokens, 2)
+
+    def record(self, cost: float, response: requests.Response) -> None:
+        """
+        Corrects the bucket with what the call really cost and what Spoonacular says is left.
+        A 402 response means the quota of the day is used up.
+        :param cost (float): The estimated points that were taken for the call.
+        :param response (requests.Response): The response of the call.
+        """
+        spent = header_number(response.headers, "X-API-Quota-Request")
+        left = header_number(response.headers, "X-API-Quota-Left")
+        with self.lock:
+            if spent is not None:
+                self.tokens -= spent - cost
+            self.stats["points_spent"] = round(
+                self.stats["points_spent"] + (cost if spent is None else spent), 2
+            )
+            if left is not None:
+                self.tokens = min(left, self.capacity)
+                self.stats["server_quota_left"] = left
+            if response.status_code == 402:
+                self.tokens = 0
+            self.stats["points_left"] = round(self.tokens, 2)
+
+    def _refill(self) -> None:
+        """
+        Adds the points that were refilled since the last update. Must be called with the lock held.
+        """
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate
+        )
+        self.updated_at = now
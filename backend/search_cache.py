@@ -0,0 +1,197 @@
+### cache of Spoonacular recipe searches, shared by all users ###
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from collections import OrderedDict
+from urllib.parse import urlencode
+import threading
+import time
+
+from storage_codec import get_codec, read_records
+from user_data.file_lock import write_atomic
+
+# Parameters that hold a comma-separated list, the order of the items does not change the search
+LIST_PARAMS = ("diet", "excludeIngredients", "intolerances", "cuisine", "type")
+# Parameters that do not change the results
+IGNORED_PARAMS = ("apiKey",)
+
+
+def canonical_value(name: str, value: Any) -> str:
+    """
+    Returns the normalized text of a parameter value, so equivalent values give the same cache key.
+    Numbers are written the same way (5, "5" and 5.0 are equal), text is trimmed and lowercased,
+    and the items of list parameters are sorted.
+    :param name (str): The name of the parameter.
+    :param value (Any): The value of the parameter.
+    :return (str): The normalized value.
+    """
+    if isinstance(value, (list, tuple)):
+        value = ",".join(str(item) for item in value)
+    if isinstance(value, bool):
+        return str(value).lower()
+    try:
+        return format(float(value), "g")
+    except (TypeError, ValueError):
+        pass
+    text = str(value).strip().lower()
+    if name in LIST_PARAMS:
+        text = ",".join(sorted(item.strip() for item in text.split(",") if item.strip()))
+    return text
+
+
+def canonical_key(params: Dict[str, Any]) -> str:
+    """
+    Returns the cache key of a search: the parameters sorted by name and normalized, without the API key
+    and without empty values, which Spoonacular treats the same as leaving them out.
+    :param params (Dict[str, Any]): The search parameters.
+    :return (str): The cache key.
+    """
+    items = []
+    for name, value in params.items():
+        if name in IGNORED_PARAMS or value is None:
+            continue
+        text = canonical_value(name, value)
+        if text:
+            items.append((name, text))
+    return urlencode(sorted(items))
+
+
+class SearchCache:
+    """
+    Cache of complexSearch results keyed by the normalized search parameters, shared by all users.
+    Results expire after `ttl` seconds, at most `max_size` searches are kept (the least recently used are removed),
+    and the cache is saved to a file so it survives restarts.
+    """
+
+    def __init__(
+        self,
+        file_path: Optional[str] = "backend/meal_data/search_cache.json",
+        ttl: float = 24 * 3600,
+        max_size: int = 1000,
+        codec=None,
+    ) -> None:
+        """
+        Initializes a SearchCache object and loads the results that have not expired from the file.
+        :param file_path (str): The file where the cache is saved, None to keep it in memory only.
+        :param ttl (float): Number of seconds a search result stays fresh.
+        :param max_size (int): Maximum number of search results that are kept.
+        :param codec: The format the file is written in (see storage_codec), compact JSON by default.
+        """
+        self.file_path = file_path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.codec = codec or get_codec("compact")
+        self.lock = threading.Lock()
+        # Cache key -> {"cached_at": unix time, "data": search result}, from least to most recently used
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+        # Counters to tune the time to live and the size of the cache
+        self.stats: Dict[str, Any] = {
+            "hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "evictions": 0,
+            "hit_rate": 0.0,
+        }
+        self.load_from_file()
+
+    def get(self, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Returns the cached result of a search if it is fresh, and counts the hit or miss.
+        :param params (Dict[str, Any]): The search parameters.
+        :return (Dict[str, Any]): The search result, or None if it is not cached or expired.
+        """
+        key = canonical_key(params)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry["cached_at"] > self.ttl:
+                del self.entries[key]
+                self.stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self._count("misses")
+                return None
+            self.entries.move_to_end(key)
+            self._count("hits")
+            return entry["data"]
+
+    def put_many(self, results: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> None:
+        """
+        Stores search results, removes the least recently used results beyond `max_size` and saves the file once.
+        :param results (List[Tuple[Dict[str, Any], Dict[str, Any]]]): The search parameters and result of every search.
+        """
+        if not results:
+            return
+        with self.lock:
+            now = time.time()
+            for params, data in results:
+                key = canonical_key(params)
+                self.entries[key] = {"cached_at": now, "data": data}
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+            self.save_to_file()
+
+    def get_many(
+        self,
+        searches: List[Dict[str, Any]],
+        fetch_many: Callable[[List[Dict[str, Any]]], List[Union[Dict[str, Any], Exception]]],
+    ) -> List[Union[Dict[str, Any], Exception]]:
+        """
+        Returns the results of several searches, from the cache where possible. The other searches are run
+        together with `fetch_many` (equal searches once), and their results are stored. Failed searches are not cached.
+        :param searches (List[Dict[str, Any]]): The parameters of every search.
+        :param fetch_many (Callable): Runs several searches and returns their results (or exceptions) in order.
+        :return (List[Union[Dict[str, Any], Exception]]): The result or exception of every search, in order.
+        """
+        results: List[Union[Dict[str, Any], Exception, None]] = [
+            self.get(params) for params in searches
+        ]
+        # Searches that are the same after normalizing are run once
+        missing: Dict[str, List[int]] = {}
+        for i, result in enumerate(results):
+            if result is None:
+                missing.setdefault(canonical_key(searches[i]), []).append(i)
+        if missing:
+            indexes = list(missing.values())
+            fetched = fetch_many([searches[same[0]] for same in indexes])
+            for same, result in zip(indexes, fetched):
+                for i in same:
+                    results[i] = result
+            self.put_many(
+                [
+                    (searches[same[0]], result)
+                    for same, result in zip(indexes, fetched)
+                    if not isinstance(result, Exception)
+                ]
+            )
+        return results
+
+    def load_from_file(self) -> None:
+        """
+        Loads the cached results that have not expired from the file. Nothing is loaded if the file does not exist.
+        """
+        if self.file_path is None:
+            return
+        try:
+            entries = read_records(self.file_path)
+        except (FileNotFoundError, ValueError):
+            return
+        now = time.time()
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]["cached_at"]):
+            if now - entry["cached_at"] <= self.ttl:
+                self.entries[key] = entry
+
+    def save_to_file(self) -> None:
+        """
+        Saves the cache to the file atomically. Must be called with the lock held.
+        """
+        if self.file_path is not None:
+            write_atomic(self.file_path, self.codec.encode(self.entries))
+
+    def _count(self, counter: str) -> None:
+        """
+        Increments a hit or miss counter and updates the hit rate. Must be called with the lock held.
+        """
+        self.stats[counter] += 1
+        lookups = self.stats["hits"] + self.stats["misses"]
+        self.stats["hit_rate"] = round(self.stats["hits"] / lookups, 3)
@@ -0,0 +1,65 @@
+### coalescing of identical concurrent calls ###
+from typing import Any, Callable, Dict, Hashable
+import threading
+
+
+class Call:
+    """
+    A call that is in flight, with the result or exception that its waiters share.
+    """
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+
+class SingleFlight:
+    """
+    Makes sure that only one call per key is in flight. The first caller makes the call, and callers that ask
+    for the same key while it runs wait for it and get the same result (or the same exception).
+    Nothing is kept after the call is done, so a later call with the same key runs again.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes a SingleFlight object without calls in flight.
+        """
+        self.lock = threading.Lock()
+        self.calls: Dict[Hashable, Call] = {}
+
+        # Counters of the calls that were made and the calls that shared the result of another call
+        self.stats: Dict[str, int] = {"calls": 0, "shared": 0}
+
+    def do(self, key: Hashable, function: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Returns the result of `function(*args, **kwargs)`, shared with the concurrent callers of the same key.
+        :param key (Hashable): The key of the call, equal for calls that give the same result.
+        :param function (Callable): The function that makes the call.
+        :return (Any): The result of the call. The exception of the call is raised for every caller.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = Call()
+                self.stats["calls"] += 1
+                leader = True
+            else:
+                self.stats["shared"] += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = function(*args, **kwargs)
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
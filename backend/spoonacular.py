@@ -0,0 +1,216 @@
+### shared client for the Spoonacular API ###
+from typing import Any, Dict, List, Optional, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from quota_limiter import QuotaLimiter
+from single_flight import SingleFlight
+
+# (connect, read) timeouts in seconds per endpoint. Generating a week plan takes Spoonacular the longest.
+TIMEOUTS: Dict[str, Tuple[float, float]] = {
+    "search": (3.05, 10),
+    "information": (3.05, 10),
+    "informationBulk": (3.05, 20),
+    "mealplanner": (3.05, 20),
+}
+DEFAULT_TIMEOUT: Tuple[float, float] = (3.05, 10)
+
+
+class SpoonacularClient:
+    """
+    Client for the Spoonacular API that is shared by all requests of the app.
+    Connections are kept alive in a pool and reused, every call has a connect and read timeout,
+    and transient failures (connection errors and 5xx responses) are retried with exponential backoff.
+    Independent calls can be run concurrently on a worker pool of the same size as the connection pool.
+    With a quota limiter, every call first takes its quota points, see QuotaLimiter.
+    Identical calls that run at the same time are made once and share the response.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = "https://api.spoonacular.com",
+        retries: int = 3,
+        backoff: float = 0.3,
+        pool_size: int = 10,
+        timeouts: Optional[Dict[str, Tuple[float, float]]] = None,
+        limiter: Optional[QuotaLimiter] = None,
+    ) -> None:
+        """
+        Initializes a SpoonacularClient object.
+        :param api_key (str): The Spoonacular API key, added to every call.
+        :param base_url (str): The URL of the API, can point to a local stand-in server.
+        :param retries (int): How many times a failed call is retried.
+        :param backoff (float): Backoff factor in seconds, retry n waits backoff * 2 ** (n - 1) seconds.
+        :param pool_size (int): The number of connections that are kept open, and of calls that run concurrently.
+        :param timeouts (Dict[str, Tuple[float, float]]): (connect, read) timeouts per endpoint, see TIMEOUTS.
+        :param limiter (QuotaLimiter): Optional limiter of the daily quota points.
+        """
+        self.api_key = api_key
+        self.limiter = limiter
+        self.base_url = base_url.rstrip("/")
+        self.timeouts = {**TIMEOUTS, **(timeouts or {})}
+
+        # 429 (quota exceeded) is not retried, a retry would only use more of the quota
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="spoonacular"
+        )
+        self.flight = SingleFlight()
+
+    def get(
+        self,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        endpoint: str = "",
+        cost: float = 1,
+    ) -> requests.Response:
+        """
+        Calls an endpoint of the API with the API key added to the parameters.
+        A call that is the same as a call in flight with the same priority waits for that call and gets the same response.
+        Raises a requests.RequestException if the call still fails after the retries,
+        or a QuotaExceeded (also a RequestException) if the quota left is too low for the call.
+        :param path (str): The path of the endpoint, for example /recipes/complexSearch.
+        :param params (Dict[str, Any]): The query parameters.
+        :param endpoint (str): The name of the endpoint in the timeout table.
+        :param cost (float): The estimated number of quota points of the call.
+        :return (requests.Response): The response, which can still have an error status like 402 or 404.
+        """
+        # The priority is part of the key: the QuotaExceeded of a background call must not reach
+        # an interactive call, which the limiter may still admit
+        key = (
+            path,
+            tuple(sorted((name, str(value)) for name, value in (params or {}).items())),
+            self.limiter.priority if self.limiter is not None else None,
+        )
+        return self.flight.do(key, self._get, path, params, endpoint, cost)
+
+    def _get(
+        self, path: str, params: Optional[Dict[str, Any]], endpoint: str, cost: float
+    ) -> requests.Response:
+        """
+        Makes a call of `get`, after taking its quota points.
+        """
+        if self.limiter is not None:
+            self.limiter.acquire(cost)
+        try:
+            response = self.session.get(
+                self.base_url + path,
+                params={**(params or {}), "apiKey": self.api_key},
+                timeout=self.timeouts.get(endpoint, DEFAULT_TIMEOUT),
+            )
+        except requests.RequestException:
+            if self.limiter is not None:
+                self.limiter.refund(cost)
+            raise
+        if self.limiter is not None:
+            self.limiter.record(cost, response)
+        return response
+
+    def search_recipes(self, params: Dict[str, Any]) -> requests.Response:
+        """
+        Searches recipes with /recipes/complexSearch.
+        :param params (Dict[str, Any]): The search parameters.
+        :return (requests.Response): The response.
+        """
+        # One point per search and 0.01 points per returned recipe, plus 0.025 points per recipe
+        # for the recipe information and again for the nutrition when they are asked inline
+        number = int(params.get("number", 10))
+        cost = 1 + 0.01 * number
+        if params.get("addRecipeInformation") or params.get("addRecipeNutrition"):
+            cost += 0.025 * number
+        if params.get("addRecipeNutrition"):
+            cost += 0.025 * number
+        return self.get("/recipes/complexSearch", params, "search", cost)
+
+    def search_many(
+        self, searches: List[Dict[str, Any]]
+    ) -> List[Union[requests.Response, Exception]]:
+        """
+        Runs several searches concurrently, so the total time is close to that of the slowest search.
+        :param searches (List[Dict[str, Any]]): The search parameters of every search.
+        :return (List[Union[requests.Response, Exception]]): The response of every search, in the same order.
+            A search that failed gives its exception instead, so one failure does not lose the other results.
+        """
+        # The worker threads make the calls with the priority of the calling thread
+        priority = self.limiter.priority if self.limiter is not None else None
+        futures = [
+            self.executor.submit(self._search_with_priority, params, priority)
+            for params in searches
+        ]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def recipe_information(
+        self, recipe_id, include_nutrition: bool = False
+    ) -> requests.Response:
+        """
+        Gets the information of a recipe with /recipes/{id}/information.
+        :param recipe_id (int | str): The id of the recipe.
+        :param include_nutrition (bool): Whether the nutrition of the recipe should be included.
+        :return (requests.Response): The response.
+        """
+        params = {"includeNutrition": True} if include_nutrition else {}
+        return self.get(f"/recipes/{recipe_id}/information", params, "information")
+
+    def recipe_information_bulk(
+        self, recipe_ids: List, include_nutrition: bool = False
+    ) -> requests.Response:
+        """
+        Gets the information of several recipes in one call with /recipes/informationBulk.
+        :param recipe_ids (List[int | str]): The ids of the recipes.
+        :param include_nutrition (bool): Whether the nutrition of the recipes should be included.
+        :return (requests.Response): The response, with a list of the recipes that were found.
+        """
+        params = {"ids": ",".join(str(recipe_id) for recipe_id in recipe_ids)}
+        if include_nutrition:
+            params["includeNutrition"] = True
+        # One point for the first recipe and half a point for every other recipe
+        cost = 1 + 0.5 * (len(recipe_ids) - 1)
+        return self.get("/recipes/informationBulk", params, "informationBulk", cost)
+
+    def generate_mealplan(self, params: Dict[str, Any]) -> requests.Response:
+        """
+        Generates a day or week meal plan with /mealplanner/generate.
+        :param params (Dict[str, Any]): The meal plan parameters.
+        :return (requests.Response): The response.
+        """
+        return self.get("/mealplanner/generate", params, "mealplanner")
+
+    def _search_with_priority(
+        self, params: Dict[str, Any], priority: Optional[str]
+    ) -> requests.Response:
+        """
+        Runs a search on a worker thread with the priority of the thread that started it.
+        """
+        if priority is None:
+            return self.search_recipes(params)
+        with self.limiter.prioritized(priority):
+            return self.search_recipes(params)
+
+    def close(self) -> None:
+        """
+        Stops the worker pool and closes the pooled connections.
+        """
+        self.executor.shutdown(wait=False)
+        self.session.close()
@@ -0,0 +1,617 @@
+### local stand-in server for the Spoonacular and Groq APIs ###
+# Run from the repository root with: python backend/stand_in.py --port 8000
+# and point the app to it in the .env file:
+#     SPOONACULAR_BASE_URL=http://localhost:8000
+#     GROQ_BASE_URL=http://localhost:8000
+# It answers the endpoints that app.py uses with made up but stable data, after an optional latency and
+# with optional injected errors. In record mode it forwards the calls to the real APIs and saves the
+# responses as fixtures, which replay mode serves again without network or quota.
+from typing import Any, Dict, List, Optional, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from search_cache import canonical_key
+
+SYNTHETIC = "synthetic"
+REPLAY = "replay"
+RECORD = "record"
+MODES = (SYNTHETIC, REPLAY, RECORD)
+
+SPOONACULAR_URL = "https://api.spoonacular.com"
+GROQ_URL = "https://api.groq.com"
+GROQ_CHAT_PATH = "/openai/v1/chat/completions"
+
+# Quota points of the Spoonacular endpoints, the same estimates the client uses
+SEARCH_POINTS = 1
+RESULT_POINTS = 0.01
+INLINE_POINTS = 0.025
+INFORMATION_POINTS = 1
+BULK_EXTRA_POINTS = 0.5
+
+DISHES = ["Soup", "Salad", "Bowl", "Stew", "Pasta", "Omelette", "Curry", "Toast", "Wrap"]
+INGREDIENTS = ["Spinach", "Lentil", "Salmon", "Chickpea", "Quinoa", "Broccoli", "Egg", "Tofu"]
+DISH_TYPES = ["breakfast", "main course", "side dish", "salad", "soup", "snack", "bread"]
+DIETS = ["gluten free", "vegetarian", "vegan", "dairy free", "pescatarian"]
+SEARCH_FIELDS = ("id", "title", "image", "imageType")
+MEALPLAN_FIELDS = ("id", "imageType", "title", "readyInMinutes", "servings", "sourceUrl")
+WEEK = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+# Nutrients of the made up recipes: name, unit and the range of the amount per serving
+NUTRIENTS: List[Tuple[str, str, float, float]] = [
+    ("Calories", "kcal", 150, 900),
+    ("Fat", "g", 2, 45),
+    ("Carbohydrates", "g", 5, 110),
+    ("Protein", "g", 3, 50),
+    ("Fiber", "g", 0, 15),
+    ("Sugar", "g", 0, 30),
+    ("Iron", "mg", 0, 12),
+    ("Calcium", "mg", 10, 500),
+    ("Magnesium", "mg", 10, 200),
+    ("Zinc", "mg", 0, 8),
+    ("Vitamin C", "mg", 0, 90),
+    ("Vitamin D", "µg", 0, 10),
+    ("Vitamin B12", "µg", 0, 5),
+    ("Folate", "µg", 10, 300),
+]
+
+
+def seeded(*parts: Any) -> random.Random:
+    """
+    Returns a random generator that gives the same numbers for the same parts, also after a restart.
+    """
+    return random.Random(zlib.crc32(repr(parts).encode()))
+
+
+def make_recipe(recipe_id: int, include_nutrition: bool = False) -> Dict[str, Any]:
+    """
+    Returns the made up information of a recipe, always the same for the same id.
+    :param recipe_id (int): The id of the recipe.
+    :param include_nutrition (bool): Whether the nutrition is included, like includeNutrition of Spoonacular.
+    :return (Dict[str, Any]): The recipe information in the format of /recipes/{id}/information.
+    """
+    rng = seeded("recipe", recipe_id)
+    ingredients = rng.sample(INGREDIENTS, 3)
+    recipe = {
+        "id": recipe_id,
+        "title": f"{ingredients[0]} {rng.choice(DISHES)}",
+        "image": f"https://img.spoonacular.com/recipes/{recipe_id}-556x370.jpg",
+        "imageType": "jpg",
+        "readyInMinutes": rng.randrange(5, 90, 5),
+        "servings": rng.randint(1, 6),
+        "sourceUrl": f"https://example.com/recipes/{recipe_id}",
+        "dishTypes": rng.sample(DISH_TYPES, 2),
+        "diets": rng.sample(DIETS, rng.randint(0, 2)),
+        "extendedIngredients": [
+            {
+                "id": i,
+                "name": name.lower(),
+                "original": f"{rng.randint(1, 3)} cups {name.lower()}",
+            }
+            for i, name in enumerate(ingredients)
+        ],
+        "analyzedInstructions": [
+            {
+                "name": "",
+                "steps": [
+                    {"number": i + 1, "step": f"Prepare the {name.lower()}."}
+                    for i, name in enumerate(ingredients)
+                ],
+            }
+        ],
+    }
+    if include_nutrition:
+        recipe["nutrition"] = {
+            "nutrients": [
+                {"name": name, "amount": round(rng.uniform(low, high), 2), "unit": unit}
+                for name, unit, low, high in NUTRIENTS
+            ]
+        }
+    return recipe
+
+
+def failure(status: int, message: str) -> Dict[str, Any]:
+    """
+    Returns an error body in the format of Spoonacular.
+    """
+    return {"status": "failure", "code": status, "message": message}
+
+
+def is_true(value: Optional[str]) -> bool:
+    """
+    Checks whether a query parameter is set to true.
+    """
+    return str(value).lower() in ("true", "1")
+
+
+def complex_search(params: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Returns made up results of /recipes/complexSearch. The same search gives the same recipes,
+    and `offset` and `number` page through them.
+    """
+    number = min(int(float(params.get("number", 10))), 100)
+    offset = int(float(params.get("offset", 0)))
+    search = {
+        name: value for name, value in params.items() if name not in ("number", "offset")
+    }
+    first_id = 1000 + zlib.crc32(canonical_key(search).encode()) % 900000
+    total = 50
+    results = []
+    for recipe_id in range(first_id + offset, first_id + min(offset + number, total)):
+        recipe = make_recipe(recipe_id, is_true(params.get("addRecipeNutrition")))
+        if is_true(params.get("addRecipeInformation")) or "nutrition" in recipe:
+            results.append(recipe)
+        else:
+            results.append({key: recipe[key] for key in SEARCH_FIELDS})
+    return {
+        "results": results,
+        "offset": offset,
+        "number": number,
+        "totalResults": total,
+    }
+
+
+def generate_mealplan(params: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Returns a made up day or week plan in the format of /mealplanner/generate.
+    """
+    rng = seeded("mealplan", canonical_key(params))
+
+    def day_plan() -> Dict[str, Any]:
+        meals = []
+        for _ in range(3):
+            recipe = make_recipe(rng.randint(1000, 900999))
+            meals.append({key: recipe[key] for key in MEALPLAN_FIELDS})
+        nutrients = {
+            "calories": round(rng.uniform(1500, 2500), 2),
+            "protein": round(rng.uniform(50, 150), 2),
+            "fat": round(rng.uniform(40, 100), 2),
+            "carbohydrates": round(rng.uniform(150, 300), 2),
+        }
+        return {"meals": meals, "nutrients": nutrients}
+
+    if params.get("timeFrame") == "week":
+        return {"week": {day: day_plan() for day in WEEK}}
+    return day_plan()
+
+
+def chat_completion(body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns a made up Groq chat completion. JSON mode requests for "deficiencies" get a structured symptom
+    analysis, other requests get a symptom analysis in the format that analyze_symptoms asks for.
+    """
+    messages = body.get("messages", [])
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    rng = seeded("chat", prompt)
+    json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+    if json_mode and '"deficiencies"' in prompt:
+        content = json.dumps(
+            {
+                "deficiencies": [
+                    {
+                        "nutrient": nutrient,
+                        "why": f"A lack of {nutrient} can cause these symptoms.",
+                        "foods": [name.lower() for name in rng.sample(INGREDIENTS, 3)],
+                        "tip": "Eat one of these foods every day.",
+                    }
+                    for nutrient in rng.sample(["Iron", "VitaminD", "Magnesium", "Zinc"], 3)
+                ],
+                "urgency_note": None,
+            }
+        )
+    else:
+        blocks = []
+        for nutrient in rng.sample(["Iron", "VitaminD", "Magnesium", "Zinc"], 3):
+            foods = ", ".join(name.lower() for name in rng.sample(INGREDIENTS, 3))
+            blocks.append(
+                f"{nutrient}:\n- Why: A lack of {nutrient} can cause these symptoms.\n"
+                f"- Foods: {foods}\n- Tip: Eat one of these foods every day."
+            )
+        content = "\n\n".join(blocks)
+    return {
+        "id": f"chatcmpl-{rng.getrandbits(32):08x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stand-in"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+                "logprobs": None,
+            }
+        ],
+        "usage": {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (len(prompt) + len(content)) // 4,
+        },
+    }
+
+
+def completion_chunks(completion: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Splits a made up chat completion into the chunks of a streamed completion, about one word per chunk.
+    """
+    content = completion["choices"][0]["message"]["content"]
+    pieces = re.findall(r"\S*\s*", content)
+    chunks = []
+    for i, piece in enumerate([piece for piece in pieces if piece]):
+        delta = {"role": "assistant", "content": piece} if i == 0 else {"content": piece}
+        chunks.append({"index": 0, "delta": delta, "finish_reason": None})
+    chunks.append({"index": 0, "delta": {}, "finish_reason": "stop"})
+    return [
+        {
+            "id": completion["id"],
+            "object": "chat.completion.chunk",
+            "created": completion["created"],
+            "model": completion["model"],
+            "choices": [choice],
+        }
+        for choice in chunks
+    ]
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    HTTP server that stands in for the Spoonacular and Groq APIs. See the top of this file.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int] = ("127.0.0.1", 8000),
+        mode: str = SYNTHETIC,
+        fixtures_dir: str = "backend/tests/fixtures/stand_in",
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        daily_quota: float = 150,
+        seed: Optional[int] = None,
+        spoonacular_url: str = SPOONACULAR_URL,
+        groq_url: str = GROQ_URL,
+        token_delay: float = 0.0,
+    ) -> None:
+        """
+        Initializes a StandInServer object, call serve_forever (or use start_server) to answer requests.
+        :param address (Tuple[str, int]): The host and port, port 0 picks a free port.
+        :param mode (str): synthetic (made up data), replay (fixtures, made up data for the other calls)
+            or record (forward to the real APIs and save the responses as fixtures).
+        :param fixtures_dir (str): The directory of the recorded responses.
+        :param latency (float): Seconds every answer is delayed.
+        :param jitter (float): Up to this many extra seconds are added to the latency at random.
+        :param error_rate (float): The part of the calls (0 to 1) that get `error_status` instead of an answer.
+        :param error_status (int): The status of the injected errors, for example 500, 429 or 402.
+        :param daily_quota (float): The Spoonacular quota points reported in the X-API-Quota-Left header.
+        :param seed (int): Seed of the latency jitter and the injected errors, to repeat a run.
+        :param spoonacular_url (str): The Spoonacular API that record mode forwards to.
+        :param groq_url (str): The Groq API that record mode forwards to.
+        :param token_delay (float): Seconds between the chunks of a streamed chat completion, the latency
+            is then the time to the first chunk. A chat completion without streaming waits for all chunks.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode {mode!r}, choose one of {', '.join(MODES)}")
+        super().__init__(address, StandInHandler)
+        self.mode = mode
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.quota_left = daily_quota
+        self.spoonacular_url = spoonacular_url.rstrip("/")
+        self.groq_url = groq_url.rstrip("/")
+        self.token_delay = token_delay
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.stats: Dict[str, int] = {"requests": 0, "errors": 0, "replayed": 0, "recorded": 0}
+
+    @property
+    def url(self) -> str:
+        """
+        The base URL of the server, to use as SPOONACULAR_BASE_URL and GROQ_BASE_URL.
+        """
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def fixture_path(self, key: str) -> str:
+        """
+        Returns the file of the recorded response of a request key.
+        """
+        name = hashlib.sha1(key.encode()).hexdigest()[:16]
+        return os.path.join(self.fixtures_dir, f"{name}.json")
+
+    def load_fixture(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the recorded response of a request key, or None if it was not recorded.
+        """
+        try:
+            with open(self.fixture_path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save_fixture(self, key: str, status: int, content_type: str, body: str) -> None:
+        """
+        Saves a recorded response. The API keys are never part of a fixture.
+        """
+        os.makedirs(self.fixtures_dir, exist_ok=True)
+        with open(self.fixture_path(key), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "request": key,
+                    "status": status,
+                    "content_type": content_type,
+                    "body": body,
+                },
+                f,
+                indent=4,
+            )
+
+    def inject(self) -> Optional[int]:
+        """
+        Waits the latency, and returns the status of an injected error or None if the call should be answered.
+        """
+        with self.lock:
+            self.stats["requests"] += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.stats["errors"] += 1
+        if delay:
+            time.sleep(delay)
+        return self.error_status if failed else None
+
+    def spend(self, points: float) -> Dict[str, str]:
+        """
+        Takes quota points and returns the quota headers of Spoonacular.
+        """
+        with self.lock:
+            self.quota_left = max(self.quota_left - points, 0)
+            return {
+                "X-API-Quota-Request": format(points, "g"),
+                "X-API-Quota-Left": format(self.quota_left, "g"),
+            }
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Answers one request of the stand-in server.
+    """
+
+    server: StandInServer
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query))
+        search = {name: value for name, value in params.items() if name != "apiKey"}
+        self.handle_call(f"GET {url.path}?{canonical_key(search)}", url.path, params, None)
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        key = f"POST {self.path} {json.dumps(body, sort_keys=True)}"
+        self.handle_call(key, self.path, {}, body)
+
+    def handle_call(
+        self, key: str, path: str, params: Dict[str, str], body: Optional[Dict[str, Any]]
+    ) -> None:
+        """
+        Answers a call with a recording, a forwarded call or made up data, depending on the mode.
+        """
+        server = self.server
+        if server.mode == RECORD:
+            self.record(key, path, params, body)
+            return
+
+        status = server.inject()
+        if status is not None:
+            self.send_json(status, failure(status, "Injected error"))
+            return
+
+        if server.mode == REPLAY:
+            fixture = server.load_fixture(key)
+            if fixture is not None:
+                with server.lock:
+                    server.stats["replayed"] += 1
+                self.send(fixture["status"], fixture["content_type"], fixture["body"].encode())
+                return
+
+        answer = self.synthetic(path, params, body)
+        if answer is None:
+            self.send_json(404, failure(404, f"No stand-in for {path}"))
+        else:
+            data, points = answer
+            if path == GROQ_CHAT_PATH:
+                chunks = completion_chunks(data)
+                if body.get("stream"):
+                    self.send_stream(chunks)
+                    return
+                # Without streaming the answer comes when the last part is written
+                time.sleep(server.token_delay * (len(chunks) - 1))
+                self.send_json(200, data)
+            else:
+                self.send_json(200, data, server.spend(points) if points else {})
+
+    def synthetic(
+        self, path: str, params: Dict[str, str], body: Optional[Dict[str, Any]]
+    ) -> Optional[Tuple[Any, float]]:
+        """
+        Returns the made up answer of a call and its quota points, or None if the path is not known.
+        """
+        if path == GROQ_CHAT_PATH and body is not None:
+            return chat_completion(body), 0
+        if path == "/recipes/complexSearch":
+            data = complex_search(params)
+            information = is_true(params.get("addRecipeInformation"))
+            nutrition = is_true(params.get("addRecipeNutrition"))
+            points = RESULT_POINTS + INLINE_POINTS * ((information or nutrition) + nutrition)
+            return data, SEARCH_POINTS + points * len(data["results"])
+        if path == "/recipes/informationBulk":
+            ids = [int(i) for i in params.get("ids", "").split(",") if i.strip()]
+            nutrition = is_true(params.get("includeNutrition"))
+            points = INFORMATION_POINTS + BULK_EXTRA_POINTS * max(len(ids) - 1, 0)
+            return [make_recipe(recipe_id, nutrition) for recipe_id in ids], points
+        match = re.fullmatch(r"/recipes/(\d+)/information", path)
+        if match:
+            nutrition = is_true(params.get("includeNutrition"))
+            return make_recipe(int(match.group(1)), nutrition), INFORMATION_POINTS
+        if path == "/mealplanner/generate":
+            return generate_mealplan(params), INFORMATION_POINTS
+        return None
+
+    def record(
+        self, key: str, path: str, params: Dict[str, str], body: Optional[Dict[str, Any]]
+    ) -> None:
+        """
+        Forwards a call to the real API with the caller's key, answers with the response and saves it as a fixture.
+        """
+        server = self.server
+        try:
+            if body is None:
+                response = requests.get(
+                    server.spoonacular_url + path, params=params, timeout=30
+                )
+            else:
+                response = requests.post(
+                    server.groq_url + path,
+                    json=body,
+                    headers={"Authorization": self.headers.get("Authorization", "")},
+                    timeout=60,
+                )
+        except requests.RequestException as e:
+            self.send_json(502, failure(502, str(e)))
+            return
+        content_type = response.headers.get("Content-Type", "application/json")
+        server.save_fixture(key, response.status_code, content_type, response.text)
+        with server.lock:
+            server.stats["recorded"] += 1
+        headers = {
+            name: response.headers[name]
+            for name in ("X-API-Quota-Request", "X-API-Quota-Left")
+            if name in response.headers
+        }
+        self.send(response.status_code, content_type, response.content, headers)
+
+    def send_json(
+        self, status: int, data: Any, headers: Optional[Dict[str, str]] = None
+    ) -> None:
+        """
+        Sends a JSON answer.
+        """
+        self.send(status, "application/json", json.dumps(data).encode(), headers)
+
+    def send(
+        self, status: int, content_type: str, body: bytes, headers: Optional[Dict[str, str]] = None
+    ) -> None:
+        """
+        Sends an answer with a status, a content type and extra headers.
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, chunks: List[Dict[str, Any]]) -> None:
+        """
+        Sends chunks as server-sent events like a streamed chat completion, `token_delay` seconds apart.
+        The connection is closed after the last event, so no length is needed.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for i, chunk in enumerate(chunks):
+            if i and self.server.token_delay:
+                time.sleep(self.server.token_delay)
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def start_server(port: int = 0, **options: Any) -> StandInServer:
+    """
+    Starts a stand-in server on a background thread, for tests and benchmarks.
+    :param port (int): The port, 0 picks a free port (see StandInServer.url).
+    :param options: The other options of StandInServer.
+    :return (StandInServer): The running server, stop it with shutdown().
+    """
+    server = StandInServer(("127.0.0.1", port), **options)
+    # A short poll interval makes shutdown() return quickly
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the Spoonacular and Groq APIs."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--mode", choices=MODES, default=SYNTHETIC)
+    parser.add_argument("--fixtures", default="backend/tests/fixtures/stand_in")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds every answer is delayed"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="up to this many extra seconds of delay"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="part of the calls that fail (0 to 1)"
+    )
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--daily-quota", type=float, default=150)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--spoonacular-url", default=SPOONACULAR_URL)
+    parser.add_argument("--groq-url", default=GROQ_URL)
+    parser.add_argument(
+        "--token-delay", type=float, default=0.0, help="seconds between streamed chat chunks"
+    )
+    args = parser.parse_args()
+
+    server = StandInServer(
+        (args.host, args.port),
+        mode=args.mode,
+        fixtures_dir=args.fixtures,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        daily_quota=args.daily_quota,
+        seed=args.seed,
+        spoonacular_url=args.spoonacular_url,
+        groq_url=args.groq_url,
+        token_delay=args.token_delay,
+    )
+    print(f"Stand-in server ({args.mode}) on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
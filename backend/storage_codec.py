@@ -0,0 +1,289 @@
+### codecs for the files of the user and meal storage ###
+# Convert a storage file between formats with:
+# python storage_codec.py user_data/users.json user_data/users.rec --codec records
+from typing import Any, Dict, Tuple
+import argparse
+import json
+import re
+import struct
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, the other codecs only need the standard library
+    msgpack = None
+
+
+class RawValue:
+    """
+    A record value that is already encoded as JSON, like a value found by index_records.
+    The JSON and records codecs copy its bytes into their output instead of decoding and encoding it again.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+
+def has_raw(records: Dict[str, Any]) -> bool:
+    """
+    Checks whether any value of the records is a RawValue.
+    """
+    return any(isinstance(value, RawValue) for value in records.values())
+
+
+class JSONCodec:
+    """
+    Stores the records as a JSON object. Pretty-printed by default, so the file stays readable.
+    """
+
+    name = "json"
+
+    def __init__(self, indent: int = 2) -> None:
+        """
+        Initializes a JSONCodec object.
+        :param indent (int): The indentation of the JSON output, None for the most compact output.
+        """
+        self.indent = indent
+
+    def encode(self, records: Dict[str, Any]) -> bytes:
+        if has_raw(records):
+            return self._encode_with_raw(records)
+        if self.indent is None:
+            return json.dumps(records, separators=(",", ":")).encode()
+        return json.dumps(records, indent=self.indent).encode()
+
+    def _encode_with_raw(self, records: Dict[str, Any]) -> bytes:
+        # Writes the top-level object by hand, the same bytes json.dumps writes for the decoded records
+        # when the raw values come from a file in the same format
+        if not records:
+            return b"{}"
+        entries = []
+        for key, value in records.items():
+            if isinstance(value, RawValue):
+                value_bytes = bytes(value.data)
+            elif self.indent is None:
+                value_bytes = json.dumps(value, separators=(",", ":")).encode()
+            else:
+                nested = "\n" + " " * self.indent
+                value_bytes = json.dumps(value, indent=self.indent).replace("\n", nested).encode()
+            separator = b":" if self.indent is None else b": "
+            entries.append(json.dumps(str(key)).encode() + separator + value_bytes)
+        if self.indent is None:
+            return b"{" + b",".join(entries) + b"}"
+        padding = b" " * self.indent
+        return b"{\n" + b",\n".join(padding + entry for entry in entries) + b"\n}"
+
+    def decode(self, data: bytes) -> Dict[str, Any]:
+        return json.loads(data)
+
+    @staticmethod
+    def detect(data: bytes) -> bool:
+        return data.lstrip()[:1] == b"{"
+
+    @staticmethod
+    def index(data: bytes) -> Dict[str, Tuple[int, int]]:
+        # Walks the top-level object once. Every value still has to be parsed to find where it ends,
+        # but no objects are kept, and the character positions are converted to byte positions.
+        text = data.decode()
+        decoder = json.JSONDecoder()
+        index = {}
+        char_position = byte_position = 0
+
+        def to_bytes(position: int) -> int:
+            nonlocal char_position, byte_position
+            byte_position += len(text[char_position:position].encode())
+            char_position = position
+            return byte_position
+
+        position = WHITESPACE.match(text, 0).end()
+        if text[position : position + 1] != "{":
+            raise ValueError("A JSON storage file must contain an object")
+        position = WHITESPACE.match(text, position + 1).end()
+        while text[position : position + 1] != "}":
+            key, position = decoder.raw_decode(text, position)
+            position = WHITESPACE.match(text, position).end() + 1  # skips the colon
+            start = WHITESPACE.match(text, position).end()
+            _, position = decoder.raw_decode(text, start)
+            start_byte = to_bytes(start)
+            index[key] = (start_byte, to_bytes(position) - start_byte)
+            position = WHITESPACE.match(text, position).end()
+            if text[position : position + 1] == ",":
+                position = WHITESPACE.match(text, position + 1).end()
+        return index
+
+
+class RecordsCodec:
+    """
+    Stores the records as length-prefixed binary records: a magic header, then for every record
+    the length and bytes of its key followed by the length and bytes of its compact JSON value.
+    The lengths allow reading a single record without parsing the others.
+    """
+
+    name = "records"
+    MAGIC = b"NSREC1\n"
+    LENGTH = struct.Struct(">I")
+
+    def encode(self, records: Dict[str, Any]) -> bytes:
+        parts = [self.MAGIC]
+        for key, value in records.items():
+            key_bytes = str(key).encode()
+            if isinstance(value, RawValue):
+                value_bytes = bytes(value.data)
+            else:
+                value_bytes = json.dumps(value, separators=(",", ":")).encode()
+            parts.append(self.LENGTH.pack(len(key_bytes)))
+            parts.append(key_bytes)
+            parts.append(self.LENGTH.pack(len(value_bytes)))
+            parts.append(value_bytes)
+        return b"".join(parts)
+
+    def decode(self, data: bytes) -> Dict[str, Any]:
+        view = memoryview(data)
+        position = len(self.MAGIC)
+        records = {}
+        while position < len(view):
+            (key_length,) = self.LENGTH.unpack_from(view, position)
+            position += self.LENGTH.size
+            key = bytes(view[position : position + key_length]).decode()
+            position += key_length
+            (value_length,) = self.LENGTH.unpack_from(view, position)
+            position += self.LENGTH.size
+            records[key] = json.loads(bytes(view[position : position + value_length]))
+            position += value_length
+        return records
+
+    @classmethod
+    def detect(cls, data: bytes) -> bool:
+        return data.startswith(cls.MAGIC)
+
+    def index(self, data: bytes) -> Dict[str, Tuple[int, int]]:
+        # Only hops over the length prefixes, the values are not parsed at all
+        position = len(self.MAGIC)
+        index = {}
+        while position < len(data):
+            (key_length,) = self.LENGTH.unpack_from(data, position)
+            position += self.LENGTH.size
+            key = bytes(data[position : position + key_length]).decode()
+            position += key_length
+            (value_length,) = self.LENGTH.unpack_from(data, position)
+            position += self.LENGTH.size
+            index[key] = (position, value_length)
+            position += value_length
+        return index
+
+
+class MsgpackCodec:
+    """
+    Stores the records as one msgpack map. Needs the optional msgpack package.
+    """
+
+    name = "msgpack"
+
+    def encode(self, records: Dict[str, Any]) -> bytes:
+        records = {
+            key: json.loads(value.data) if isinstance(value, RawValue) else value
+            for key, value in records.items()
+        }
+        return msgpack.packb(records)
+
+    def decode(self, data: bytes) -> Dict[str, Any]:
+        return msgpack.unpackb(data, strict_map_key=False)
+
+    @staticmethod
+    def detect(data: bytes) -> bool:
+        # A msgpack map starts with a fixmap (0x80-0x8f), map16 (0xde) or map32 (0xdf) byte
+        return bool(data) and (0x80 <= data[0] <= 0x8F or data[0] in (0xDE, 0xDF))
+
+
+WHITESPACE = re.compile(r"\s*")
+
+# The codecs that can be picked by name, "compact" is JSON without any whitespace.
+CODECS = {
+    "json": lambda: JSONCodec(),
+    "compact": lambda: JSONCodec(indent=None),
+    "records": lambda: RecordsCodec(),
+    "msgpack": lambda: MsgpackCodec(),
+}
+
+
+def get_codec(name: str = "json"):
+    """
+    Returns the codec with the given name.
+    Raises a ValueError if the codec does not exist or its optional package is not installed.
+    :param name (str): The name of the codec (json, compact, records or msgpack).
+    :return: The codec object.
+    """
+    factory = CODECS.get(name.lower())
+    if factory is None:
+        raise ValueError(f"Unknown storage codec '{name}', choose one of: {', '.join(CODECS)}")
+    if name.lower() == "msgpack" and msgpack is None:
+        raise ValueError("The msgpack codec needs the msgpack package: pip install msgpack")
+    return factory()
+
+
+def decode_any(data: bytes) -> Dict[str, Any]:
+    """
+    Decodes stored records, detecting the format they were written in.
+    An empty file decodes to no records.
+    :param data (bytes): The content of the storage file.
+    :return (Dict[str, Any]): The decoded records.
+    """
+    if not data.strip():
+        return {}
+    if RecordsCodec.detect(data):
+        return RecordsCodec().decode(data)
+    if msgpack is not None and MsgpackCodec.detect(data):
+        return MsgpackCodec().decode(data)
+    return JSONCodec().decode(data)
+
+
+def index_records(data) -> Dict[str, Tuple[int, int]]:
+    """
+    Finds where the value of every record starts and how long it is, without building the records.
+    The value of a record can then be decoded on its own with decode_record.
+    Raises a ValueError for formats that cannot be indexed (msgpack).
+    :param data (bytes): The content of the storage file, for example a memory map.
+    :return (Dict[str, Tuple[int, int]]): The byte offset and length of every value by key.
+    """
+    if not bytes(data[:64]).strip():
+        return {}
+    if RecordsCodec.detect(data[: len(RecordsCodec.MAGIC)]):
+        return RecordsCodec().index(data)
+    if JSONCodec.detect(bytes(data[:64])):
+        return JSONCodec.index(bytes(data))
+    raise ValueError("Only json, compact and records storage files can be indexed")
+
+
+def decode_record(data, offset: int, length: int) -> Any:
+    """
+    Decodes the value of a single record found by index_records.
+    :param data (bytes): The content of the storage file, for example a memory map.
+    :param offset (int): The byte offset of the value.
+    :param length (int): The length of the value in bytes.
+    :return (Any): The decoded value.
+    """
+    return json.loads(data[offset : offset + length])
+
+
+def read_records(path: str) -> Dict[str, Any]:
+    """
+    Reads and decodes a storage file in any supported format.
+    :param path (str): The path of the storage file.
+    :return (Dict[str, Any]): The decoded records.
+    """
+    with open(path, "rb") as file:
+        return decode_any(file.read())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a storage file to another format.")
+    parser.add_argument("input", help="storage file in any supported format")
+    parser.add_argument("output", help="path of the converted file")
+    parser.add_argument("--codec", default="records", choices=sorted(CODECS))
+    args = parser.parse_args()
+
+    records = read_records(args.input)
+    with open(args.output, "wb") as file:
+        file.write(get_codec(args.codec).encode(records))
+    print(f"Converted {len(records)} records from {args.input} to {args.output} ({args.codec})")
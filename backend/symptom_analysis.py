@@ -0,0 +1,395 @@
+### memoized symptom analysis ###
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+import hashlib
+import json
+import os
+import re
+import threading
+
+from single_flight import SingleFlight
+from user_data.user_profile import UserProfile
+
+NUTRIENT_INFO_FILE = os.path.join(os.path.dirname(__file__), "data", "nutrient_info.json")
+SYNONYMS_FILE = os.path.join(os.path.dirname(__file__), "data", "symptom_synonyms.json")
+# Words in front of a symptom that do not change it, like "feeling dizzy"
+FILLER_WORDS = ("feeling", "having", "a", "constant", "always", "very")
+
+# The profile fields that are part of the analysis prompt. A change of one of them makes the earlier analyses stale
+PROMPT_FIELDS = (
+    "name",
+    "age",
+    "sex",
+    "height",
+    "weight",
+    "skin_color",
+    "medication",
+    "existing_conditions",
+    "allergies",
+    "diet",
+)
+
+
+class SymptomVocabulary:
+    """
+    Turns the symptoms typed by a user into a canonical key: lowercase, trimmed, without duplicates, sorted,
+    and with synonyms replaced by one symptom, so "Hair loss,fatigue" and "tired, hair loss" give the same key.
+    The vocabulary is seeded from the symptoms of nutrient_info.json, with the synonyms of symptom_synonyms.json.
+    """
+
+    def __init__(self, nutrient_info_path: str = NUTRIENT_INFO_FILE, synonyms_path: str = SYNONYMS_FILE) -> None:
+        """
+        Initializes a SymptomVocabulary object from the data files.
+        :param nutrient_info_path (str): The nutrient information, every nutrient has a list of symptoms.
+        :param synonyms_path (str): Canonical symptom -> list of symptoms that mean the same.
+        """
+        with open(nutrient_info_path, "r", encoding="utf-8") as f:
+            nutrient_info = json.load(f)
+        with open(synonyms_path, "r", encoding="utf-8") as f:
+            synonyms = json.load(f)
+        # Cleaned symptom -> canonical symptom
+        self.canonical_of: Dict[str, str] = {}
+        for info in nutrient_info.values():
+            for symptom in info.get("symptoms", []):
+                cleaned = clean_symptom(symptom)
+                self.canonical_of.setdefault(cleaned, cleaned)
+        for canonical, others in synonyms.items():
+            if canonical.startswith("_"):
+                continue
+            canonical = clean_symptom(canonical)
+            self.canonical_of[canonical] = canonical
+            for other in others:
+                self.canonical_of[clean_symptom(other)] = canonical
+
+    def canonical(self, raw: str) -> str:
+        """
+        Returns the canonical key of the symptoms typed by a user. Unknown symptoms are kept, cleaned.
+        :param raw (str): The symptoms from the search form, separated by commas.
+        :return (str): The canonical symptoms, sorted and joined by ", ".
+        """
+        symptoms = set()
+        for part in re.split(r"[,;]", str(raw or "")):
+            cleaned = clean_symptom(part)
+            if cleaned:
+                symptoms.add(self.lookup(cleaned))
+        return ", ".join(sorted(symptoms))
+
+    def lookup(self, symptom: str) -> str:
+        """
+        Returns the canonical symptom of a cleaned symptom, also for its singular or plural form and without
+        words like "feeling", or the symptom itself if it is not known.
+        """
+        candidates = [symptom, symptom[:-1] if symptom.endswith("s") else symptom + "s"]
+        for prefix in FILLER_WORDS:
+            if symptom.startswith(prefix + " "):
+                candidates.append(self.lookup(symptom[len(prefix) + 1 :]))
+        for candidate in candidates:
+            if candidate in self.canonical_of:
+                return self.canonical_of[candidate]
+        return symptom
+
+
+def clean_symptom(symptom: str) -> str:
+    """
+    Returns a symptom in lowercase, without text between brackets, punctuation and extra spaces.
+    """
+    symptom = re.sub(r"\([^)]*\)", " ", str(symptom).lower())
+    symptom = re.sub(r"[^\w\s']", " ", symptom)
+    return " ".join(symptom.split())
+
+
+def rekey_analyses(user: UserProfile, vocabulary: SymptomVocabulary) -> bool:
+    """
+    Moves the stored analyses of a user to their canonical symptom keys. Analyses that end up under the same key
+    are merged: the one made for the current profile comes first, and the others fill in the missing fields.
+    :param user (UserProfile): The user profile.
+    :param vocabulary (SymptomVocabulary): The vocabulary of the canonical keys.
+    :return (bool): True if a key changed, the caller then has to save the profile.
+    """
+    fingerprint = profile_fingerprint(user)
+    merged: Dict[str, Dict[str, Any]] = {}
+    changed = False
+    # Entries of the current profile first, so their fields win
+    entries = sorted(
+        user.symptom_analysis.items(),
+        key=lambda item: isinstance(item[1], dict) and item[1].get("fingerprint") != fingerprint,
+    )
+    for symptoms, entry in entries:
+        key = vocabulary.canonical(symptoms)
+        changed = changed or key != symptoms
+        if not isinstance(entry, dict) or not key:
+            changed = True
+            continue
+        target = merged.setdefault(key, {})
+        if target and target.get("fingerprint") != entry.get("fingerprint"):
+            # The fields of an older profile are not mixed into the analysis of another one
+            continue
+        for name, value in entry.items():
+            target.setdefault(name, value)
+    if changed:
+        user.symptom_analysis = merged
+    return changed
+
+
+def rekey_all(users_data: Any, vocabulary: SymptomVocabulary) -> int:
+    """
+    Moves the stored analyses of all users to their canonical symptom keys, see rekey_analyses.
+    :param users_data (UsersData): The user storage.
+    :param vocabulary (SymptomVocabulary): The vocabulary of the canonical keys.
+    :return (int): The number of user profiles that changed.
+    """
+    changed = []
+    for username in list(users_data.users):
+        user = users_data.get_user(username)
+        if user is not None and rekey_analyses(user, vocabulary):
+            changed.append(user)
+    if changed:
+        users_data.save_users(changed)
+    return len(changed)
+
+
+def profile_fingerprint(user: UserProfile) -> str:
+    """
+    Returns a short hash of the profile fields of the analysis prompt, equal for profiles that give the same prompt.
+    :param user (UserProfile): The user profile.
+    :return (str): The fingerprint of the profile.
+    """
+    fields = {field: getattr(user, field, None) for field in PROMPT_FIELDS}
+    encoded = json.dumps(fields, sort_keys=True, default=str)
+    return hashlib.sha1(encoded.encode()).hexdigest()[:16]
+
+
+# The fields of a stored analysis: the text of the results page, and the structured analysis of the
+# recommendations page (deficiencies, foods, tips and daily minimums as a dict)
+TEXT = "analyse"
+STRUCTURED = "structured"
+
+
+class SymptomAnalyses:
+    """
+    The symptom analyses of all routes, keyed on (normalized symptoms, profile fingerprint).
+    An analysis is looked up in memory, then in the analyses stored in the user profile, and only then asked
+    from the LLM, once for concurrent requests of the same key. Failed analyses are not kept.
+    Every analysis has a text and a structured form, which are asked separately (see TEXT and STRUCTURED).
+    With `analyze_stream`, the text can also be streamed while the LLM writes it.
+    """
+
+    def __init__(
+        self,
+        analyze: Callable[[UserProfile, str], Optional[str]],
+        save: Callable[[UserProfile], Any],
+        max_entries: int = 1000,
+        analyze_stream: Optional[Callable[[UserProfile, str], Iterable[str]]] = None,
+        analyze_structured: Optional[Callable[[UserProfile, str], Optional[Dict[str, Any]]]] = None,
+    ) -> None:
+        """
+        Initializes a SymptomAnalyses object with an empty memo.
+        :param analyze (Callable): Asks the LLM for the analysis of a user profile and symptoms, returns None on failure.
+        :param save (Callable): Saves a user profile after a new analysis was stored in it.
+        :param max_entries (int): The maximum number of analyses kept in memory, the least recently used go first.
+        :param analyze_stream (Callable): Asks the LLM for the analysis and yields its text in parts as it is written.
+        :param analyze_structured (Callable): Asks the LLM for the structured analysis, returns None on failure.
+        """
+        self.analyzers = {TEXT: analyze, STRUCTURED: analyze_structured}
+        self.analyze_stream = analyze_stream
+        self.save = save
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.flight = SingleFlight()
+        # (field, symptoms, fingerprint) -> analysis
+        self.memo: "OrderedDict[Tuple[str, str, str], Any]" = OrderedDict()
+
+        # Counters of where the analyses came from
+        self.stats: Dict[str, int] = {
+            "memo_hits": 0,
+            "stored_hits": 0,
+            "llm_calls": 0,
+            "llm_streams": 0,
+            "llm_failures": 0,
+            "invalidations": 0,
+        }
+
+    def get(self, user: UserProfile, symptoms: str, field: str = TEXT) -> Optional[Any]:
+        """
+        Returns the analysis of the symptoms of a user, and stores a new analysis in the user profile.
+        :param user (UserProfile): The user profile.
+        :param symptoms (str): The normalized symptoms.
+        :param field (str): TEXT or STRUCTURED.
+        :return (Any): The analysis, or None if the LLM call failed.
+        """
+        analysis = self.cached(user, symptoms, field)
+        if analysis is not None:
+            return analysis
+
+        fingerprint = profile_fingerprint(user)
+        key = (field, symptoms, fingerprint)
+        analysis = self.flight.do(key, self._ask, key, user, symptoms)
+        if analysis is not None and self._store(user, key, analysis):
+            self.save(user)
+        return analysis
+
+    def put(self, user: UserProfile, symptoms: str, analysis: Any, field: str = TEXT) -> None:
+        """
+        Keeps and stores an analysis that was made in another way, for example the text of a structured analysis.
+        :param user (UserProfile): The user profile.
+        :param symptoms (str): The normalized symptoms.
+        :param analysis (Any): The analysis.
+        :param field (str): TEXT or STRUCTURED.
+        """
+        key = (field, symptoms, profile_fingerprint(user))
+        with self.lock:
+            self._remember(key, analysis)
+        if self._store(user, key, analysis):
+            self.save(user)
+
+    def cached(self, user: UserProfile, symptoms: str, field: str = TEXT) -> Optional[Any]:
+        """
+        Returns the analysis of the symptoms of a user if it is in memory or stored in the user profile.
+        :param user (UserProfile): The user profile.
+        :param symptoms (str): The normalized symptoms.
+        :param field (str): TEXT or STRUCTURED.
+        :return (Any): The analysis, or None if the LLM has to be asked.
+        """
+        fingerprint = profile_fingerprint(user)
+        key = (field, symptoms, fingerprint)
+        with self.lock:
+            analysis = self.memo.get(key)
+            if analysis is not None:
+                self.memo.move_to_end(key)
+                self.stats["memo_hits"] += 1
+        if analysis is not None:
+            # Another user with the same prompt can have asked it, the profile then gets a copy
+            if self._store(user, key, analysis):
+                self.save(user)
+            return analysis
+
+        stored = user.symptom_analysis.get(symptoms)
+        if (
+            isinstance(stored, dict)
+            and stored.get(field)
+            and stored.get("fingerprint", fingerprint) == fingerprint
+        ):
+            with self.lock:
+                self.stats["stored_hits"] += 1
+                self._remember(key, stored[field])
+            return stored[field]
+        return None
+
+    def stream(self, user: UserProfile, symptoms: str) -> Iterator[str]:
+        """
+        Yields the text of the analysis of the symptoms of a user in parts while the LLM writes it, or in one part
+        if it was made before. The complete text is kept and stored in the user profile when the stream ends.
+        An error of the LLM call is raised after the parts that were already yielded.
+        :param user (UserProfile): The user profile.
+        :param symptoms (str): The normalized symptoms.
+        :return (Iterator[str]): The parts of the analysis.
+        """
+        analysis = self.cached(user, symptoms)
+        if analysis is None and self.analyze_stream is None:
+            analysis = self.get(user, symptoms)
+        if analysis is not None:
+            yield analysis
+            return
+
+        with self.lock:
+            self.stats["llm_streams"] += 1
+        parts = []
+        try:
+            for part in self.analyze_stream(user, symptoms):
+                parts.append(part)
+                yield part
+        except Exception:
+            with self.lock:
+                self.stats["llm_failures"] += 1
+            raise
+
+        analysis = "".join(parts)
+        if analysis:
+            self.put(user, symptoms, analysis)
+
+    def invalidate(self, user: UserProfile, old_fingerprint: str) -> bool:
+        """
+        Forgets the analyses of a profile whose prompt fields changed, in memory and in the user profile.
+        The recommended meals of those analyses are removed with them, they depend on the diet and allergies.
+        :param user (UserProfile): The user profile, with the changed fields.
+        :param old_fingerprint (str): The fingerprint of the profile before the change.
+        :return (bool): True if the prompt fields changed, the caller then has to save the profile.
+        """
+        fingerprint = profile_fingerprint(user)
+        if fingerprint == old_fingerprint:
+            return False
+        with self.lock:
+            for key in [key for key in self.memo if key[2] == old_fingerprint]:
+                del self.memo[key]
+            self.stats["invalidations"] += 1
+        user.symptom_analysis = {
+            symptoms: entry
+            for symptoms, entry in user.symptom_analysis.items()
+            if isinstance(entry, dict) and entry.get("fingerprint") == fingerprint
+        }
+        return True
+
+    def _ask(self, key: Tuple[str, str, str], user: UserProfile, symptoms: str) -> Optional[Any]:
+        """
+        Asks the LLM for an analysis and keeps it in memory if the call succeeded.
+        """
+        analyze = self.analyzers[key[0]]
+        if analyze is None:
+            return None
+        with self.lock:
+            self.stats["llm_calls"] += 1
+        analysis = analyze(user, symptoms)
+        with self.lock:
+            if analysis is None:
+                self.stats["llm_failures"] += 1
+            else:
+                self._remember(key, analysis)
+        return analysis
+
+    def _remember(self, key: Tuple[str, str, str], analysis: Any) -> None:
+        """
+        Keeps an analysis in memory and removes the least recently used ones beyond `max_entries`.
+        Must be called with the lock held.
+        """
+        self.memo[key] = analysis
+        self.memo.move_to_end(key)
+        while len(self.memo) > self.max_entries:
+            self.memo.popitem(last=False)
+
+    @staticmethod
+    def _store(user: UserProfile, key: Tuple[str, str, str], analysis: Any) -> bool:
+        """
+        Stores an analysis in the user profile, next to the other form and the recommended meals of the same symptoms.
+        The analyses of an older fingerprint are replaced.
+        :return (bool): True if the stored analysis changed.
+        """
+        field, symptoms, fingerprint = key
+        entry = user.symptom_analysis.get(symptoms)
+        if not isinstance(entry, dict):
+            entry = user.symptom_analysis[symptoms] = {}
+        if entry.get("fingerprint", fingerprint) != fingerprint:
+            for name in (TEXT, STRUCTURED):
+                entry.pop(name, None)
+        if entry.get(field) == analysis and entry.get("fingerprint") == fingerprint:
+            return False
+        entry[field] = analysis
+        entry["fingerprint"] = fingerprint
+        return True
+
+
+if __name__ == "__main__":
+    # One-time re-keying of the analyses stored before the symptom keys were canonical.
+    # Run from the repository root with the .env of the app: python backend/symptom_analysis.py
+    from dotenv import load_dotenv
+    from user_data.storage import create_users_data
+
+    load_dotenv()
+    storage = create_users_data(
+        os.getenv("USERS_STORAGE", "json"),
+        os.getenv("USERS_FILE"),
+        os.getenv("USERS_BLOB_DIR"),
+        None,
+        os.getenv("STORAGE_CODEC"),
+    )
+    count = rekey_all(storage, SymptomVocabulary())
+    print(f"Re-keyed the symptom analyses of {count} user profiles")
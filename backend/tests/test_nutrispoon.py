@@ -1,10 +1,22 @@
 ### first backend tests file ###
 
-import json, os, pytest
-import time
-from context import app, UserProfile, UsersData
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Tuple
 from unittest.mock import patch, MagicMock
+import json
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
 from flask.testing import FlaskClient
+from groq import Groq
+from pydantic import ValidationError
+import pytest
+import requests
+
+# context adds the backend directory to the Python path, so it is imported before the app modules
+from context import app, UserProfile, UsersData
 from app import (
     app,
     users_data,
@@ -17,7 +29,39 @@ from app import (
     calculate_bmr,
     vitamin_intake
 )
-from dotenv import load_dotenv
+from image_cache import ImageCache, thumbnail_url
+from intake_targets import IntakeTargets
+from meal_data.meal_data import Meal, MealsData
+from meal_data.query_engine import RecipeQueryEngine
+from meal_data.recipe_cache import RecipeCache
+from models.input_output_models import Deficiency, SymptomAnalysis
+from quota_limiter import QuotaLimiter, QuotaExceeded, BACKGROUND
+from search_cache import SearchCache, canonical_key
+from single_flight import SingleFlight
+from spoonacular import SpoonacularClient
+from stand_in import start_server
+from storage_codec import (
+    CODECS,
+    RawValue,
+    get_codec,
+    decode_any,
+    index_records,
+    decode_record,
+)
+from symptom_analysis import (
+    SymptomAnalyses,
+    SymptomVocabulary,
+    profile_fingerprint,
+    rekey_all,
+    rekey_analyses,
+)
+from user_data.blob_store import BlobStore
+from user_data.change_tracking import ChangeTracker
+from user_data.indexed_store import IndexedUsersData
+from user_data.journal import JournaledUsersData
+from user_data.sqlite_store import SQLiteUsersData
+from user_data.storage import STORAGE_ENGINES, create_users_data
+from user_data.write_behind import WriteBehindUsersData
 
 load_dotenv()
 
@@ -54,9 +98,85 @@ def set_users_data() -> UsersData:
     with patch("app.users_data", users_data):
         yield users_data
 
-    # Removes the temporary test file
-    if os.path.exists(test_users_file):
-        os.remove(test_users_file)
+    # Removes the temporary test file and its lock file
+    for path in (test_users_file, test_users_file + ".lock"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@pytest.fixture(autouse=True)
+def set_recipe_cache(tmp_path) -> RecipeCache:
+    """
+    Set up of an empty recipe cache with a temporary meals file, so tests never change meals_database.json,
+    and of a query engine over it.
+    :returns:
+        RecipeCache: The recipe cache that the app uses during the test.
+    """
+    import app as app_module
+
+    recipe_cache = RecipeCache(
+        MealsData(str(tmp_path / "meals.json")),
+        app_module.fetch_recipe_information,
+        fetch_bulk=app_module.fetch_recipe_information_bulk,
+    )
+    with patch("app.recipe_cache", recipe_cache), patch(
+        "app.query_engine", RecipeQueryEngine(recipe_cache.meals_data)
+    ):
+        yield recipe_cache
+
+
+@pytest.fixture(autouse=True)
+def set_search_cache(tmp_path) -> SearchCache:
+    """
+    Set up of an empty search cache with a temporary file, so tests never share cached search results.
+    :returns:
+        SearchCache: The search cache that the app uses during the test.
+    """
+    search_cache = SearchCache(str(tmp_path / "search_cache.json"))
+    with patch("app.search_cache", search_cache):
+        yield search_cache
+
+
+@pytest.fixture(autouse=True)
+def set_quota_limiter() -> QuotaLimiter:
+    """
+    Set up of a full quota limiter, so tests never run out of the quota spent by other tests.
+    :returns:
+        QuotaLimiter: The quota limiter that the Spoonacular client uses during the test.
+    """
+    import app as app_module
+
+    limiter = QuotaLimiter()
+    with patch.object(app_module.spoonacular, "limiter", limiter):
+        yield limiter
+
+
+@pytest.fixture(autouse=True)
+def set_symptom_analyses() -> SymptomAnalyses:
+    """
+    Set up of an empty symptom analysis memo, so tests never get the analyses of other tests.
+    :returns:
+        SymptomAnalyses: The symptom analyses that the app uses during the test.
+    """
+    import app as app_module
+
+    symptom_analyses = SymptomAnalyses(
+        app_module.groq_symptom_analysis,
+        lambda user: app_module.users_data.save_user(user),
+        analyze_stream=app_module.groq_symptom_analysis_stream,
+        analyze_structured=app_module.groq_structured_analysis,
+    )
+    with patch("app.symptom_analyses", symptom_analyses):
+        yield symptom_analyses
+
+
+@pytest.fixture
+def no_streaming() -> None:
+    """
+    Set up of the results page without streaming, so it waits for the complete analysis.
+    """
+    with patch.dict(app.config, {"STREAM_ANALYSIS": False}):
+        yield
 
 
 def set_user_login(client) -> None:
@@ -541,7 +661,7 @@ def test_generate_recipe_structure():
     from app import generate_recipe
 
     with app.app_context():
-        with patch("app.requests.get") as mock_get:
+        with patch("app.spoonacular.session.get") as mock_get:
             mock_get.return_value.status_code = 200
             mock_get.return_value.json.return_value = {
                 "recipes": [{"title": "Test Recipe", "id": 1234}]
@@ -571,7 +691,7 @@ Vitamin D:
         assert len(foods) == 3
 
 
-def test_display_results(client):
+def test_display_results(client, no_streaming):
     """
     Tests if the display_results function and /results route correctly display groq ai's response as in the prompt, so explanation, foods and a tip.
     """
@@ -594,7 +714,7 @@ def test_recipe_details(client):
     """
     Tests if the recipe_details function correctly retrieves the recipe details such as ingredients, nutrients and instructions.
     """
-    with patch("app.requests.get") as test_get:
+    with patch("app.spoonacular.session.get") as test_get:
         test_get.return_value.json.return_value = {
             "title": "test recipe",
             "image": "https://example.com/image.jpg",
@@ -832,16 +952,42 @@ def test_calorie_calculation_for_male(client, set_users_data):
 ###############################################################################
     
 def test_vitamin_intake():
-    test_response = {
-        "vitamin_a": {"minVitaminA": 50},         
-        "zinc": {"minZinc": 40},                   
-        "calcium": {"minCalcium": 30}
-    }
-    
+    """
+    Tests that the minimum amounts come from the intake target table for the age and sex of the user,
+    without asking Groq, and that nutrients without a target are left out.
+    """
+    user = make_test_user()
     with patch("app.client.chat.completions.create") as test_create:
-        test_create.return_value.choices[0].message.content = json.dumps(test_response)
-        result = vitamin_intake(["VitaminA", "Zinc"])
-        assert result == test_response
+        result = vitamin_intake(["VitaminA", "zinc", "vitamin d", "Sodium"], user)
+        test_create.assert_not_called()
+    # A quarter of the daily amounts of a 20 year old woman
+    assert result == {
+        "vitamina": {"minVitaminA": 582.5},
+        "zinc": {"minZinc": 2},
+        "vitamind": {"minVitaminD": 3.8},
+    }
+
+    user.age, user.sex = 75, "Male"
+    assert vitamin_intake(["Iron", "VitaminD"], user) == {
+        "iron": {"minIron": 2},
+        "vitamind": {"minVitaminD": 5},
+    }
+    # Without a profile the adult targets are used, with the higher amount of both sexes
+    assert vitamin_intake(["Iron"]) == {"iron": {"minIron": 4.5}}
+    assert vitamin_intake([]) == {}
+
+
+def test_intake_targets_age_bands():
+    """
+    Tests that ages are put in the right band of the intake target table.
+    """
+    targets = IntakeTargets()
+    assert targets.band(10) == "9-13"
+    assert targets.band(14) == "14-18"
+    assert targets.band("31") == "31-50"
+    assert targets.band(90) == "71+"
+    assert targets.band(None) == "19-30"
+    assert targets.band("unknown") == "19-30"
 
 ###############################################################################
 #                                                                             #
@@ -893,7 +1039,7 @@ def test_spoonacular_builtin_mealplanner_success(client, set_users_data):
         sess["logged_in"] = True
         sess["username"] = "testusername"
 
-    with patch("app.requests.get") as mock_get:
+    with patch("app.spoonacular.session.get") as mock_get:
         mock_get.return_value.status_code = 200
         mock_get.return_value.json.return_value = (
             mock_get.return_value.json.return_value
@@ -933,7 +1079,7 @@ def test_spoonacular_builtin_mealplanner_fail(client, set_users_data):
         sess["logged_in"] = True
         sess["username"] = "testusername"
 
-    with patch("app.requests.get") as mock_get:
+    with patch("app.spoonacular.session.get") as mock_get:
         mock_get.return_value.status_code = 500
         response = client.post(
             "/recommendations/mealplanner/spoonacular",
@@ -963,17 +1109,21 @@ def test_mealplanner_create_nutrient_calculation(client, set_users_data):
         sess["logged_in"] = True
         sess["username"] = "testusername"
 
-    mock_nutrients = {
-        "nutrition": {
-            "nutrients": [
-                {"name": "Calories", "amount": 500},
-                {"name": "Protein", "amount": 30},
-                {"name": "Fat", "amount": 20},
-                {"name": "Carbohydrates", "amount": 50},
-            ]
+    # informationBulk answers with a list of recipes
+    mock_nutrients = [
+        {
+            "id": 123,
+            "nutrition": {
+                "nutrients": [
+                    {"name": "Calories", "amount": 500},
+                    {"name": "Protein", "amount": 30},
+                    {"name": "Fat", "amount": 20},
+                    {"name": "Carbohydrates", "amount": 50},
+                ]
+            },
         }
-    }
-    with patch("app.requests.get") as mock_get:
+    ]
+    with patch("app.spoonacular.session.get") as mock_get:
         mock_get.return_value.json.return_value = mock_nutrients
         mock_get.return_value.status_code = 200
 
@@ -1264,3 +1414,2187 @@ def test_search_bar_info_page(client):
 # test_add_saving(client, set_users_data)
 # test_remove_saving()
 # test_save_results()
+
+
+###############################################################################
+#                                                                             #
+#                        JOURNALED STORAGE TESTS                              #
+#                                                                             #
+###############################################################################
+
+
+def make_test_user(username: str = "testusername") -> UserProfile:
+    """
+    Helper function to create a test user profile.
+    :param username: The username of the test user.
+    :returns:
+        UserProfile: The test user profile.
+    """
+    return UserProfile(
+        username,
+        "testpassword",
+        "Test User",
+        20,
+        "Female",
+        175.0,
+        70.0,
+        "medium",
+        "The Netherlands",
+        "None",
+        "None",
+    )
+
+
+def test_journal_appends_only_changed_fields(tmp_path):
+    """
+    Tests that saving a single user appends a small record with only the changed fields, and that the journal is replayed on startup.
+    """
+    users_file = str(tmp_path / "users.json")
+    storage = JournaledUsersData(users_file)
+    user = make_test_user()
+    user.saved_recipes = []
+    storage.add_user(user)
+
+    user.saved_recipes.append(4)
+    storage.save_user(user)
+
+    with open(storage.journal_path) as journal:
+        records = [json.loads(line) for line in journal]
+    assert records[-1] == {"user": "testusername", "fields": {"saved_recipes": [4]}}
+
+    # Saving without changes does not write anything
+    storage.save_user(user)
+    with open(storage.journal_path) as journal:
+        assert len(journal.readlines()) == len(records)
+
+    reloaded = JournaledUsersData(users_file)
+    assert reloaded.get_user("testusername").saved_recipes == [4]
+
+
+def test_journal_compaction(tmp_path):
+    """
+    Tests that the journal is compacted into the snapshot once it gets too long.
+    """
+    users_file = str(tmp_path / "users.json")
+    storage = JournaledUsersData(users_file, compact_after=4)
+    user = make_test_user()
+    user.saved_recipes = []
+    storage.add_user(user)
+    for recipe_id in range(3):
+        user.saved_recipes.append(recipe_id)
+        storage.save_user(user)
+
+    assert os.path.getsize(storage.journal_path) == 0
+    with open(users_file) as file:
+        assert json.load(file)["testusername"]["saved_recipes"] == [0, 1, 2]
+    assert JournaledUsersData(users_file).get_user("testusername").saved_recipes == [0, 1, 2]
+
+
+###############################################################################
+#                                                                             #
+#                        SQLITE STORAGE TESTS                                 #
+#                                                                             #
+###############################################################################
+
+
+def test_sqlite_storage_keeps_public_api(tmp_path):
+    """
+    Tests that the SQLite storage engine adds, saves, finds and authenticates users like the JSON storage.
+    """
+    storage = SQLiteUsersData(str(tmp_path / "users.db"))
+    user = make_test_user()
+    storage.add_user(user)
+    with pytest.raises(ValueError):
+        storage.add_user(make_test_user())
+
+    user.saved_recipes = [4]
+    storage.save_to_file()
+    storage.close()
+
+    reloaded = SQLiteUsersData(str(tmp_path / "users.db"))
+    assert "testusername" in reloaded.users
+    assert reloaded.get_user("testusername").saved_recipes == [4]
+    assert reloaded.get_user("unknown") is None
+    assert reloaded.user_authentication("testusername", "testpassword") == (
+        True,
+        "Authentication successful",
+    )
+    assert reloaded.user_authentication("unknown", "testpassword")[0] is False
+    reloaded.close()
+
+
+def test_sqlite_migration_from_json(tmp_path):
+    """
+    Tests that the users of a users.json file can be migrated to the SQLite storage engine.
+    """
+    users_file = str(tmp_path / "users.json")
+    json_storage = UsersData(users_file)
+    json_storage.add_user(make_test_user("first"))
+    json_storage.add_user(make_test_user("second"))
+
+    storage = create_users_data("sqlite", str(tmp_path / "users.db"))
+    assert storage.import_json(users_file) == 2
+    assert sorted(storage.users) == ["first", "second"]
+    storage.close()
+
+    with pytest.raises(ValueError):
+        create_users_data("unknown")
+
+
+###############################################################################
+#                                                                             #
+#                        BLOB STORE TESTS                                     #
+#                                                                             #
+###############################################################################
+
+
+def test_blob_fields_are_stored_separately(tmp_path):
+    """
+    Tests that the heavy profile fields are kept out of users.json and are only loaded when they are accessed.
+    """
+    users_file = str(tmp_path / "users.json")
+    storage = UsersData(users_file, BlobStore(str(tmp_path / "blobs")))
+    user = make_test_user()
+    user.mealplan = {"meals": [{"id": 1, "title": "Test Recipe"}]}
+    storage.add_user(user)
+
+    with open(users_file) as file:
+        assert "mealplan" not in json.load(file)["testusername"]
+
+    reloaded = UsersData(users_file, BlobStore(str(tmp_path / "blobs")))
+    reloaded_user = reloaded.get_user("testusername")
+    assert not reloaded_user.is_loaded("mealplan")
+    assert reloaded_user.mealplan == {"meals": [{"id": 1, "title": "Test Recipe"}]}
+    assert reloaded_user.is_loaded("mealplan")
+    assert reloaded_user.symptom_analysis == {}
+
+
+def test_blob_fields_are_only_written_when_changed(tmp_path):
+    """
+    Tests that saving a favorite does not rewrite or load the meal plan blob.
+    """
+    users_file = str(tmp_path / "users.json")
+    blob_store = BlobStore(str(tmp_path / "blobs"))
+    storage = UsersData(users_file, blob_store)
+    user = make_test_user()
+    user.mealplan = {"meals": []}
+    storage.add_user(user)
+
+    reloaded = UsersData(users_file, BlobStore(str(tmp_path / "blobs")))
+    reloaded_user = reloaded.get_user("testusername")
+    with patch.object(BlobStore, "save") as save_blob:
+        reloaded_user.saved_recipes = [4]
+        reloaded.save_user(reloaded_user)
+        save_blob.assert_not_called()
+    assert not reloaded_user.is_loaded("mealplan")
+
+
+
+def test_blob_fields_rewritten_by_another_process_are_reloaded(tmp_path):
+    """
+    Tests that refresh reloads a loaded blob field that another process saved, also when only the blob changed,
+    and that unsaved local changes of a blob field are kept.
+    """
+    for storage_class in (UsersData, JournaledUsersData):
+        users_file = str(tmp_path / storage_class.__name__ / "users.json")
+        blob_dir = str(tmp_path / storage_class.__name__ / "blobs")
+        first = storage_class(users_file, blob_store=BlobStore(blob_dir))
+        first.add_user(make_test_user())
+        second = storage_class(users_file, blob_store=BlobStore(blob_dir))
+
+        first_user = first.get_user("testusername")
+        assert not first_user.mealplan
+        assert first_user.symptom_analysis == {}
+        first_user.symptom_analysis["fatigue"] = {"analyse": "local"}
+
+        second_user = second.get_user("testusername")
+        second_user.mealplan = {"meals": [{"id": 1}]}
+        second_user.symptom_analysis = {"headache": {"analyse": "other"}}
+        second.save_user(second_user)
+
+        first.refresh()
+        assert not first_user.is_loaded("mealplan")
+        assert first_user.mealplan == {"meals": [{"id": 1}]}
+        assert first_user.symptom_analysis == {"fatigue": {"analyse": "local"}}
+
+
+###############################################################################
+#                                                                             #
+#                        WRITE BEHIND TESTS                                   #
+#                                                                             #
+###############################################################################
+
+
+def test_write_behind_merges_saves(tmp_path):
+    """
+    Tests that several quick saves are merged into one physical write by the background flusher.
+    """
+    storage = WriteBehindUsersData(
+        UsersData(str(tmp_path / "users.json")), debounce=0.05, max_delay=1.0
+    )
+    user = make_test_user()
+    user.saved_recipes = []
+    storage.add_user(user)
+    for recipe_id in range(5):
+        user.saved_recipes.append(recipe_id)
+        storage.save_user(user)
+
+    with patch.object(UsersData, "save_users", wraps=storage.storage.save_users) as save_users:
+        time.sleep(0.5)
+        save_users.assert_called_once()
+    assert storage.stats["logical_saves"] == 6
+    assert storage.stats["physical_writes"] == 1
+    assert storage.stats["last_batch"] == 6
+    storage.close()
+
+    assert UsersData(str(tmp_path / "users.json")).get_user("testusername").saved_recipes == [0, 1, 2, 3, 4]
+
+
+def test_create_users_data_sets_write_behind_delays(tmp_path):
+    """
+    Tests that the debounce window and the maximum delay of the background writes can be configured.
+    """
+    storage = create_users_data("json", str(tmp_path / "users.json"), None, 0.1, None, 5)
+    assert isinstance(storage, WriteBehindUsersData)
+    assert (storage.debounce, storage.max_delay) == (0.1, 5)
+    storage.close()
+    storage = create_users_data("json", str(tmp_path / "users.json"), write_delay=0.1)
+    assert storage.max_delay == 2.0
+    storage.close()
+
+
+def test_write_behind_flushes_on_close(tmp_path):
+    """
+    Tests that closing the storage writes the dirty profiles without waiting for the debounce window.
+    """
+    storage = WriteBehindUsersData(
+        UsersData(str(tmp_path / "users.json")), debounce=60, max_delay=60
+    )
+    storage.add_user(make_test_user())
+    assert not os.path.exists(tmp_path / "users.json")
+    storage.close()
+    assert UsersData(str(tmp_path / "users.json")).get_user("testusername") is not None
+
+
+def test_metrics_route(client):
+    """
+    Tests that the metrics page returns the counters as JSON, and only to logged in users.
+    """
+    assert client.get("/metrics").status_code == 302
+    set_user_login(client)
+    response = client.get("/metrics")
+    assert_200(response)
+    assert "users_data" in response.get_json()
+
+
+###############################################################################
+#                                                                             #
+#                        MULTI-PROCESS STORAGE TESTS                          #
+#                                                                             #
+###############################################################################
+
+
+def test_json_storage_merges_changes_of_other_processes(tmp_path):
+    """
+    Tests that two storage objects on the same file (like two worker processes) do not lose each other's updates,
+    and that refresh only updates the changed fields of the loaded profile.
+    """
+    users_file = str(tmp_path / "users.json")
+    first = UsersData(users_file)
+    first.add_user(make_test_user())
+    second = UsersData(users_file)
+
+    first_user = first.get_user("testusername")
+    first_user.saved_recipes = [4]
+    first.save_user(first_user)
+
+    second_user = second.get_user("testusername")
+    second_user.age = 30
+    second.save_user(second_user)
+
+    stored = UsersData(users_file).get_user("testusername")
+    assert stored.saved_recipes == [4]
+    assert stored.age == 30
+
+    first.refresh()
+    assert first.get_user("testusername") is first_user
+    assert first_user.age == 30
+
+
+def test_json_storage_fingerprints_only_after_a_foreign_write(tmp_path):
+    """
+    Tests that loading and saving the JSON file do not fingerprint the profiles, and that after a write
+    of another process a field changed in place locally still wins over the stored one.
+    """
+    users_file = str(tmp_path / "users.json")
+    UsersData(users_file).add_user(make_test_user())
+    with patch.object(ChangeTracker, "fingerprint", wraps=ChangeTracker.fingerprint) as fingerprint:
+        first = UsersData(users_file)
+        first.save_user(first.get_user("testusername"))
+        fingerprint.assert_not_called()
+
+        first_user = first.get_user("testusername")
+        first_user.saved_recipes.append(4)
+        second = UsersData(users_file)
+        second_user = second.get_user("testusername")
+        second_user.saved_recipes = [5]
+        second_user.age = 30
+        second.save_user(second_user)
+
+        first.save_user(first_user)
+        assert fingerprint.called
+    stored = UsersData(users_file).get_user("testusername")
+    assert stored.saved_recipes == [4]
+    assert stored.age == 30
+
+
+def test_storage_engines_start_in_a_new_directory(tmp_path):
+    """
+    Tests that every storage engine starts empty when the directory of its file does not exist yet,
+    and creates it on the first save. The default paths do not depend on the working directory.
+    """
+    for name in STORAGE_ENGINES:
+        directory = tmp_path / name / "missing"
+        file_name = "users.db" if name == "sqlite" else "users.json"
+        storage = create_users_data(name, str(directory / file_name))
+        assert list(storage.users) == []
+        storage.add_user(make_test_user())
+        if hasattr(storage, "close"):
+            storage.close()
+        reloaded = create_users_data(name, str(directory / file_name))
+        assert reloaded.get_user("testusername") is not None
+        if hasattr(reloaded, "close"):
+            reloaded.close()
+    assert os.path.isabs(UsersData.__init__.__defaults__[0])
+
+
+def test_json_storage_write_is_atomic(tmp_path):
+    """
+    Tests that a failing write leaves the previous users file intact.
+    """
+    users_file = str(tmp_path / "users.json")
+    storage = UsersData(users_file)
+    storage.add_user(make_test_user())
+
+    storage.get_user("testusername").age = 30
+    with patch("user_data.file_lock.os.fsync", side_effect=RuntimeError("disk full")):
+        with pytest.raises(RuntimeError):
+            storage.save_to_file()
+    assert UsersData(users_file).get_user("testusername").age == 20
+
+
+def test_journal_and_sqlite_pick_up_changes_of_other_processes(tmp_path):
+    """
+    Tests that the journal and SQLite storage engines see what another storage object on the same files wrote.
+    """
+    for storage_class, file_name in (
+        (JournaledUsersData, "users.json"),
+        (SQLiteUsersData, "users.db"),
+    ):
+        path = str(tmp_path / file_name)
+        first = storage_class(path)
+        first.add_user(make_test_user())
+        second = storage_class(path)
+        second_user = second.get_user("testusername")
+
+        first_user = first.get_user("testusername")
+        first_user.saved_recipes = [4]
+        first.save_user(first_user)
+
+        second.refresh()
+        assert second_user.saved_recipes == [4]
+
+        second_user.age = 30
+        second.save_user(second_user)
+        first.refresh()
+        assert first_user.age == 30
+        assert first_user.saved_recipes == [4]
+
+
+###############################################################################
+#                                                                             #
+#                        STORAGE CODEC TESTS                                  #
+#                                                                             #
+###############################################################################
+
+
+def test_codecs_round_trip_and_are_detected():
+    """
+    Tests that every codec decodes what it encoded, and that the format is detected when decoding.
+    """
+    records = {"testusername": {"age": 20, "saved_recipes": [4], "name": "Tést"}}
+    for name in CODECS:
+        if name == "msgpack":
+            pytest.importorskip("msgpack")
+        codec = get_codec(name)
+        data = codec.encode(records)
+        assert codec.decode(data) == records
+        assert decode_any(data) == records
+    assert decode_any(b"") == {}
+    with pytest.raises(ValueError):
+        get_codec("unknown")
+
+
+def test_users_and_meals_data_with_binary_codec(tmp_path):
+    """
+    Tests that the user and meal storage write the configured format and read it back.
+    """
+    users_file = str(tmp_path / "users.rec")
+    storage = UsersData(users_file, codec=get_codec("records"))
+    storage.add_user(make_test_user())
+    with open(users_file, "rb") as file:
+        assert file.read().startswith(b"NSREC1")
+    # The file is detected as records, even when another codec is configured
+    assert UsersData(users_file).get_user("testusername").name == "Test User"
+
+    meals_file = str(tmp_path / "meals.rec")
+    meals = MealsData(meals_file, codec=get_codec("records"))
+    meals.add_meal(Meal(1, "Test Recipe", "image.jpg", 10, "url", {}, "summary", [], [], "url"))
+    assert MealsData(meals_file).meals[1].title == "Test Recipe"
+
+
+###############################################################################
+#                                                                             #
+#                          COMPACT OBJECT TESTS                               #
+#                                                                             #
+###############################################################################
+
+
+def test_user_profiles_do_not_share_default_containers():
+    """
+    Tests that profiles created without the list and dict fields each get their own containers.
+    """
+    first = make_test_user("first")
+    second = make_test_user("second")
+    first.saved_recipes.append(1)
+    first.symptom_analysis["tired"] = "iron"
+    assert second.saved_recipes == []
+    assert second.symptom_analysis == {}
+
+
+def test_user_profile_and_meal_use_slots():
+    """
+    Tests that user profiles and meals have no per-object __dict__.
+    """
+    user = make_test_user()
+    meal = Meal(1, "Test Recipe", "image.jpg", 10, "url", {}, "summary", [], [], "url")
+    assert not hasattr(user, "__dict__")
+    assert not hasattr(meal, "__dict__")
+    with pytest.raises(AttributeError):
+        user.unknown_field = 1
+    assert meal.to_dict()["title"] == "Test Recipe"
+
+
+def test_user_profile_from_dict_fills_defaults():
+    """
+    Tests that a profile loaded from a stored record gets defaults for missing fields and equals the original.
+    """
+    user = make_test_user()
+    assert UserProfile.from_dict(user.to_dict()).to_dict() == user.to_dict()
+
+    record = user.to_dict(exclude=("saved_recipes", "symptom_analysis"))
+    loaded = UserProfile.from_dict(record)
+    assert loaded.saved_recipes == []
+    assert loaded.symptom_analysis == {}
+    assert loaded.saved_recipes is not UserProfile.from_dict(record).saved_recipes
+
+
+###############################################################################
+#                                                                             #
+#                       INDEXED STORAGE TESTS                                 #
+#                                                                             #
+###############################################################################
+
+
+def test_index_records_finds_every_record():
+    """
+    Tests that every record can be decoded on its own from the index, in the JSON and records formats.
+    """
+    records = {"first": {"name": "Tést"}, "second": {"saved_recipes": [1, 2]}}
+    for name in ("json", "compact", "records"):
+        data = get_codec(name).encode(records)
+        index = index_records(data)
+        assert {key: decode_record(data, *entry) for key, entry in index.items()} == records
+    assert index_records(b"") == {}
+
+
+def test_codecs_copy_raw_values():
+    """
+    Tests that raw values found by index_records are written as they are,
+    and give the same file as the decoded records.
+    """
+    records = {"first": {"name": "Tést", "saved_recipes": [1, 2]}, "second": {}, "third": [{"a": None}]}
+    for name in ("json", "compact", "records"):
+        codec = get_codec(name)
+        data = codec.encode(records)
+        raw = {
+            key: RawValue(data[offset : offset + length])
+            for key, (offset, length) in index_records(data).items()
+        }
+        raw["second"] = {"name": "Changed"}
+        assert codec.encode(raw) == codec.encode({**records, "second": {"name": "Changed"}})
+    assert get_codec("json").encode({"first": RawValue(b"1")}) == b'{\n  "first": 1\n}'
+
+
+def test_indexed_storage_loads_profiles_on_first_lookup(tmp_path):
+    """
+    Tests that the indexed storage engine only decodes the profiles that are asked for and saves the others unchanged.
+    """
+    users_file = str(tmp_path / "users.json")
+    json_storage = UsersData(users_file)
+    json_storage.add_user(make_test_user("first"))
+    json_storage.add_user(make_test_user("second"))
+
+    storage = IndexedUsersData(users_file)
+    assert os.path.exists(users_file + ".idx")
+    assert storage.users.loaded == {}
+    assert sorted(storage.users) == ["first", "second"]
+
+    user = storage.get_user("first")
+    assert list(storage.users.loaded) == ["first"]
+    user.saved_recipes = [4]
+    storage.save_user(user)
+    storage.add_user(make_test_user("third"))
+
+    # The records of profiles that were never loaded are copied without decoding them
+    with patch("user_data.indexed_store.decode_record") as decode, patch(
+        "user_data.user_profile.UserProfile.from_dict"
+    ) as from_dict:
+        storage.add_user(make_test_user("fourth"))
+    decode.assert_not_called()
+    from_dict.assert_not_called()
+
+    reloaded = UsersData(users_file)
+    assert reloaded.get_user("first").saved_recipes == [4]
+    assert reloaded.get_user("second").name == "Test User"
+    assert "third" in reloaded.users
+    storage.close()
+
+
+def test_indexed_storage_reuses_saved_index_and_refreshes(tmp_path):
+    """
+    Tests that a saved index is reused while the file is unchanged, and that changes of another process are picked up.
+    """
+    users_file = str(tmp_path / "users.json")
+    UsersData(users_file).add_user(make_test_user("first"))
+    IndexedUsersData(users_file).close()
+
+    with patch("user_data.indexed_store.index_records") as index:
+        storage = IndexedUsersData(users_file)
+    index.assert_not_called()
+    assert storage.get_user("first").saved_recipes == []
+
+    other = UsersData(users_file)
+    other.get_user("first").saved_recipes = [7]
+    other.add_user(make_test_user("second"))
+    storage.refresh()
+    assert storage.get_user("first").saved_recipes == [7]
+    assert storage.get_user("second") is not None
+    storage.close()
+
+
+###############################################################################
+#                                                                             #
+#                           RECIPE CACHE TESTS                                #
+#                                                                             #
+###############################################################################
+
+
+def make_recipe_information(recipe_id: int = 1, nutrition: bool = True) -> dict:
+    """
+    Helper function to create a Spoonacular recipe information response.
+    :param recipe_id: The id of the recipe.
+    :param nutrition: Whether the response includes the nutrition.
+    :returns:
+        dict: The recipe information.
+    """
+    information = {
+        "id": recipe_id,
+        "title": "Test Recipe",
+        "image": "image.jpg",
+        "readyInMinutes": 10,
+        "extendedIngredients": [{"original": "1 egg"}],
+    }
+    if nutrition:
+        information["nutrition"] = {"nutrients": [{"name": "Calories", "amount": 100}]}
+    return information
+
+
+def test_recipe_cache_reads_through_and_counts(tmp_path):
+    """
+    Tests that a recipe is fetched and stored once, and then served from MealsData.
+    """
+    meals_file = str(tmp_path / "meals.json")
+    fetch = MagicMock(return_value=make_recipe_information())
+    cache = RecipeCache(MealsData(meals_file), fetch)
+
+    assert cache.get(1, include_nutrition=True)["title"] == "Test Recipe"
+    information = cache.get(1)
+    assert information["extendedIngredients"] == [{"original": "1 egg"}]
+    assert fetch.call_count == 1
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+    # The stored recipe is served after a restart as well
+    restarted = RecipeCache(MealsData(meals_file), fetch)
+    assert restarted.get(1, include_nutrition=True)["nutrition"]["nutrients"][0]["amount"] == 100
+    assert fetch.call_count == 1
+
+
+def test_recipe_cache_refetches_stale_or_incomplete_recipes(tmp_path):
+    """
+    Tests that expired recipes and recipes without the needed nutrition are fetched again,
+    and that a stale copy is served when fetching fails.
+    """
+    fetch = MagicMock(return_value=make_recipe_information(nutrition=False))
+    cache = RecipeCache(MealsData(str(tmp_path / "meals.json")), fetch, ttl=60)
+    cache.get(1)
+    fetch.return_value = make_recipe_information()
+    assert "nutrition" in cache.get(1, include_nutrition=True)
+    assert fetch.call_count == 2
+
+    cache.meals_data.get_meal(1).cached_at -= 120
+    fetch.return_value = None
+    assert cache.get(1)["title"] == "Test Recipe"
+    assert cache.stats["stale"] == 2
+    assert cache.stats["fetch_errors"] == 1
+
+
+def test_recipe_cache_fallback_needs_the_nutrition(tmp_path):
+    """
+    Tests that a stale copy without nutrition is not served when fetching fails and the nutrition is needed.
+    """
+    fetch = MagicMock(return_value=make_recipe_information(nutrition=False))
+    cache = RecipeCache(MealsData(str(tmp_path / "meals.json")), fetch)
+    cache.get(1)
+    fetch.return_value = None
+    assert cache.get(1, include_nutrition=True) is None
+    assert cache.stats["fetch_errors"] == 1
+
+
+def test_recipe_details_fail_cleanly_without_stored_nutrition(client, set_recipe_cache):
+    """
+    Tests that the recipe page shows its error page instead of crashing when Spoonacular fails
+    and the stored copy of the recipe has no nutrition, as after saving it to the favorites.
+    """
+    set_user_login(client)
+    set_recipe_cache.meals_data.upsert_meals(
+        [Meal.from_information(make_recipe_information(7, nutrition=False))]
+    )
+    with patch("app.spoonacular.session.get") as get:
+        get.return_value = MagicMock(ok=False, status_code=402)
+        response = client.get("/recipe/7")
+    assert response.status_code == 404
+
+
+def test_add_meals_is_atomic_between_threads(tmp_path):
+    """
+    Tests that only one of several threads adding the same meal succeeds.
+    """
+    meals_data = MealsData(str(tmp_path / "meals.json"))
+    barrier = threading.Barrier(4)
+
+    def add():
+        barrier.wait()
+        try:
+            meals_data.add_meal(Meal.from_information(make_recipe_information(1)))
+            return True
+        except ValueError:
+            return False
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: add(), range(4)))
+    assert results.count(True) == 1
+
+
+def test_meals_file_is_written_atomically_and_recovers(tmp_path):
+    """
+    Tests that the meals file is replaced without leaving temporary files,
+    and that a truncated file is read as no meals instead of failing.
+    """
+    meals_file = str(tmp_path / "meals.json")
+    meals_data = MealsData(meals_file)
+    meals_data.upsert_meals([Meal.from_information(make_recipe_information(1))])
+    meals_data.upsert_meals([Meal.from_information(make_recipe_information(2))])
+    assert sorted(MealsData(meals_file).meals) == [1, 2]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+    with open(meals_file, "rb") as file:
+        data = file.read()
+    with open(meals_file, "wb") as file:
+        file.write(data[: len(data) // 2])
+    restarted = MealsData(meals_file)
+    assert restarted.meals == {}
+    restarted.upsert_meals([Meal.from_information(make_recipe_information(3))])
+    assert sorted(MealsData(meals_file).meals) == [3]
+
+
+def test_recipe_cache_evicts_least_recently_used(tmp_path):
+    """
+    Tests that the cache keeps at most max_size recipes and removes the least recently used one.
+    """
+    fetch = MagicMock(side_effect=lambda recipe_id, nutrition: make_recipe_information(recipe_id))
+    cache = RecipeCache(MealsData(str(tmp_path / "meals.json")), fetch, max_size=2)
+    cache.get(1)
+    cache.get(2)
+    cache.get(1)
+    cache.get(3)
+    assert sorted(cache.meals_data.meals) == [1, 3]
+    assert cache.stats["evictions"] == 1
+    assert sorted(MealsData(cache.meals_data.file_path).meals) == [1, 3]
+
+    # The query engine sees the removal
+    engine = RecipeQueryEngine(cache.meals_data)
+    assert engine.search({"number": 2}) is not None
+    version = cache.meals_data.version
+    assert cache.meals_data.remove_meals([3, 99]) == 1
+    assert cache.meals_data.version == version + 1
+    assert engine.search({"number": 2}) is None
+
+
+def test_recipe_details_uses_recipe_cache(client):
+    """
+    Tests that opening the same recipe twice only calls Spoonacular once, and that the counters are on /metrics.
+    """
+    with patch("app.spoonacular.session.get") as test_get:
+        test_get.return_value.ok = True
+        test_get.return_value.json.return_value = make_recipe_information(12345)
+        assert_200(client.get("/recipe/12345"))
+        assert_200(client.get("/recipe/12345"))
+        assert test_get.call_count == 1
+    set_user_login(client)
+    stats = client.get("/metrics").get_json()["recipe_cache"]
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+
+###############################################################################
+#                                                                             #
+#                          BULK MEALS DATA TESTS                              #
+#                                                                             #
+###############################################################################
+
+
+def make_test_meal(meal_id: int, title: str = "Test Recipe") -> Meal:
+    """
+    Helper function to create a test meal.
+    :param meal_id: The id of the meal.
+    :param title: The title of the meal.
+    :returns:
+        Meal: The test meal.
+    """
+    return Meal(meal_id, title, "image.jpg", 10, "url", {}, "summary", [], [], "url")
+
+
+def test_meals_data_keys_are_ints(tmp_path):
+    """
+    Tests that meals are found by their id as an int or a string, also after loading them from the file.
+    """
+    meals_file = str(tmp_path / "meals.json")
+    MealsData(meals_file).add_meal(make_test_meal("12"))
+    meals = MealsData(meals_file)
+    assert list(meals.meals) == [12]
+    assert meals.get_meal(12).title == "Test Recipe"
+    assert meals.get_meal("12").title == "Test Recipe"
+    assert meals.get_meal("unknown") is None
+
+
+def test_add_and_upsert_meals_write_once(tmp_path):
+    """
+    Tests that the bulk APIs write the file once per batch, and that add_meals adds nothing if an id exists.
+    """
+    meals = MealsData(str(tmp_path / "meals.json"))
+    with patch.object(meals, "save_to_file", wraps=meals.save_to_file) as save:
+        meals.add_meals([make_test_meal(i) for i in range(10)])
+        assert save.call_count == 1
+
+        with pytest.raises(ValueError):
+            meals.add_meals([make_test_meal(20), make_test_meal(5)])
+        assert 20 not in meals.meals
+        with pytest.raises(ValueError):
+            meals.add_meals([make_test_meal(21), make_test_meal(21)])
+
+        added = meals.upsert_meals([make_test_meal(5, "Changed"), make_test_meal(30)])
+        assert added == 1
+        assert save.call_count == 2
+    reloaded = MealsData(meals.file_path)
+    assert len(reloaded.meals) == 11
+    assert reloaded.get_meal(5).title == "Changed"
+
+
+###############################################################################
+#                                                                             #
+#                         SPOONACULAR CLIENT TESTS                            #
+#                                                                             #
+###############################################################################
+
+
+def test_spoonacular_client_adds_key_and_timeouts():
+    """
+    Tests that the client calls the configured base URL with the API key and the timeout of the endpoint.
+    """
+    spoonacular = SpoonacularClient("key", "http://localhost:9999/", timeouts={"search": (1, 2)})
+    with patch.object(spoonacular.session, "get") as get:
+        spoonacular.search_recipes({"type": "soup"})
+        get.assert_called_once_with(
+            "http://localhost:9999/recipes/complexSearch",
+            params={"type": "soup", "apiKey": "key"},
+            timeout=(1, 2),
+        )
+        spoonacular.recipe_information(5, include_nutrition=True)
+        assert get.call_args.args[0] == "http://localhost:9999/recipes/5/information"
+        assert get.call_args.kwargs["params"]["includeNutrition"] is True
+
+
+def test_spoonacular_client_reuses_one_pooled_session():
+    """
+    Tests that the client mounts one retrying, pooled adapter, so connections are reused between calls.
+    """
+    spoonacular = SpoonacularClient("key", retries=2, pool_size=4)
+    adapter = spoonacular.session.get_adapter("https://api.spoonacular.com/recipes/complexSearch")
+    assert adapter.max_retries.total == 2
+    assert 503 in adapter.max_retries.status_forcelist
+    assert 429 not in adapter.max_retries.status_forcelist
+    assert adapter._pool_maxsize == 4
+
+
+def test_recipe_details_survives_spoonacular_timeout(client):
+    """
+    Tests that a timed out call is handled instead of failing the request.
+    """
+    with patch("app.spoonacular.session.get", side_effect=requests.Timeout):
+        response = client.get("/recipe/12345")
+        assert response.status_code == 404
+
+
+def make_symptom_analysis(*nutrients: str) -> SymptomAnalysis:
+    """
+    Helper function to create a structured symptom analysis.
+    :param nutrients: The deficient nutrients, like "Iron".
+    :returns:
+        SymptomAnalysis: The analysis.
+    """
+    return SymptomAnalysis(
+        deficiencies=[Deficiency(nutrient=nutrient) for nutrient in nutrients]
+    )
+
+
+def test_recommendations_searches_run_concurrently(client, set_users_data):
+    """
+    Tests that the nine recommendation searches run at the same time, with the same rotation of the
+    nutrient parameters and the same dedup of recipes per category as when they ran one after another.
+    """
+    set_users_data.add_user(make_test_user())
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+        sess["username"] = "testusername"
+
+    searched = []
+
+    def slow_search(url, params, timeout):
+        time.sleep(0.2)
+        searched.append((params["type"], "minIron" if "minIron" in params else "minZinc"))
+        response = MagicMock()
+        response.json.return_value = {
+            "results": [
+                {"id": 1, "title": "Recipe 1", "image": "1.jpg"},
+                {"id": 2, "title": "Recipe 2", "image": "2.jpg"},
+            ]
+        }
+        return response
+
+    with patch(
+        "app.structured_symptom_analysis",
+        return_value=make_symptom_analysis("Iron", "Zinc"),
+    ), patch("app.spoonacular.session.get", side_effect=slow_search):
+        start = time.perf_counter()
+        response = client.get("/recommendations?symptoms=tired")
+        elapsed = time.perf_counter() - start
+    assert_200(response)
+    assert elapsed < 9 * 0.2 / 2
+
+    assert sorted(searched) == sorted(
+        [
+            ("breakfast", "minIron"),
+            ("bread", "minZinc"),
+            ("snack", "minIron"),
+            ("main course", "minZinc"),
+            ("salad", "minIron"),
+            ("soup", "minZinc"),
+            ("main course", "minIron"),
+            ("side dish", "minZinc"),
+            ("appetizer", "minIron"),
+        ]
+    )
+    meals = set_users_data.get_user("testusername").symptom_analysis["fatigue"]
+    for category in ("breakfast", "lunch", "dinner"):
+        assert [r["id"] for r in meals["recommended_meals"]["meals"][category]] == [1, 2]
+
+
+def test_search_many_keeps_order_and_failures():
+    """
+    Tests that search_many returns the responses in the order of the searches, with the exception of a failed search.
+    """
+    spoonacular = SpoonacularClient("key")
+
+    def search(url, params, timeout):
+        if params["type"] == "bad":
+            raise requests.ConnectionError("down")
+        time.sleep(0.05 if params["type"] == "slow" else 0)
+        return params["type"]
+
+    with patch.object(spoonacular.session, "get", side_effect=search):
+        results = spoonacular.search_many([{"type": "slow"}, {"type": "bad"}, {"type": "fast"}])
+    assert results[0] == "slow" and results[2] == "fast"
+    assert isinstance(results[1], requests.ConnectionError)
+    spoonacular.close()
+
+
+###############################################################################
+#                                                                             #
+#                         BULK RECIPE HYDRATION TESTS                         #
+#                                                                             #
+###############################################################################
+
+
+def test_get_many_fetches_missing_recipes_in_chunks(tmp_path):
+    """
+    Tests that get_many deduplicates the ids, only fetches the missing recipes, in chunks,
+    and returns the recipes in the order of the ids.
+    """
+    fetch = MagicMock()
+    fetch_bulk = MagicMock(
+        side_effect=lambda ids, nutrition: [make_recipe_information(i) for i in ids if i != 4]
+    )
+    cache = RecipeCache(
+        MealsData(str(tmp_path / "meals.json")), fetch, fetch_bulk=fetch_bulk, chunk_size=2
+    )
+    cache.get_many([1])
+    fetch_bulk.reset_mock()
+
+    recipes = cache.get_many([3, "2", 1, 3, 4, 5])
+    assert [recipe and recipe["id"] for recipe in recipes] == [3, 2, 1, 3, None, 5]
+    assert [call.args[0] for call in fetch_bulk.call_args_list] == [[3, 2], [4, 5]]
+    fetch.assert_not_called()
+    assert sorted(MealsData(cache.meals_data.file_path).meals) == [1, 2, 3, 5]
+
+
+def test_get_many_fallback_needs_the_nutrition(tmp_path):
+    """
+    Tests that get_many only falls back to stored copies that hold the needed nutrition when fetching fails,
+    with a stale nutrient summary counting when summary_ok is set.
+    """
+    fetch_bulk = MagicMock(return_value=[])
+    cache = RecipeCache(
+        MealsData(str(tmp_path / "meals.json")), MagicMock(), fetch_bulk=fetch_bulk, ttl=60
+    )
+    cache.meals_data.upsert_meals(
+        [
+            Meal.from_information(make_recipe_information(1, nutrition=False)),
+            Meal.from_information(make_recipe_information(2)),
+        ]
+    )
+    cache.store_summaries([make_recipe_information(3)])
+    for meal in cache.meals_data.meals.values():
+        meal.cached_at = meal.cached_at and meal.cached_at - 120
+    cache.meals_data.meals[3].extra["summarized_at"] -= 120
+
+    recipes = cache.get_many([1, 2, 3], include_nutrition=True)
+    assert [recipe and recipe["id"] for recipe in recipes] == [None, 2, None]
+    recipes = cache.get_many([1, 2, 3], include_nutrition=True, summary_ok=True)
+    assert [recipe and recipe["id"] for recipe in recipes] == [None, 2, 3]
+    assert [recipe and recipe["id"] for recipe in cache.get_many([1])] == [1]
+
+
+def test_summaries_do_not_replace_stale_full_recipes(tmp_path):
+    """
+    Tests that a nutrient summary from a search does not overwrite a stale recipe that is stored in full,
+    so the recipe is still served when fetching it fails.
+    """
+    fetch = MagicMock(return_value=make_recipe_information(1))
+    cache = RecipeCache(MealsData(str(tmp_path / "meals.json")), fetch, ttl=60)
+    cache.get(1, include_nutrition=True)
+    cache.meals_data.get_meal(1).cached_at -= 120
+
+    assert cache.store_summaries([{**make_recipe_information(1), "title": "Summary"}]) == 0
+    fetch.return_value = None
+    recipe = cache.get(1, include_nutrition=True)
+    assert recipe["title"] == "Test Recipe"
+    assert recipe["extendedIngredients"] == [{"original": "1 egg"}]
+
+
+def test_meal_planner_skips_recipes_without_nutrition(client, set_users_data, set_recipe_cache):
+    """
+    Tests that the meal planner leaves out a stored recipe without nutrition when Spoonacular fails,
+    instead of crashing.
+    """
+    set_users_data.add_user(make_test_user())
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+        sess["username"] = "testusername"
+    set_recipe_cache.meals_data.upsert_meals(
+        [
+            Meal.from_information(make_recipe_information(5, nutrition=False)),
+            Meal.from_information(make_recipe_information(6)),
+        ]
+    )
+    for meal in set_recipe_cache.meals_data.meals.values():
+        meal.cached_at = 0
+    with patch("app.spoonacular.session.get") as get:
+        get.return_value = MagicMock(ok=False, status_code=402)
+        response = client.post("/recommendations/mealplanner/create", data={"meals": ["5", "6"]})
+    assert response.status_code == 302
+    mealplan = set_users_data.get_user("testusername").mealplan
+    assert [meal["id"] for meal in mealplan["meals"]] == [6]
+    assert mealplan["nutrients"]["calories"] == 100
+
+
+def test_builtin_week_plan_hydrates_with_one_call(client, set_users_data):
+    """
+    Tests that the images of a week plan are fetched with one bulk call instead of one call per meal.
+    """
+    set_users_data.add_user(make_test_user())
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+        sess["username"] = "testusername"
+
+    week = {
+        day: {"meals": [{"id": 10 + i}, {"id": 20 + i}, {"id": 30}]}
+        for i, day in enumerate(["monday", "tuesday", "wednesday"])
+    }
+
+    def spoonacular_get(url, params, timeout):
+        response = MagicMock(ok=True, status_code=200)
+        if url.endswith("/mealplanner/generate"):
+            response.json.return_value = {"week": week}
+        else:
+            ids = [int(i) for i in params["ids"].split(",")]
+            response.json.return_value = [
+                {"id": i, "image": f"{i}.jpg", "readyInMinutes": 5} for i in ids
+            ]
+        return response
+
+    with patch("app.spoonacular.session.get", side_effect=spoonacular_get) as get:
+        client.post("/recommendations/mealplanner/spoonacular", data={"timeFrame": "week"})
+        assert get.call_count == 2
+        assert len(get.call_args.kwargs["params"]["ids"].split(",")) == 7
+
+    mealplan = set_users_data.get_user("testusername").mealplan
+    assert mealplan["week"]["tuesday"]["meals"][1]["image"] == "21.jpg"
+    assert mealplan["week"]["monday"]["meals"][2]["readyInMinutes"] == 5
+
+
+###############################################################################
+#                                                                             #
+#                             SEARCH CACHE TESTS                              #
+#                                                                             #
+###############################################################################
+
+
+def test_canonical_key_normalizes_search_parameters():
+    """
+    Tests that equivalent searches get the same key and that the API key is not part of it.
+    """
+    first = {
+        "type": "Main Course",
+        "diet": "vegan",
+        "excludeIngredients": "nuts, eggs",
+        "minIron": 5,
+        "apiKey": "a",
+    }
+    second = {
+        "minIron": "5.0",
+        "excludeIngredients": "eggs,nuts",
+        "diet": " Vegan",
+        "type": "main course",
+        "apiKey": "b",
+    }
+    assert canonical_key(first) == canonical_key(second)
+    assert "apiKey" not in canonical_key(first)
+    assert canonical_key({"type": "soup", "diet": ""}) == canonical_key({"type": "soup"})
+    assert canonical_key({"type": "soup"}) != canonical_key({"type": "salad"})
+
+
+def test_search_cache_expires_evicts_and_persists(tmp_path):
+    """
+    Tests the time to live, the LRU size cap and that the cache is loaded again after a restart.
+    """
+    cache_file = str(tmp_path / "search_cache.json")
+    cache = SearchCache(cache_file, ttl=60, max_size=2)
+    cache.put_many([({"type": "soup"}, {"results": [1]}), ({"type": "salad"}, {"results": [2]})])
+    assert cache.get({"type": "soup"}) == {"results": [1]}
+    cache.put_many([({"type": "snack"}, {"results": [3]})])
+    assert cache.get({"type": "salad"}) is None
+    assert cache.stats["evictions"] == 1
+
+    restarted = SearchCache(cache_file, ttl=60, max_size=2)
+    assert restarted.get({"type": "snack"}) == {"results": [3]}
+    restarted.entries[canonical_key({"type": "soup"})]["cached_at"] -= 120
+    assert restarted.get({"type": "soup"}) is None
+    assert restarted.stats["expired"] == 1
+    assert restarted.stats["hit_rate"] == 0.5
+
+
+def test_recommendations_share_search_results_between_users(client, set_users_data):
+    """
+    Tests that a second user with the same searches gets the results from the search cache without calling Spoonacular,
+    and that failed searches are not cached.
+    """
+    set_users_data.add_user(make_test_user("first"))
+    set_users_data.add_user(make_test_user("second"))
+
+    def search(url, params, timeout):
+        response = MagicMock()
+        if params["type"] == "soup":
+            response.raise_for_status.side_effect = requests.HTTPError("500")
+        response.json.return_value = {"results": [{"id": 1, "title": "Recipe", "image": "1.jpg"}]}
+        return response
+
+    with patch(
+        "app.structured_symptom_analysis", return_value=make_symptom_analysis("Iron")
+    ), patch("app.spoonacular.session.get", side_effect=search) as get:
+        for username in ("first", "second"):
+            with client.session_transaction() as sess:
+                sess["logged_in"] = True
+                sess["username"] = username
+            assert_200(client.get("/recommendations?symptoms=tired"))
+        # Eight searches for the first user (both main course searches are the same),
+        # only the failed soup search again for the second
+        assert get.call_count == 9
+    stats = client.get("/metrics").get_json()["search_cache"]
+    assert stats["hits"] == 8 and stats["misses"] == 10
+
+
+###############################################################################
+#                                                                             #
+#                             QUOTA LIMITER TESTS                             #
+#                                                                             #
+###############################################################################
+
+
+def quota_response(status_code: int = 200, headers: dict = None) -> MagicMock:
+    """
+    Makes a fake Spoonacular response with quota headers.
+    """
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    return response
+
+
+def test_quota_limiter_keeps_reserve_for_interactive_calls():
+    """
+    Tests that background calls stop at the reserve while interactive calls can still use it.
+    """
+    limiter = QuotaLimiter(daily_quota=10, background_reserve=0.5)
+    with limiter.prioritized(BACKGROUND):
+        for _ in range(5):
+            limiter.acquire(1)
+        with pytest.raises(QuotaExceeded):
+            limiter.acquire(1)
+    limiter.acquire(5)
+    with pytest.raises(QuotaExceeded):
+        limiter.acquire(1)
+    assert limiter.stats["denied_background"] == 1
+    assert limiter.stats["denied_interactive"] == 1
+    assert isinstance(QuotaExceeded(), requests.RequestException)
+
+
+def test_quota_limiter_follows_quota_headers():
+    """
+    Tests that the bucket is corrected with the points Spoonacular reports and is emptied by a 402.
+    """
+    limiter = QuotaLimiter(daily_quota=150)
+    limiter.acquire(1)
+    limiter.record(1, quota_response(headers={"X-API-Quota-Request": "3.5"}))
+    assert limiter.tokens == pytest.approx(146.5)
+    assert limiter.stats["points_spent"] == 3.5
+
+    limiter.record(1, quota_response(headers={"X-API-Quota-Left": "40"}))
+    assert limiter.tokens == 40
+    assert limiter.stats["server_quota_left"] == 40
+
+    limiter.record(1, quota_response(402))
+    with pytest.raises(QuotaExceeded):
+        limiter.acquire(1)
+
+
+def test_spoonacular_client_does_not_call_without_quota():
+    """
+    Tests that the client raises QuotaExceeded without calling Spoonacular, and refunds calls that never got an answer.
+    """
+    limiter = QuotaLimiter(daily_quota=2)
+    spoonacular = SpoonacularClient("key", limiter=limiter)
+    with patch.object(
+        spoonacular.session, "get", side_effect=requests.ConnectionError("down")
+    ) as get:
+        with pytest.raises(requests.ConnectionError):
+            spoonacular.recipe_information(1)
+        assert limiter.tokens == pytest.approx(2, abs=0.01)
+        with pytest.raises(QuotaExceeded):
+            spoonacular.recipe_information_bulk([1, 2, 3, 4])
+        assert get.call_count == 1
+    spoonacular.close()
+
+
+def test_search_many_uses_priority_of_caller():
+    """
+    Tests that the searches run on the worker threads with the priority of the thread that started them.
+    """
+    limiter = QuotaLimiter(daily_quota=10, background_reserve=0.9)
+    spoonacular = SpoonacularClient("key", limiter=limiter)
+    with patch.object(spoonacular.session, "get", return_value=quota_response()):
+        with limiter.prioritized(BACKGROUND):
+            results = spoonacular.search_many([{"type": "soup", "number": 3}] * 2)
+        assert all(isinstance(result, QuotaExceeded) for result in results)
+        results = spoonacular.search_many([{"type": "soup", "number": 3}] * 2)
+        assert not any(isinstance(result, Exception) for result in results)
+    spoonacular.close()
+
+
+def test_recipe_details_served_stale_when_quota_is_used_up(client, set_recipe_cache, set_quota_limiter):
+    """
+    Tests that a stored recipe is still served when there is no quota left to refresh it.
+    """
+    set_user_login(client)
+    set_recipe_cache.meals_data.upsert_meals(
+        [Meal.from_information({**make_recipe_information(7), "title": "Old Soup"})]
+    )
+    set_recipe_cache.meals_data.meals[7].cached_at = 0
+    set_quota_limiter.tokens = 0
+    with patch("app.spoonacular.session.get") as get:
+        response = client.get("/recipe/7")
+        get.assert_not_called()
+    assert_200(response)
+    assert b"Old Soup" in response.data
+    assert client.get("/metrics").get_json()["spoonacular_quota"]["denied_interactive"] == 1
+
+
+###############################################################################
+#                                                                             #
+#                             SINGLE FLIGHT TESTS                             #
+#                                                                             #
+###############################################################################
+
+
+def run_concurrently(function, count: int = 4) -> list:
+    """
+    Runs a function in several threads at the same time and returns the results.
+    """
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        futures = [executor.submit(function) for _ in range(count)]
+        return [future.result() for future in futures]
+
+
+def test_single_flight_shares_result_and_exception():
+    """
+    Tests that concurrent calls with the same key run once and all get the result or the exception.
+    """
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow(value):
+        calls.append(value)
+        started.set()
+        release.wait(5)
+        return value
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        first = executor.submit(flight.do, "key", slow, 1)
+        started.wait(5)
+        others = [executor.submit(flight.do, "key", slow, 2) for _ in range(2)]
+        while flight.stats["shared"] < 2:
+            time.sleep(0.01)
+        release.set()
+        assert [first.result()] + [other.result() for other in others] == [1, 1, 1]
+    assert calls == [1]
+    assert flight.do("key", lambda: 3) == 3
+
+    def failing():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        flight.do("key", failing)
+    assert flight.calls == {}
+
+
+def test_spoonacular_client_coalesces_identical_calls():
+    """
+    Tests that concurrent identical Spoonacular calls are made once and spend the quota once.
+    """
+    limiter = QuotaLimiter(daily_quota=10)
+    spoonacular = SpoonacularClient("key", limiter=limiter)
+    barrier = threading.Barrier(4)
+
+    def get(url, params, timeout):
+        time.sleep(0.2)
+        return quota_response()
+
+    with patch.object(spoonacular.session, "get", side_effect=get) as test_get:
+
+        def open_recipe():
+            barrier.wait(5)
+            return spoonacular.recipe_information(42)
+
+        responses = run_concurrently(open_recipe)
+        assert test_get.call_count == 1
+        assert all(response is responses[0] for response in responses)
+        spoonacular.recipe_information(43)
+        assert test_get.call_count == 2
+    assert limiter.tokens == pytest.approx(8, abs=0.01)
+    spoonacular.close()
+
+
+def test_background_quota_error_is_not_shared_with_interactive_calls():
+    """
+    Tests that an interactive call does not wait for, and fail with, the same call made in the background
+    when the background call is denied by the quota reserve.
+    """
+    limiter = QuotaLimiter(daily_quota=10, background_reserve=0.5)
+    # Below the background reserve, but enough for an interactive call
+    limiter.tokens = 4
+    spoonacular = SpoonacularClient("key", limiter=limiter)
+    started = threading.Event()
+    release = threading.Event()
+    acquire = limiter.acquire
+
+    def slow_acquire(cost, priority=None):
+        if limiter.priority == BACKGROUND:
+            started.set()
+            release.wait(5)
+        return acquire(cost, priority)
+
+    with patch.object(limiter, "acquire", side_effect=slow_acquire), patch.object(
+        spoonacular.session, "get", return_value=quota_response()
+    ):
+
+        def plan_in_background():
+            with limiter.prioritized(BACKGROUND):
+                return spoonacular.generate_mealplan({"timeFrame": "day"})
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            background = executor.submit(plan_in_background)
+            started.wait(5)
+            response = spoonacular.generate_mealplan({"timeFrame": "day"})
+            release.set()
+            with pytest.raises(QuotaExceeded):
+                background.result()
+    assert response.ok
+    spoonacular.close()
+
+
+def test_groq_calls_are_coalesced():
+    """
+    Tests that the same structured analysis asked at the same time is sent to Groq once.
+    """
+    barrier = threading.Barrier(3)
+
+    def create(**request):
+        time.sleep(0.2)
+        response = MagicMock()
+        response.choices[0].message.content = json.dumps(
+            {"deficiencies": [{"nutrient": "Iron"}]}
+        )
+        return response
+
+    with patch("app.client.chat.completions.create", side_effect=create) as test_create:
+
+        from app import groq_structured_analysis
+
+        user = make_test_user()
+
+        def ask():
+            barrier.wait(5)
+            return groq_structured_analysis(user, "tired")
+
+        results = run_concurrently(ask, 3)
+        assert results[0]["deficiencies"][0]["nutrient"] == "Iron"
+        assert results == [results[0]] * 3
+        assert test_create.call_count == 1
+
+
+###############################################################################
+#                                                                             #
+#                            STAND-IN SERVER TESTS                            #
+#                                                                             #
+###############################################################################
+
+
+@pytest.fixture
+def stand_in():
+    """
+    Set up of a stand-in server with made up data on a free port.
+    :returns:
+        StandInServer: The running server.
+    """
+    server = start_server()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_stand_in_answers_spoonacular_endpoints(stand_in):
+    """
+    Tests that the stand-in answers the endpoints of the client with stable data and quota headers.
+    """
+    spoonacular = SpoonacularClient("key", stand_in.url)
+    search = spoonacular.search_recipes({"type": "soup", "number": 3})
+    assert len(search.json()["results"]) == 3
+    assert search.json() == spoonacular.search_recipes({"number": 3, "type": "soup"}).json()
+    assert float(search.headers["X-API-Quota-Left"]) < 150
+
+    recipe_id = search.json()["results"][0]["id"]
+    information = spoonacular.recipe_information(recipe_id, include_nutrition=True).json()
+    assert information["title"] == search.json()["results"][0]["title"]
+    assert information["nutrition"]["nutrients"][0]["name"] == "Calories"
+    bulk = spoonacular.recipe_information_bulk([recipe_id, 7]).json()
+    assert [recipe["id"] for recipe in bulk] == [recipe_id, 7]
+    week = spoonacular.generate_mealplan({"timeFrame": "week"}).json()["week"]
+    assert len(week["monday"]["meals"]) == 3
+    spoonacular.close()
+
+
+def test_stand_in_injects_latency_and_errors():
+    """
+    Tests the configurable latency and error injection.
+    """
+    server = start_server(latency=0.1, error_rate=1, error_status=402)
+    spoonacular = SpoonacularClient("key", server.url, retries=0)
+    start = time.perf_counter()
+    response = spoonacular.recipe_information(1)
+    assert time.perf_counter() - start >= 0.1
+    assert response.status_code == 402
+    assert server.stats["errors"] == 1
+    spoonacular.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_stand_in_records_and_replays(stand_in, tmp_path):
+    """
+    Tests that record mode saves the upstream responses without the API key, and replay mode serves them again.
+    """
+    fixtures = str(tmp_path / "fixtures")
+    recorder = start_server(mode="record", fixtures_dir=fixtures, spoonacular_url=stand_in.url)
+    spoonacular = SpoonacularClient("secret-key", recorder.url)
+    recorded = spoonacular.search_recipes({"type": "salad", "number": 2}).json()
+    recorder.shutdown()
+    recorder.server_close()
+    assert recorder.stats["recorded"] == 1
+    for name in os.listdir(fixtures):
+        with open(os.path.join(fixtures, name)) as f:
+            assert "secret-key" not in f.read()
+
+    replayer = start_server(mode="replay", fixtures_dir=fixtures)
+    spoonacular.base_url = replayer.url
+    assert spoonacular.search_recipes({"number": 2, "type": "salad"}).json() == recorded
+    assert replayer.stats["replayed"] == 1
+    spoonacular.close()
+    replayer.shutdown()
+    replayer.server_close()
+
+
+def test_recommendations_against_stand_in(client, set_users_data, stand_in):
+    """
+    Tests the recommendations page end to end against the stand-in, without mocking Spoonacular or Groq.
+    """
+    set_users_data.add_user(make_test_user("standin"))
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+        sess["username"] = "standin"
+    with patch("app.spoonacular.base_url", stand_in.url), patch(
+        "app.client", Groq(api_key="key", base_url=stand_in.url)
+    ):
+        response = client.get("/recommendations?symptoms=tired")
+    assert_200(response)
+    assert b"img.spoonacular.com" in response.data
+    # One structured Groq call and eight searches, the two identical main course searches are made once
+    assert stand_in.stats["requests"] == 9
+
+
+###############################################################################
+#                                                                             #
+#                              IMAGE PROXY TESTS                              #
+#                                                                             #
+###############################################################################
+
+
+IMAGE_URL = "https://img.spoonacular.com/recipes/716429-556x370.jpg"
+
+
+def image_response(content: bytes = b"jpeg bytes") -> MagicMock:
+    """
+    Makes a fake response of the Spoonacular image host.
+    """
+    response = MagicMock()
+    response.status_code = 200
+    response.headers = {"Content-Type": "image/jpeg"}
+    response.content = content
+    return response
+
+
+@pytest.fixture
+def set_image_cache(tmp_path) -> ImageCache:
+    """
+    Set up of an empty image cache in a temporary directory.
+    :returns:
+        ImageCache: The image cache that the app uses during the test.
+    """
+    image_cache = ImageCache(str(tmp_path / "images"))
+    with patch("app.image_cache", image_cache):
+        yield image_cache
+
+
+def test_thumbnail_url_uses_spoonacular_sizes():
+    """
+    Tests that recipe images are asked in the thumbnail size and that unknown sizes are refused.
+    """
+    assert thumbnail_url(IMAGE_URL, "312x231") == (
+        "https://img.spoonacular.com/recipes/716429-312x231.jpg",
+        "jpg",
+    )
+    assert thumbnail_url("https://spoonacular.com/cdn/apple.png", "90x90")[1] == "png"
+    with pytest.raises(ValueError):
+        thumbnail_url(IMAGE_URL, "4000x4000")
+    with app.test_request_context():
+        assert app.jinja_env.filters["thumbnail"](IMAGE_URL).startswith("/image?url=")
+        assert app.jinja_env.filters["thumbnail"]("https://example.com/a.jpg") == "https://example.com/a.jpg"
+
+
+def test_image_proxy_fetches_once_and_validates(client, set_image_cache):
+    """
+    Tests that an image is fetched once, served with a long cache lifetime and an ETag, and revalidated with a 304.
+    """
+    with patch.object(set_image_cache.session, "get", return_value=image_response()) as get:
+        first = client.get("/image", query_string={"url": IMAGE_URL})
+        second = client.get("/image", query_string={"url": IMAGE_URL})
+        assert get.call_count == 1
+        assert get.call_args[0][0].endswith("716429-312x231.jpg")
+    assert_200(first)
+    assert first.data == b"jpeg bytes" and first.mimetype == "image/jpeg"
+    assert first.cache_control.max_age == 30 * 24 * 3600 and first.cache_control.public
+    assert second.headers["ETag"] == first.headers["ETag"]
+    revalidated = client.get(
+        "/image",
+        query_string={"url": IMAGE_URL},
+        headers={"If-None-Match": first.headers["ETag"]},
+    )
+    assert revalidated.status_code == 304
+    assert set_image_cache.stats["hits"] == 2 and set_image_cache.stats["misses"] == 1
+
+
+def test_image_proxy_refuses_other_hosts_and_falls_back(client, set_image_cache):
+    """
+    Tests that only Spoonacular images are proxied, and that a failed fetch redirects to the original image.
+    """
+    with patch.object(set_image_cache.session, "get") as get:
+        response = client.get("/image", query_string={"url": "http://169.254.169.254/latest"})
+        assert response.status_code == 400
+        get.assert_not_called()
+
+        get.side_effect = requests.ConnectionError("down")
+        response = client.get("/image", query_string={"url": IMAGE_URL})
+    assert response.status_code == 302
+    assert response.headers["Location"] == IMAGE_URL
+    assert set_image_cache.stats["fetch_errors"] == 1
+
+
+def test_image_cache_evicts_least_recently_served(tmp_path):
+    """
+    Tests that the cache removes the least recently served images beyond its maximum size.
+    """
+    cache = ImageCache(str(tmp_path / "images"), max_bytes=25)
+    with patch.object(cache.session, "get", return_value=image_response(b"x" * 10)):
+        first, _ = cache.get("https://img.spoonacular.com/recipes/1-556x370.jpg", "90x90")
+        second, _ = cache.get("https://img.spoonacular.com/recipes/2-556x370.jpg", "90x90")
+        os.utime(first, (0, 0))
+        os.utime(second, (1, 1))
+        # Serving the first image again makes the second one the least recently served
+        cache.get("https://img.spoonacular.com/recipes/1-556x370.jpg", "90x90")
+        third, _ = cache.get("https://img.spoonacular.com/recipes/3-556x370.jpg", "90x90")
+    assert not os.path.exists(second)
+    assert os.path.exists(first) and os.path.exists(third)
+    assert cache.stats["evictions"] == 1
+
+
+###############################################################################
+#                                                                             #
+#                              QUERY ENGINE TESTS                             #
+#                                                                             #
+###############################################################################
+
+
+def make_stored_recipe(
+    recipe_id: int, dish_types: list, diets: list, iron: float, ingredient: str = "rice"
+) -> Meal:
+    """
+    Helper function to create a stored recipe with ingredients and nutrition.
+    """
+    return Meal.from_information(
+        {
+            "id": recipe_id,
+            "title": f"Recipe {recipe_id}",
+            "image": f"https://img.spoonacular.com/recipes/{recipe_id}-556x370.jpg",
+            "dishTypes": dish_types,
+            "diets": diets,
+            "extendedIngredients": [{"name": ingredient, "original": f"1 cup {ingredient}"}],
+            "nutrition": {"nutrients": [{"name": "Iron", "amount": iron, "unit": "mg"}]},
+        }
+    )
+
+
+def test_query_engine_filters_like_complex_search(tmp_path):
+    """
+    Tests the diet, type, excluded ingredient and nutrient filters, and the order by the asked nutrient.
+    """
+    meals_data = MealsData(str(tmp_path / "meals.json"))
+    meals_data.upsert_meals(
+        [
+            make_stored_recipe(1, ["soup"], ["vegan", "gluten free"], 2),
+            make_stored_recipe(2, ["soup"], ["lacto ovo vegetarian"], 8, "peanuts"),
+            make_stored_recipe(3, ["soup", "main course"], ["vegan"], 6),
+            make_stored_recipe(4, ["salad"], ["vegan"], 9),
+            make_stored_recipe(5, ["soup"], [], 7),
+        ]
+    )
+    engine = RecipeQueryEngine(meals_data)
+
+    result = engine.search({"diet": "vegetarian", "type": "soup", "number": 3})
+    assert [r["id"] for r in result["results"]] == [1, 2, 3]
+    result = engine.search({"type": "soup", "minIron": 5, "number": 2, "apiKey": "key"})
+    assert [r["id"] for r in result["results"]] == [2, 5]
+    assert result["results"][0]["nutrition"]["nutrients"][0]["amount"] == 8
+    assert engine.search({"type": "Soup", "excludeIngredients": "peanuts", "number": 3}) is not None
+    assert engine.search({"type": "soup", "excludeIngredients": "peanuts", "number": 4}) is None
+    assert engine.search({"type": "soup", "maxIron": 2, "number": 1})["results"][0]["id"] == 1
+    assert engine.search({"diet": "Gluten Free", "number": 1})["results"][0]["id"] == 1
+    assert engine.search({"diet": "none", "type": "salad", "number": 1}) is not None
+    # Filters the engine does not know are left to Spoonacular
+    assert engine.search({"type": "soup", "cuisine": "italian", "number": 1}) is None
+    assert engine.search({"diet": "carnivore", "number": 1}) is None
+    assert engine.stats["answered"] == 6 and engine.stats["unanswered"] == 3
+
+    meals_data.upsert_meals([make_stored_recipe(6, ["salad"], ["vegan"], 1)])
+    assert engine.search({"type": "salad", "number": 2}) is not None
+    assert engine.stats["rebuilds"] == 2
+
+
+def test_query_engine_searches_while_the_cache_stores(tmp_path):
+    """
+    Tests that searches keep working while the recipe cache stores and evicts recipes in another thread,
+    and that a search that fails is left to Spoonacular.
+    """
+    cache = RecipeCache(MealsData(str(tmp_path / "meals.json")), MagicMock(), max_size=50)
+    cache.meals_data.save_to_file = lambda: None
+    engine = RecipeQueryEngine(cache.meals_data)
+    stop = threading.Event()
+
+    def store():
+        recipe_id = 0
+        while not stop.is_set():
+            recipe_id += 1
+            cache._store([make_stored_recipe(recipe_id, ["soup"], [], recipe_id % 10)])
+
+    writer = threading.Thread(target=store)
+    writer.start()
+    try:
+        for _ in range(200):
+            engine.search({"type": "soup", "minIron": 1, "number": 1})
+    finally:
+        stop.set()
+        writer.join()
+    assert engine.stats["errors"] == 0
+
+    with patch.object(engine, "_search", side_effect=KeyError(1)):
+        assert engine.search({"type": "soup", "number": 1}) is None
+    assert engine.stats["errors"] == 1
+
+
+def test_recommendations_answered_from_stored_recipes(client, set_users_data, set_recipe_cache):
+    """
+    Tests that searches that the stored recipes can answer do not call Spoonacular.
+    """
+    set_users_data.add_user(make_test_user("offline"))
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+        sess["username"] = "offline"
+    set_recipe_cache.meals_data.upsert_meals(
+        [make_stored_recipe(i, ["soup"], [], 10) for i in range(1, 4)]
+    )
+
+    def search(url, params, timeout):
+        response = MagicMock()
+        response.json.return_value = {"results": [{"id": 99, "title": "Remote", "image": "99.jpg"}]}
+        return response
+
+    with patch(
+        "app.structured_symptom_analysis", return_value=make_symptom_analysis("Iron")
+    ), patch("app.spoonacular.session.get", side_effect=search) as get:
+        response = client.get("/recommendations?symptoms=tired")
+        assert_200(response)
+        # The soup search is answered locally, the seven other distinct searches go to Spoonacular
+        assert get.call_count == 7
+        assert all(call.kwargs["params"]["type"] != "soup" for call in get.call_args_list)
+    assert b"Recipe 1" in response.data
+
+
+###############################################################################
+#                                                                             #
+#                           INLINE NUTRITION TESTS                            #
+#                                                                             #
+###############################################################################
+
+
+def test_store_summaries_keeps_full_recipes(set_recipe_cache):
+    """
+    Tests that a nutrient summary is slim, does not replace a full recipe and is not served as the recipe details.
+    """
+    set_recipe_cache.meals_data.upsert_meals([make_stored_recipe(1, ["soup"], [], 3)])
+    search_recipe = {
+        "id": 2,
+        "title": "Searched",
+        "extendedIngredients": [{"name": "rice"}],
+        "nutrition": {
+            "nutrients": [
+                {"name": "Calories", "amount": 300, "unit": "kcal"},
+                {"name": "Iron", "amount": 4, "unit": "mg"},
+                {"name": "Sugar", "amount": 9, "unit": "g"},
+            ]
+        },
+    }
+    stored = set_recipe_cache.store_summaries(
+        [{**search_recipe, "id": 1}, search_recipe], ["Iron"]
+    )
+    assert stored == 1
+    summary = set_recipe_cache.meals_data.get_meal(2)
+    assert [n["name"] for n in summary.nutrition["nutrients"]] == ["Calories", "Iron"]
+    assert "extendedIngredients" not in summary.extra
+    assert set_recipe_cache.get_many([2], include_nutrition=True, summary_ok=True)[0]["title"] == "Searched"
+    with patch("app.spoonacular.session.get") as get:
+        get.return_value.ok = True
+        get.return_value.json.return_value = make_recipe_information(2)
+        assert set_recipe_cache.get(2, include_nutrition=True)["title"] == "Test Recipe"
+        assert get.call_count == 1
+
+
+def test_meal_planner_uses_nutrition_from_recommendations(client, set_users_data):
+    """
+    Tests that the recommendation searches ask for the nutrition inline, and that the meal planner
+    adds up the nutrition of recommended recipes without calling Spoonacular.
+    """
+    set_users_data.add_user(make_test_user("planner"))
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+        sess["username"] = "planner"
+
+    def search(url, params, timeout):
+        recipe_id = 100 + len(params["type"])
+        response = MagicMock()
+        response.json.return_value = {
+            "results": [
+                {
+                    "id": recipe_id,
+                    "title": f"Recipe {recipe_id}",
+                    "image": f"{recipe_id}.jpg",
+                    "nutrition": {
+                        "nutrients": [
+                            {"name": "Calories", "amount": 200, "unit": "kcal"},
+                            {"name": "Protein", "amount": 10, "unit": "g"},
+                            {"name": "Fat", "amount": 5, "unit": "g"},
+                        ]
+                    },
+                }
+            ]
+        }
+        return response
+
+    with patch(
+        "app.structured_symptom_analysis", return_value=make_symptom_analysis()
+    ), patch("app.spoonacular.session.get", side_effect=search) as get:
+        assert_200(client.get("/recommendations?symptoms=tired"))
+        assert all(call.kwargs["params"]["addRecipeNutrition"] for call in get.call_args_list)
+
+    with patch("app.spoonacular.session.get") as get:
+        response = client.post(
+            "/recommendations/mealplanner/create", data={"meals": ["104", "109"]}
+        )
+        get.assert_not_called()
+    assert response.status_code == 302
+    mealplan = set_users_data.get_user("planner").mealplan
+    assert mealplan["nutrients"]["calories"] == 400
+    assert mealplan["nutrients"]["protein"] == 20
+
+
+###############################################################################
+#                                                                             #
+#                            SYMPTOM ANALYSIS TESTS                           #
+#                                                                             #
+###############################################################################
+
+
+def analysis_response(text: str) -> MagicMock:
+    """
+    Helper function to create a Groq chat completion with the given text.
+    :param text: The text of the completion.
+    :returns:
+        MagicMock: The chat completion.
+    """
+    response = MagicMock()
+    response.choices[0].message.content = text
+    return response
+
+
+def test_profile_fingerprint_uses_prompt_fields():
+    """
+    Tests that only the fields of the prompt change the profile fingerprint.
+    """
+    user = make_test_user()
+    fingerprint = profile_fingerprint(user)
+    user.country = "Belgium"
+    user.password = "other"
+    assert profile_fingerprint(user) == fingerprint
+    user.weight = 71.0
+    assert profile_fingerprint(user) != fingerprint
+
+
+def test_results_and_recommendations_share_one_analysis(
+    client, set_users_data, set_symptom_analyses, no_streaming
+):
+    """
+    Tests that the recommendations make one structured Groq call for the deficiencies,
+    and that the results pages of the same symptoms show its text without calling Groq again.
+    """
+    set_users_data.add_user(make_test_user())
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+        sess["username"] = "testusername"
+    structured = {
+        "deficiencies": [
+            {
+                "nutrient": "iron",
+                "why": "Iron carries oxygen.",
+                "foods": ["spinach", "lentils"],
+                "tip": "Add vitamin C.",
+            }
+        ],
+        "urgency_note": None,
+    }
+
+    with patch(
+        "app.client.chat.completions.create",
+        return_value=analysis_response(json.dumps(structured)),
+    ) as create, patch("app.spoonacular.session.get") as get:
+        get.return_value.json.return_value = {"results": []}
+        assert_200(client.get("/recommendations?symptoms=tired , headache"))
+        assert create.call_count == 1
+        assert create.call_args.kwargs["response_format"] == {"type": "json_object"}
+        # A quarter of the 18 mg a day of a 20 year old woman
+        assert all(call.kwargs["params"]["minIron"] == 4.5 for call in get.call_args_list)
+
+        for symptoms in ("tired,headache", "tired, headache"):
+            response = client.get(f"/results?symptoms={symptoms}")
+            assert_200(response)
+            assert b"spinach" in response.data
+            assert b"Iron carries oxygen." in response.data
+        assert create.call_count == 1
+
+    stored = set_users_data.get_user("testusername").symptom_analysis["fatigue, headache"]
+    assert stored["structured"]["deficiencies"][0]["nutrient"] == "Iron"
+    assert stored["analyse"].startswith("Iron:\n- Why: Iron carries oxygen.")
+    assert "recommended_meals" in stored
+    assert set_symptom_analyses.stats["llm_calls"] == 1
+
+
+def test_stored_analysis_is_served_without_groq(
+    client, set_users_data, set_symptom_analyses
+):
+    """
+    Tests that an analysis stored in the user profile before a restart is served without asking Groq.
+    """
+    user = make_test_user()
+    user.symptom_analysis["fatigue"] = {"analyse": "Stored analysis"}
+    set_users_data.add_user(user)
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+        sess["username"] = "testusername"
+
+    with patch("app.client.chat.completions.create") as create:
+        response = client.get("/results?symptoms=tired")
+        create.assert_not_called()
+    assert b"Stored analysis" in response.data
+    assert set_symptom_analyses.stats["stored_hits"] == 1
+
+
+def test_failed_analysis_is_not_kept(client, set_users_data, no_streaming):
+    """
+    Tests that an analysis is asked again after the Groq call failed.
+    """
+    set_users_data.add_user(make_test_user())
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+        sess["username"] = "testusername"
+
+    with patch(
+        "app.client.chat.completions.create",
+        side_effect=[Exception("down"), analysis_response("Zinc:\n- Foods: seeds")],
+    ) as create:
+        client.get("/results?symptoms=tired")
+        response = client.get("/results?symptoms=tired")
+        assert create.call_count == 2
+    assert b"seeds" in response.data
+
+
+def test_profile_change_invalidates_analyses(
+    client, set_users_data, set_symptom_analyses, no_streaming
+):
+    """
+    Tests that changing a field of the prompt on the profile page forgets the analyses and recommended meals,
+    and that changing other fields keeps them.
+    """
+    set_users_data.add_user(make_test_user())
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+        sess["username"] = "testusername"
+    form = {
+        "name": "Test User",
+        "age": 20,
+        "sex": "Female",
+        "height": 175.0,
+        "weight": 70.0,
+        "skin_color": "medium",
+        "country": "The Netherlands",
+        "medication": "",
+        "diet": "None",
+        "existing_conditions": "",
+        "allergies": "",
+        "password": "testpassword",
+    }
+    assert_200(client.post("/profile", data=form))
+    user = set_users_data.get_user("testusername")
+    invalidations = set_symptom_analyses.stats["invalidations"]
+
+    with patch(
+        "app.client.chat.completions.create", return_value=analysis_response("Iron")
+    ) as create:
+        client.get("/results?symptoms=tired")
+        user.symptom_analysis["fatigue"]["recommended_meals"] = {"meals": {}}
+
+        assert_200(client.post("/profile", data={**form, "country": "Belgium"}))
+        client.get("/results?symptoms=tired")
+        assert create.call_count == 1
+        assert "recommended_meals" in user.symptom_analysis["fatigue"]
+
+        assert_200(client.post("/profile", data={**form, "weight": 80.0}))
+        assert set_users_data.get_user("testusername").symptom_analysis == {}
+        client.get("/results?symptoms=tired")
+        assert create.call_count == 2
+    assert set_symptom_analyses.stats["invalidations"] == invalidations + 1
+
+
+def read_events(response) -> List[Tuple[str, Any]]:
+    """
+    Helper function to parse a server-sent event stream.
+    :param response: The response of the stream.
+    :returns:
+        List[Tuple[str, Any]]: The event name and JSON data of every event.
+    """
+    events = []
+    for block in response.get_data(as_text=True).strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
+
+
+def test_results_page_streams_new_analysis(client, set_users_data, set_symptom_analyses, stand_in):
+    """
+    Tests that the results page of a new analysis is sent without waiting for Groq, that the analysis
+    is streamed in parts by the stand-in server, and that it is stored and shown as cards afterwards.
+    """
+    set_users_data.add_user(make_test_user())
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+        sess["username"] = "testusername"
+
+    with patch("app.client", Groq(api_key="test", base_url=stand_in.url)):
+        with patch("app.client.chat.completions.create") as create:
+            page = client.get("/results?symptoms=tired")
+            create.assert_not_called()
+        assert_200(page)
+        assert b"/results/stream?symptoms=fatigue" in page.data
+
+        stream = client.get("/results/stream?symptoms=tired")
+        assert stream.mimetype == "text/event-stream"
+        events = read_events(stream)
+
+    assert events[-1] == ("done", {})
+    parts = [data for name, data in events if name == "message"]
+    assert len(parts) > 10
+    analysis = "".join(parts)
+    assert "- Foods:" in analysis
+    assert set_users_data.get_user("testusername").symptom_analysis["fatigue"]["analyse"] == analysis
+    assert set_symptom_analyses.stats["llm_streams"] == 1
+
+    with patch("app.client.chat.completions.create") as create:
+        page = client.get("/results?symptoms=tired")
+        create.assert_not_called()
+    assert b"nutrient-card" in page.data
+    assert b"data-stream-url" not in page.data
+    # A finished analysis is streamed in one part
+    assert read_events(client.get("/results/stream?symptoms=tired")) == [
+        ("message", analysis),
+        ("done", {}),
+    ]
+
+
+def test_failed_stream_sends_error_event(client, set_users_data, set_symptom_analyses):
+    """
+    Tests that a Groq error during the stream ends it with an error event, and that nothing is stored.
+    """
+    set_users_data.add_user(make_test_user())
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+        sess["username"] = "testusername"
+
+    with patch("app.client.chat.completions.create", side_effect=Exception("down")):
+        events = read_events(client.get("/results/stream?symptoms=tired"))
+    assert [name for name, _ in events] == ["error"]
+    assert set_users_data.get_user("testusername").symptom_analysis == {}
+    assert set_symptom_analyses.stats["llm_failures"] == 1
+
+
+def test_symptom_analysis_model_validates_llm_output():
+    """
+    Tests that the structured analysis normalizes nutrient names and foods,
+    rejects invalid answers, and gives the text of the results page.
+    """
+    analysis = SymptomAnalysis.model_validate_json(
+        json.dumps(
+            {
+                "deficiencies": [
+                    {"nutrient": "vitamin d", "foods": "salmon, eggs"},
+                    {"nutrient": "Iron", "why": "w", "foods": ["beans"], "tip": "t"},
+                    {"nutrient": "Omega 3"},
+                ],
+                "urgency_note": "See a doctor.",
+            }
+        )
+    )
+    assert [d.nutrient for d in analysis.deficiencies] == ["VitaminD", "Iron", "Omega3"]
+    assert analysis.deficiencies[0].foods == ["salmon", "eggs"]
+    assert analysis.to_text().split("\n\n")[1] == "Iron:\n- Why: w\n- Foods: beans\n- Tip: t"
+    assert analysis.to_text().endswith("[Urgency Note]: See a doctor.")
+
+    with pytest.raises(ValidationError):
+        SymptomAnalysis.model_validate_json('{"deficiencies": [{"why": "no nutrient"}]}')
+    with pytest.raises(ValidationError):
+        SymptomAnalysis.model_validate_json("Iron: eat spinach")
+
+
+def test_invalid_structured_analysis_is_not_kept(client, set_users_data, set_symptom_analyses):
+    """
+    Tests that an answer that does not match the analysis model gives recommendations without nutrient
+    minimums, and is asked again next time.
+    """
+    set_users_data.add_user(make_test_user())
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+        sess["username"] = "testusername"
+
+    with patch(
+        "app.client.chat.completions.create", return_value=analysis_response("Iron: eat spinach")
+    ) as create, patch("app.spoonacular.session.get") as get:
+        get.return_value.json.return_value = {"results": []}
+        assert_200(client.get("/recommendations?symptoms=tired"))
+        assert not any("minIron" in call.kwargs["params"] for call in get.call_args_list)
+        set_users_data.get_user("testusername").symptom_analysis.clear()
+        assert_200(client.get("/recommendations?symptoms=tired"))
+        assert create.call_count == 2
+    assert set_symptom_analyses.stats["llm_failures"] == 2
+
+
+def test_stand_in_answers_structured_analysis(set_users_data, stand_in):
+    """
+    Tests that the structured analysis call works against the stand-in server and validates.
+    """
+    from app import groq_structured_analysis
+
+    with patch("app.client", Groq(api_key="test", base_url=stand_in.url)):
+        structured = groq_structured_analysis(make_test_user(), "tired")
+    analysis = SymptomAnalysis.model_validate(structured)
+    assert len(analysis.deficiencies) == 3
+    assert all(d.foods and d.why for d in analysis.deficiencies)
+
+
+def test_symptom_vocabulary_canonical_keys():
+    """
+    Tests that symptoms are lowercased, trimmed, deduplicated, sorted and mapped to one synonym,
+    and that a canonical key stays the same when it is canonicalized again.
+    """
+    vocabulary = SymptomVocabulary()
+    assert vocabulary.canonical("fatigue, hair loss") == "fatigue, hair loss"
+    assert vocabulary.canonical("Hair loss,fatigue") == "fatigue, hair loss"
+    assert vocabulary.canonical("  Tired ,, losing hair; FATIGUE ,") == "fatigue, hair loss"
+    assert vocabulary.canonical("headaches, feeling dizzy") == "dizziness, headache"
+    assert vocabulary.canonical("Weak muscles, muscle weakness") == "muscle weakness"
+    assert vocabulary.canonical("low energy (from overly restricted fat intake)") == "fatigue"
+    # Unknown symptoms are kept
+    assert vocabulary.canonical("Acne!") == "acne"
+    assert vocabulary.canonical(None) == ""
+
+    with open(os.path.join(os.path.dirname(__file__), "..", "data", "nutrient_info.json")) as f:
+        symptoms = [s for info in json.load(f).values() for s in info["symptoms"]]
+    for symptom in symptoms:
+        key = vocabulary.canonical(symptom.replace(",", ""))
+        assert key and vocabulary.canonical(key) == key
+
+
+def test_equivalent_symptoms_share_the_analysis(client, set_users_data, no_streaming):
+    """
+    Tests that symptoms written in another order, case or with synonyms get the stored analysis of the first search.
+    """
+    set_users_data.add_user(make_test_user())
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+        sess["username"] = "testusername"
+
+    with patch(
+        "app.client.chat.completions.create", return_value=analysis_response("Iron")
+    ) as create:
+        for symptoms in ("fatigue, hair loss", "Hair loss,fatigue", "tired, losing hair"):
+            assert_200(client.get(f"/results?symptoms={symptoms}"))
+        assert create.call_count == 1
+    assert list(set_users_data.get_user("testusername").symptom_analysis) == ["fatigue, hair loss"]
+
+
+def test_rekey_stored_analyses(set_users_data):
+    """
+    Tests the one-time re-keying of analyses stored under the raw symptoms: equivalent keys are merged,
+    with the fields of the analysis of the current profile first.
+    """
+    user = make_test_user()
+    fingerprint = profile_fingerprint(user)
+    user.symptom_analysis = {
+        "Hair loss,fatigue": {"analyse": "old", "fingerprint": "other"},
+        "tired, hair loss": {"analyse": "current", "fingerprint": fingerprint},
+        "fatigue,  hair loss": {
+            "recommended_meals": {"meals": {}},
+            "fingerprint": fingerprint,
+        },
+        "acne": {"analyse": "acne analysis"},
+        "broken": "not an analysis",
+    }
+    set_users_data.add_user(user)
+    set_users_data.add_user(make_test_user("untouched"))
+
+    assert rekey_all(set_users_data, SymptomVocabulary()) == 1
+    stored = UsersData(set_users_data.file_path).get_user("testusername").symptom_analysis
+    assert stored == {
+        "fatigue, hair loss": {
+            "analyse": "current",
+            "fingerprint": fingerprint,
+            "recommended_meals": {"meals": {}},
+        },
+        "acne": {"analyse": "acne analysis"},
+    }
+    # Running it again changes nothing
+    assert not rekey_analyses(set_users_data.get_user("testusername"), SymptomVocabulary())
@@ -1 +1,7 @@
-from .user_profile import UserProfile, UsersData
\ No newline at end of file
+from .user_profile import UserProfile, UsersData
+from .journal import JournaledUsersData
+from .sqlite_store import SQLiteUsersData
+from .indexed_store import IndexedUsersData
+from .blob_store import BlobStore
+from .write_behind import WriteBehindUsersData
+from .storage import create_users_data
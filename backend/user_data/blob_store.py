@@ -0,0 +1,125 @@
+from typing import Any, Dict, Mapping, Optional, Tuple
+from urllib.parse import quote
+import json
+import os
+
+from .user_profile import DATA_DIR, UserProfile
+from .change_tracking import ChangeTracker
+from .file_lock import file_signature, write_json_atomic
+
+
+class BlobStore:
+    """
+    Class storing the heavy fields of the user profiles (meal plan, symptom analysis and analysis results)
+    in separate files, one file per user and field.
+    A blob is only read when the field is accessed, and only written when it has changed.
+    The signature of every loaded blob file is remembered, so blobs that another process rewrote are read again.
+    """
+
+    def __init__(self, directory=os.path.join(DATA_DIR, "blobs")) -> None:
+        """
+        Initializes a BlobStore object.
+        :param directory (str): The directory where the blob files are stored.
+        """
+        self.directory = directory
+        self.tracker = ChangeTracker()
+        # (username, field) -> signature of the blob file when it was last read or written
+        self.signatures: Dict[Tuple[str, str], Optional[Tuple[int, int, int]]] = {}
+
+    def path(self, username: str, field: str) -> str:
+        """
+        Returns the path of the blob file of a user's field.
+        The username is quoted, so it can safely be used as a directory name.
+        :param username (str): The username of the user.
+        :param field (str): The name of the blob field.
+        :return (str): The path of the blob file.
+        """
+        return os.path.join(self.directory, quote(username, safe=""), f"{field}.json")
+
+    def load(self, username: str, field: str) -> Any:
+        """
+        Loads the blob of a user's field. Returns the default value if no blob is stored.
+        :param username (str): The username of the user.
+        :param field (str): The name of the blob field.
+        :return (Any): The value of the field.
+        """
+        path = self.path(username, field)
+        # Taken before reading, so a blob replaced during the read is read again on the next refresh
+        self.signatures[(username, field)] = file_signature(path)
+        try:
+            with open(path, "r") as file:
+                value = json.load(file)
+        except FileNotFoundError:
+            value = UserProfile.DEFAULTS[field]()
+        self.tracker.track(username, {field: value})
+        return value
+
+    def save(self, username: str, field: str, value: Any) -> None:
+        """
+        Writes the blob of a user's field. The blob is written to a temporary file first and then renamed,
+        so a crash never leaves a broken blob.
+        :param username (str): The username of the user.
+        :param field (str): The name of the blob field.
+        :param value (Any): The value of the field.
+        """
+        path = self.path(username, field)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_json_atomic(path, value)
+        self.signatures[(username, field)] = file_signature(path)
+        self.tracker.track(username, {field: value})
+
+    def save_changed(self, user_profile: UserProfile) -> None:
+        """
+        Writes the loaded blob fields of a user profile that changed since they were loaded or saved.
+        Deferred fields that were never accessed cannot have changed, so they are not loaded.
+        :param user_profile (UserProfile): The user profile to save.
+        """
+        loaded = {
+            field: getattr(user_profile, field)
+            for field in UserProfile.BLOB_FIELDS
+            if user_profile.is_loaded(field)
+        }
+        changes = self.tracker.changes(user_profile.username, loaded)
+        for field, value in changes.items():
+            self.save(user_profile.username, field, value)
+
+    def refresh(self, users: Mapping[str, UserProfile]) -> None:
+        """
+        Unloads the blob fields that another process rewrote since they were read or written,
+        so they are loaded again on their next access. Fields with unsaved local changes are kept.
+        Costs one stat call per loaded blob.
+        :param users (Mapping[str, UserProfile]): The loaded user profiles by username.
+        """
+        for (username, field), signature in list(self.signatures.items()):
+            if file_signature(self.path(username, field)) == signature:
+                continue
+            del self.signatures[(username, field)]
+            user_profile = users.get(username)
+            if user_profile is None or not user_profile.is_loaded(field):
+                continue
+            if self.tracker.changes(username, {field: getattr(user_profile, field)}):
+                continue
+            delattr(user_profile, field)
+            user_profile.deferred_loader = self.load
+
+    def split(self, user_profile: UserProfile) -> Dict[str, Any]:
+        """
+        Saves the changed blob fields of a user profile and returns the small core record without them.
+        :param user_profile (UserProfile): The user profile to save.
+        :return (Dict[str, Any]): The core record of the user profile.
+        """
+        self.save_changed(user_profile)
+        return user_profile.to_dict(exclude=UserProfile.BLOB_FIELDS)
+
+    def defer(self, user_profile: UserProfile, record: Dict[str, Any]) -> None:
+        """
+        Defers loading the blob fields that are not in the stored record until they are accessed.
+        Fields that are still in the record, for example in a users.json file from before the split,
+        stay loaded and are moved to the blob store on the next save.
+        :param user_profile (UserProfile): The user profile created from the record.
+        :param record (Dict[str, Any]): The stored record of the user profile.
+        """
+        for field in UserProfile.BLOB_FIELDS:
+            if field not in record:
+                delattr(user_profile, field)
+        user_profile.deferred_loader = self.load
@@ -0,0 +1,88 @@
+from typing import Callable, Dict, Any, Optional
+import json
+
+
+class ChangeTracker:
+    """
+    Remembers a fingerprint of every persisted field of every user profile.
+    Storage engines use it to find out which fields of a profile changed since the last write,
+    so they only have to persist those fields instead of the whole file.
+    The state of all users can also be given as a function (see track_all), then the fingerprints are only
+    computed when they are first needed.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes an empty ChangeTracker object.
+        """
+        self.fingerprints: Dict[str, Dict[str, int]] = {}
+        # Returns the records of the state given to track_all, until they are fingerprinted
+        self.pending: Optional[Callable[[], Dict[str, Dict[str, Any]]]] = None
+
+    @staticmethod
+    def fingerprint(value: Any) -> int:
+        """
+        Returns a fingerprint for a single field value.
+        The value is encoded as JSON so that in-place changes of lists and dicts are detected as well.
+        :param value (Any): The field value of a user profile.
+        :return (int): The fingerprint of the value.
+        """
+        return hash(json.dumps(value))
+
+    def track(self, username: str, record: Dict[str, Any]) -> None:
+        """
+        Remembers the given fields as the persisted state of the user.
+        Fields that are not in the record keep their earlier persisted state.
+        :param username (str): The username of the user.
+        :param record (Dict[str, Any]): The persisted fields of the user profile.
+        """
+        self._resolve()
+        self.fingerprints.setdefault(username, {}).update(
+            {field: self.fingerprint(value) for field, value in record.items()}
+        )
+
+    def changes(self, username: str, record: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Returns the fields of the record that differ from the persisted state of the user.
+        All fields are returned for a user that has not been persisted yet.
+        :param username (str): The username of the user.
+        :param record (Dict[str, Any]): The current fields of the user profile.
+        :return (Dict[str, Any]): The changed fields and their current values.
+        """
+        self._resolve()
+        known = self.fingerprints.get(username)
+        if known is None:
+            return dict(record)
+        return {
+            field: value
+            for field, value in record.items()
+            if known.get(field) != self.fingerprint(value)
+        }
+
+    def forget(self, username: str) -> None:
+        """
+        Forgets the persisted state of the user.
+        :param username (str): The username of the user.
+        """
+        self._resolve()
+        self.fingerprints.pop(username, None)
+
+    def track_all(self, load: Callable[[], Dict[str, Dict[str, Any]]]) -> None:
+        """
+        Remembers the persisted state of all users, replacing everything that was tracked before.
+        The records are only loaded and fingerprinted when the state is first needed.
+        :param load (Callable): Returns the persisted records by username. It must not return objects
+            that can still change, like the fields of loaded profiles, for example by decoding the written file.
+        """
+        self.fingerprints = {}
+        self.pending = load
+
+    def _resolve(self) -> None:
+        """
+        Fingerprints the records given to track_all, if that has not happened yet.
+        """
+        if self.pending is None:
+            return
+        load, self.pending = self.pending, None
+        for username, record in load().items():
+            self.track(username, record)
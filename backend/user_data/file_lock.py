@@ -0,0 +1,86 @@
+from typing import Any, Iterator, Optional, Tuple
+from contextlib import contextmanager
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl, msvcrt only offers exclusive locks
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def locked(path: str, shared: bool = False) -> Iterator[None]:
+    """
+    Holds a lock on a file that is respected by all processes (and threads) using this function.
+    The lock is taken on a separate `.lock` file, so the data file itself can be replaced while the lock is held.
+    If the directory of the data file does not exist, a shared lock is skipped, since there is nothing to read,
+    and the directory is created for an exclusive lock.
+    :param path (str): The path of the data file to lock.
+    :param shared (bool): Whether a shared (read) lock is enough, otherwise an exclusive (write) lock is taken.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        if shared:
+            yield
+            return
+        os.makedirs(directory, exist_ok=True)
+    with open(path + ".lock", "a+") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    """
+    Returns a cheap signature of a file that changes whenever the file is replaced or written.
+    :param path (str): The path of the file.
+    :return (Tuple[int, int, int]): The inode, size and modification time of the file, or None if it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """
+    Writes data to a temporary file and renames it over the target file.
+    Readers therefore always see either the old or the new file, never a partially written one.
+    :param path (str): The path of the file.
+    :param data (bytes): The content to write.
+    """
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def write_json_atomic(path: str, data: Any, indent: int = None) -> None:
+    """
+    Writes data as JSON to the file atomically, see write_atomic.
+    :param path (str): The path of the JSON file.
+    :param data (Any): The data to write.
+    :param indent (int): Optional indentation of the JSON output.
+    """
+    write_atomic(path, json.dumps(data, indent=indent).encode())
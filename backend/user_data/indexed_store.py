@@ -0,0 +1,161 @@
+from typing import Any, Dict, Optional, Tuple
+import json
+import mmap
+import threading
+
+from storage_codec import RawValue, decode_record, index_records
+from .user_profile import USERS_FILE, UserProfile, UsersData
+from .lazy_users import LazyUsers
+from .file_lock import locked, file_signature, write_atomic, write_json_atomic
+
+
+class IndexedUsersData(UsersData):
+    """
+    Class managing the data storage of the user profiles in a users.json file without loading the whole file.
+    The file is memory-mapped, and an index from username to the byte offset and length of its record
+    is built once and saved next to it, so a profile is only decoded when it is asked for.
+    Saves still rewrite the whole file, the bytes of the records of profiles that were never loaded are copied
+    as they are, without decoding them.
+    """
+
+    def __init__(
+        self, file_path=USERS_FILE, blob_store=None, codec=None
+    ) -> None:
+        """
+        Initializes an IndexedUsersData object. Maps the file and loads or builds its index.
+        :param file_path (str): The path to the file where user profiles are stored.
+        :param blob_store (BlobStore): Optional store that keeps the heavy fields of every profile in separate files.
+        :param codec: The format the file is written in (see storage_codec), pretty-printed JSON by default.
+            The records format is the cheapest to index. msgpack files cannot be indexed.
+        """
+        self.index_path = file_path + ".idx"
+        self.lock = threading.RLock()
+        self.data: Optional[mmap.mmap] = None
+        self.index: Dict[str, Tuple[int, int]] = {}
+        super().__init__(file_path, blob_store, codec)
+
+    def save_to_file(self) -> None:
+        """
+        Saves all user profiles to the file. Loaded profiles are encoded, the bytes of the others are copied
+        from the old file.
+        If another process changed the file in the meantime, its changes are merged in first so they are not lost.
+        """
+        with self.lock, locked(self.file_path):
+            if file_signature(self.file_path) != self.signature:
+                self._open()
+                self._merge_loaded()
+            loaded = {u: self.to_record(p) for u, p in self.users.loaded.items()}
+            records = {}
+            for username, (offset, length) in self.index.items():
+                if username in loaded:
+                    records[username] = loaded[username]
+                else:
+                    # Slicing the map copies the bytes, so they stay valid after the file is unmapped
+                    records[username] = RawValue(self.data[offset : offset + length])
+            records.update(loaded)
+            # Windows cannot replace a file that is still mapped
+            self.close()
+            write_atomic(self.file_path, self.codec.encode(records))
+            self._open()
+        for username, record in loaded.items():
+            self.tracker.track(username, record)
+
+    def refresh(self) -> None:
+        """
+        Maps the file again if another process replaced it, and merges the changes into the loaded profiles.
+        Only costs a stat call when the file did not change.
+        """
+        self._refresh_blobs()
+        if file_signature(self.file_path) == self.signature:
+            return
+        with self.lock, locked(self.file_path, shared=True):
+            self._open()
+            self._merge_loaded()
+
+    def load_from_file(self) -> None:
+        """
+        Maps the file and loads its index. User profiles are not loaded here, but on their first lookup.
+        """
+        with self.lock, locked(self.file_path, shared=True):
+            self._open()
+        self.users = LazyUsers(self._load_user, lambda: list(self.index))
+
+    def close(self) -> None:
+        """
+        Unmaps the file. The next save or refresh maps it again.
+        """
+        with self.lock:
+            if self.data is not None:
+                self.data.close()
+                self.data = None
+
+    def _open(self) -> None:
+        """
+        Maps the current file and loads its index, or builds and saves the index if it belongs to another version.
+        Must be called while the file is locked.
+        """
+        self.close()
+        self.signature = file_signature(self.file_path)
+        if self.signature is None or self.signature[1] == 0:
+            self.index = {}
+            return
+        with open(self.file_path, "rb") as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        index = self._read_index()
+        if index is None:
+            index = index_records(self.data)
+            write_json_atomic(
+                self.index_path, {"signature": self.signature, "index": index}
+            )
+        self.index = index
+
+    def _read_index(self) -> Optional[Dict[str, Tuple[int, int]]]:
+        """
+        Reads the saved index, if it was built for the current version of the file.
+        :return (Dict[str, Tuple[int, int]]): The offset and length of every record, or None if the index is missing or outdated.
+        """
+        try:
+            with open(self.index_path, "r") as file:
+                saved = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        if tuple(saved.get("signature") or ()) != self.signature:
+            return None
+        return {username: tuple(entry) for username, entry in saved["index"].items()}
+
+    def _record(self, username: str) -> Optional[Dict[str, Any]]:
+        """
+        Decodes the stored record of a single user from the mapped file.
+        :param username (str): The username of the user.
+        :return (Dict[str, Any]): The record of the user, or None if it is not stored.
+        """
+        with self.lock:
+            entry = self.index.get(username)
+            if entry is None:
+                return None
+            return decode_record(self.data, *entry)
+
+    def _load_user(self, username: str) -> Optional[UserProfile]:
+        """
+        Creates the user profile of a username from its stored record, used by the lazy users mapping.
+        :param username (str): The username of the user.
+        :return (UserProfile): The user profile, or None if it is not stored.
+        """
+        record = self._record(username)
+        if record is None:
+            return None
+        self.tracker.track(username, record)
+        return self.from_record(record)
+
+    def _merge_loaded(self) -> None:
+        """
+        Merges the stored records of the loaded user profiles after the file was mapped again.
+        Profiles that were never loaded are read from the new file when they are asked for.
+        """
+        records = {}
+        for username in list(self.users.loaded):
+            record = self._record(username)
+            if record is not None:
+                records[username] = record
+        self.merge_records(records)
@@ -0,0 +1,217 @@
+from typing import Dict, Any, List, Tuple
+import json
+import os
+
+from .user_profile import USERS_FILE, UserProfile, UsersData
+from storage_codec import get_codec
+from .file_lock import locked, file_signature, write_atomic
+
+
+class JournaledUsersData(UsersData):
+    """
+    Class managing the data storage of the user profiles with an append-only journal.
+    The users.json file is used as a snapshot, every change of a user profile is appended to a journal file
+    as a small record that only contains the changed fields.
+    Once the journal gets too long it is compacted into a new snapshot.
+    Several processes can share the journal, each of them reads the records the others appended.
+    """
+
+    def __init__(
+        self,
+        file_path=USERS_FILE,
+        journal_path: str = None,
+        compact_after: int = 1000,
+        fsync: bool = False,
+        blob_store=None,
+        codec=None,
+    ) -> None:
+        """
+        Initializes a JournaledUsersData object. Loads the snapshot and replays the journal on top of it.
+        :param file_path (str): The path to the JSON snapshot file.
+        :param journal_path (str): The path to the journal file, defaults to the snapshot path with a .journal suffix.
+        :param compact_after (int): The number of journal records after which the journal is compacted into the snapshot.
+        :param fsync (bool): Whether every append is forced to disk before returning.
+        :param blob_store (BlobStore): Optional store that keeps the heavy fields of every profile in separate files.
+        :param codec: The format the snapshot is written in (see storage_codec), compact JSON by default.
+        """
+        self.journal_path = journal_path or file_path + ".journal"
+        self.compact_after = compact_after
+        self.fsync = fsync
+        self.journal_records = 0
+        self.journal_offset = 0
+        super().__init__(file_path, blob_store, codec or get_codec("compact"))
+
+    def add_user(self, user_profile: UserProfile) -> None:
+        """
+        Add's a new user profile and appends it to the journal.
+        If the username already exists in the database, it raises a ValueError.
+        :param user_profile (UserProfile): A user profile object that will be added to the storage.
+        """
+        username: str = user_profile.username
+        if username in self.users:
+            raise ValueError(f"User with username '{username}' already exists.")
+        self.users[username] = user_profile
+        self.save_user(user_profile)
+
+    def save_user(self, user_profile: UserProfile) -> None:
+        """
+        Appends the changed fields of a single user profile to the journal.
+        Nothing is written when the profile did not change.
+        :param user_profile (UserProfile): The user profile that has been changed.
+        """
+        self._append_changes([user_profile])
+        self._maybe_compact()
+
+    def save_users(self, user_profiles: List[UserProfile]) -> None:
+        """
+        Appends the changed fields of several user profiles to the journal in one write.
+        :param user_profiles (List[UserProfile]): The user profiles that have been changed.
+        """
+        self._append_changes(user_profiles)
+        self._maybe_compact()
+
+    def save_to_file(self) -> None:
+        """
+        Appends the changed fields of all user profiles to the journal.
+        """
+        self._append_changes(self.users.values())
+        self._maybe_compact()
+
+    def compact(self) -> None:
+        """
+        Writes all user profiles to a new snapshot file and empties the journal.
+        The snapshot is written to a temporary file first and then renamed, so a crash never leaves a broken snapshot.
+        Replaying the old journal on top of the new snapshot gives the same result, so a crash between both steps is harmless.
+        """
+        with locked(self.file_path):
+            self._catch_up()
+            records = {u: self.to_record(p) for u, p in self.users.items()}
+            write_atomic(self.file_path, self.codec.encode(records))
+            with open(self.journal_path, "w"):
+                pass
+            self.signature = file_signature(self.file_path)
+            self.journal_offset = 0
+            self.journal_records = 0
+        for username, record in records.items():
+            self.tracker.track(username, record)
+
+    def refresh(self) -> None:
+        """
+        Applies the changes that other processes appended to the journal, or reloads after they compacted it.
+        Only costs two stat calls when nothing changed.
+        """
+        self._refresh_blobs()
+        if (
+            file_signature(self.file_path) == self.signature
+            and self._journal_size() == self.journal_offset
+        ):
+            return
+        with locked(self.file_path, shared=True):
+            self._catch_up()
+
+    def load_from_file(self) -> None:
+        """
+        Loads the user profiles from the snapshot and replays the journal on top of it.
+        A partially written last record, for example after a crash, is ignored.
+        """
+        with locked(self.file_path, shared=True):
+            records = self._read_records()
+            entries, self.journal_offset = self._read_journal(0)
+        for entry in entries:
+            records.setdefault(entry["user"], {}).update(entry["fields"])
+        self.journal_records = len(entries)
+
+        for username, record in records.items():
+            self.users[username] = self.from_record(record)
+            self.tracker.track(username, record)
+
+    def _catch_up(self) -> None:
+        """
+        Merges everything other processes wrote since this process last read the snapshot and journal.
+        Must be called while the file is locked.
+        """
+        if file_signature(self.file_path) != self.signature:
+            # The snapshot was compacted by another process, so the whole journal is replayed on top of it
+            records = self._read_records()
+            entries, self.journal_offset = self._read_journal(0)
+            for entry in entries:
+                records.setdefault(entry["user"], {}).update(entry["fields"])
+            self.merge_records(records)
+            self.journal_records = len(entries)
+        else:
+            entries, self.journal_offset = self._read_journal(self.journal_offset)
+            for entry in entries:
+                self.merge_records({entry["user"]: entry["fields"]})
+            self.journal_records += len(entries)
+
+    def _read_journal(self, offset: int) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Reads the complete journal records from a byte offset on.
+        A partially written last record is left for a later read.
+        :param offset (int): The byte offset to start reading from.
+        :return (Tuple[List[Dict[str, Any]], int]): The records and the offset after the last complete record.
+        """
+        try:
+            with open(self.journal_path, "rb") as journal:
+                journal.seek(offset)
+                data = journal.read()
+        except FileNotFoundError:
+            return [], 0
+
+        entries = []
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+            offset += len(line)
+        return entries, offset
+
+    def _journal_size(self) -> int:
+        """
+        Returns the size of the journal file in bytes, zero if it does not exist.
+        """
+        try:
+            return os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            return 0
+
+    def _append_changes(self, user_profiles) -> None:
+        """
+        Appends one journal record for every given user profile that has changed fields.
+        Records of other processes are merged in first, so the journal offset stays correct.
+        :param user_profiles (Iterable[UserProfile]): The user profiles to check for changes.
+        """
+        with locked(self.file_path):
+            self._catch_up()
+            lines = []
+            records = []
+            for user_profile in list(user_profiles):
+                record = self.to_record(user_profile)
+                changes = self.tracker.changes(user_profile.username, record)
+                if changes:
+                    entry = {"user": user_profile.username, "fields": changes}
+                    lines.append(json.dumps(entry) + "\n")
+                    records.append(record)
+            if not lines:
+                return
+
+            data = "".join(lines).encode()
+            with open(self.journal_path, "ab") as journal:
+                journal.write(data)
+                journal.flush()
+                if self.fsync:
+                    os.fsync(journal.fileno())
+            self.journal_offset += len(data)
+            self.journal_records += len(lines)
+            for record in records:
+                self.tracker.track(record["username"], record)
+
+    def _maybe_compact(self) -> None:
+        """
+        Compacts the journal once it holds more records than allowed.
+        """
+        if self.journal_records >= self.compact_after:
+            self.compact()
@@ -0,0 +1,56 @@
+from typing import Callable, Dict, Iterable, Iterator, Optional
+from collections.abc import MutableMapping
+
+from .user_profile import UserProfile
+
+
+class LazyUsers(MutableMapping):
+    """
+    Dictionary-like view of the stored user profiles that only loads a profile when it is asked for.
+    Loaded profiles are kept, so every lookup of the same username returns the same UserProfile object.
+    Storage engines that do not keep all profiles in memory use it as their `users` attribute.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[str], Optional[UserProfile]],
+        usernames: Callable[[], Iterable[str]],
+    ) -> None:
+        """
+        Initializes a LazyUsers object.
+        :param load (Callable): Returns the stored user profile for a username, or None if it does not exist.
+        :param usernames (Callable): Returns all stored usernames.
+        """
+        self.load = load
+        self.usernames = usernames
+        self.loaded: Dict[str, UserProfile] = {}
+
+    def __getitem__(self, username: str) -> UserProfile:
+        user_profile = self.loaded.get(username)
+        if user_profile is None:
+            user_profile = self.load(username)
+            if user_profile is None:
+                raise KeyError(username)
+            self.loaded[username] = user_profile
+        return user_profile
+
+    def __setitem__(self, username: str, user_profile: UserProfile) -> None:
+        self.loaded[username] = user_profile
+
+    def __delitem__(self, username: str) -> None:
+        del self.loaded[username]
+
+    def __contains__(self, username) -> bool:
+        if username in self.loaded:
+            return True
+        return self.get(username) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        seen = set(self.loaded)
+        yield from self.loaded
+        for username in self.usernames():
+            if username not in seen:
+                yield username
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
@@ -0,0 +1,19 @@
+### one-shot migration of the JSON user storage to SQLite ###
+# Run from the backend directory:
+# python -m user_data.migrate_sqlite user_data/users.json user_data/users.db
+# The migration lives in its own module, because the package already imports sqlite_store
+# and running that module with -m would load it twice.
+import argparse
+
+from .sqlite_store import SQLiteUsersData
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate users.json to SQLite.")
+    parser.add_argument("json_path", help="path to the existing users.json file")
+    parser.add_argument("db_path", help="path to the SQLite database to fill")
+    args = parser.parse_args()
+
+    storage = SQLiteUsersData(args.db_path)
+    count = storage.import_json(args.json_path)
+    storage.close()
+    print(f"Migrated {count} user profiles from {args.json_path} to {args.db_path}")
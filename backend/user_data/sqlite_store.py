@@ -0,0 +1,184 @@
+from typing import Any, Dict, Iterable, List, Optional
+import json
+import os
+import sqlite3
+import threading
+
+from storage_codec import read_records
+from .user_profile import DATA_DIR, UserProfile, UsersData
+from .lazy_users import LazyUsers
+
+
+class SQLiteUsersData(UsersData):
+    """
+    Class managing the data storage of the user profiles in a SQLite database.
+    Every user profile is stored as one row, looked up by its username.
+    Profiles are only loaded from the database when they are asked for, and only changed profiles are written back.
+    Several processes can share the database, changes of other processes are merged field by field.
+    """
+
+    def __init__(
+        self, file_path=os.path.join(DATA_DIR, "users.db"), blob_store=None, codec=None
+    ) -> None:
+        """
+        Initializes a SQLiteUsersData object. Opens (and if needed creates) the database in WAL mode.
+        :param file_path (str): The path to the SQLite database file.
+        :param blob_store (BlobStore): Optional store that keeps the heavy fields of every profile in separate files.
+        :param codec: Not used, the rows are always stored as JSON. Accepted so all storage engines share one signature.
+        """
+        self.lock = threading.RLock()
+        self.data_version = None
+        super().__init__(file_path, blob_store, codec)
+
+    def add_user(self, user_profile: UserProfile) -> None:
+        """
+        Add's a new user profile to the database.
+        If the username already exists in the database, it raises a ValueError.
+        :param user_profile (UserProfile): A user profile object that will be added to the storage.
+        """
+        username: str = user_profile.username
+        if username in self.users:
+            raise ValueError(f"User with username '{username}' already exists.")
+        self.users[username] = user_profile
+        self.save_user(user_profile)
+
+    def save_user(self, user_profile: UserProfile) -> None:
+        """
+        Writes a single user profile to the database if it has changed.
+        :param user_profile (UserProfile): The user profile that has been changed.
+        """
+        self._write([user_profile])
+
+    def save_users(self, user_profiles: List[UserProfile]) -> None:
+        """
+        Writes the changed user profiles of the given list to the database in one transaction.
+        :param user_profiles (List[UserProfile]): The user profiles that have been changed.
+        """
+        self._write(user_profiles)
+
+    def save_to_file(self) -> None:
+        """
+        Writes all loaded user profiles that have changed to the database in one transaction.
+        Profiles that were never loaded cannot have changed, so they are not touched.
+        """
+        self._write(list(self.users.loaded.values()))
+
+    def load_from_file(self) -> None:
+        """
+        Opens the database and creates the users table if it does not exist yet.
+        User profiles are not loaded here, but on their first lookup.
+        """
+        directory = os.path.dirname(self.file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(self.file_path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                "username TEXT PRIMARY KEY, profile TEXT NOT NULL)"
+            )
+            self.data_version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+        self.users = LazyUsers(self._load_user, self._usernames)
+
+    def refresh(self) -> None:
+        """
+        Reloads the loaded user profiles that other processes changed.
+        Only costs one PRAGMA query when the database did not change.
+        """
+        self._refresh_blobs()
+        with self.lock:
+            data_version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self.data_version:
+                return
+            self.data_version = data_version
+            records = {}
+            for username in list(self.users.loaded):
+                record = self._select(username)
+                if record is not None:
+                    records[username] = record
+            self.merge_records(records)
+
+    def import_json(self, json_path: str) -> int:
+        """
+        Copies all user profiles of a users.json file into the database, replacing existing rows with the same username.
+        Files written with another storage codec are detected and read as well.
+        :param json_path (str): The path to the JSON file with the user profiles.
+        :return (int): The number of imported user profiles.
+        """
+        user_data = read_records(json_path)
+        # Builds every profile first so that invalid records fail before anything is written
+        profiles = [UserProfile(**user_profile) for user_profile in user_data.values()]
+        self._write(profiles, force=True)
+        return len(profiles)
+
+    def close(self) -> None:
+        """
+        Closes the database connection.
+        """
+        with self.lock:
+            self.connection.close()
+
+    def _load_user(self, username: str) -> Optional[UserProfile]:
+        """
+        Loads a single user profile from the database.
+        :param username (str): The username of the user.
+        :return (UserProfile): The user profile, or None if it does not exist.
+        """
+        record = self._select(username)
+        if record is None:
+            return None
+        self.tracker.track(username, record)
+        return self.from_record(record)
+
+    def _select(self, username: str) -> Optional[Dict[str, Any]]:
+        """
+        Reads the stored record of a single user.
+        :param username (str): The username of the user.
+        :return (Dict[str, Any]): The stored record, or None if it does not exist.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT profile FROM users WHERE username = ?", (username,)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def _usernames(self) -> List[str]:
+        """
+        Returns the usernames of all stored user profiles.
+        """
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT username FROM users")]
+
+    def _write(self, user_profiles: Iterable[UserProfile], force: bool = False) -> None:
+        """
+        Writes the given user profiles to the database in one transaction.
+        Changes another process made to the same profiles are merged in first, so they are not lost.
+        :param user_profiles (Iterable[UserProfile]): The user profiles to write.
+        :param force (bool): Whether unchanged profiles are written as well.
+        """
+        with self.lock, self.connection:
+            # Takes the write lock right away, so no other process can change the rows between reading and writing
+            self.connection.execute("BEGIN IMMEDIATE")
+            rows = []
+            records = []
+            for user_profile in user_profiles:
+                username = user_profile.username
+                if self.users.loaded.get(username) is user_profile:
+                    stored = self._select(username)
+                    if stored is not None:
+                        self.merge_records({username: stored})
+                record = self.to_record(user_profile)
+                if force or self.tracker.changes(username, record):
+                    rows.append((username, json.dumps(record)))
+                    records.append(record)
+            if rows:
+                self.connection.executemany(
+                    "INSERT INTO users (username, profile) VALUES (?, ?) "
+                    "ON CONFLICT(username) DO UPDATE SET profile = excluded.profile",
+                    rows,
+                )
+        for record in records:
+            self.tracker.track(record["username"], record)
@@ -0,0 +1,57 @@
+from typing import Dict, Type, Union
+
+from storage_codec import get_codec
+from .user_profile import UsersData
+from .journal import JournaledUsersData
+from .sqlite_store import SQLiteUsersData
+from .indexed_store import IndexedUsersData
+from .blob_store import BlobStore
+from .write_behind import WriteBehindUsersData
+
+# The storage engines that can be picked with the USERS_STORAGE setting.
+STORAGE_ENGINES: Dict[str, Type[UsersData]] = {
+    "json": UsersData,
+    "journal": JournaledUsersData,
+    "sqlite": SQLiteUsersData,
+    "indexed": IndexedUsersData,
+}
+
+
+def create_users_data(
+    storage: str = "json",
+    file_path: str = None,
+    blob_dir: str = None,
+    write_delay: float = None,
+    codec: str = None,
+    write_max_delay: float = None,
+) -> Union[UsersData, WriteBehindUsersData]:
+    """
+    Creates the UsersData object for the configured storage engine.
+    Raises a ValueError if the storage engine does not exist.
+    :param storage (str): The name of the storage engine (json, journal, sqlite or indexed).
+    :param file_path (str): The path of the storage file, defaults to the default path of the storage engine.
+    :param blob_dir (str): Optional directory where the heavy profile fields are stored separately and loaded lazily.
+    :param write_delay (float): Optional debounce window in seconds, saves are then written by a background thread.
+    :param codec (str): Optional file format of the storage file (json, compact, records or msgpack).
+    :param write_max_delay (float): Optional maximum number of seconds a save may wait in the background,
+        2 seconds by default. Only used with a write delay.
+    :return (UsersData): The UsersData object of the storage engine.
+    """
+    storage_class = STORAGE_ENGINES.get(storage.lower())
+    if storage_class is None:
+        raise ValueError(
+            f"Unknown user storage '{storage}', choose one of: {', '.join(STORAGE_ENGINES)}"
+        )
+    blob_store = BlobStore(blob_dir) if blob_dir else None
+    file_codec = get_codec(codec) if codec else None
+    if file_path:
+        users_data = storage_class(file_path, blob_store=blob_store, codec=file_codec)
+    else:
+        users_data = storage_class(blob_store=blob_store, codec=file_codec)
+    if write_delay:
+        if write_max_delay:
+            return WriteBehindUsersData(
+                users_data, debounce=write_delay, max_delay=write_max_delay
+            )
+        return WriteBehindUsersData(users_data, debounce=write_delay)
+    return users_data
@@ -1,5 +1,13 @@
-from typing import List, Tuple, Dict, Any
-import json
+from typing import List, Tuple, Dict, Any, Callable, Optional
+import os
+
+from storage_codec import decode_any, get_codec
+from .change_tracking import ChangeTracker
+from .file_lock import locked, file_signature, write_atomic
+
+# The default location of the user storage files, next to this module so it does not depend on the working directory
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+USERS_FILE = os.path.join(DATA_DIR, "users.json")
 
 
 class UserProfile:
@@ -7,6 +15,46 @@ class UserProfile:
     Class representing a user profile in the system.
     """
 
+    # All fields of a user profile, in the order they are stored.
+    FIELDS = (
+        "username",
+        "password",
+        "name",
+        "age",
+        "sex",
+        "height",
+        "weight",
+        "skin_color",
+        "country",
+        "medication",
+        "diet",
+        "existing_conditions",
+        "allergies",
+        "saved_recipes",
+        "analysis_results",
+        "mealplan",
+        "symptom_analysis",
+    )
+
+    # Fields that hold large per-user data. A blob store can keep them outside the main storage file.
+    BLOB_FIELDS = ("analysis_results", "mealplan", "symptom_analysis")
+
+    # Factories for the value of a list or dict field that was not given, so every profile gets its own container.
+    DEFAULTS: Dict[str, Callable[[], Any]] = {
+        "medication": list,
+        "diet": list,
+        "existing_conditions": list,
+        "allergies": list,
+        "saved_recipes": list,
+        "analysis_results": list,
+        "mealplan": list,
+        "symptom_analysis": dict,
+    }
+
+    # Slots instead of a per-object __dict__ keep every loaded profile small.
+    # deferred_loader loads a deferred blob field, set by the blob store when the field was not loaded with the profile.
+    __slots__ = FIELDS + ("deferred_loader",)
+
     def __init__(
         self,
         username: str,
@@ -18,14 +66,14 @@ class UserProfile:
         weight: float,
         skin_color: str,
         country: str,
-        medication: List[str] = [],
-        diet: List[str] = [],
-        existing_conditions: List[str] = [],
-        allergies: List[str] = [],
-        saved_recipes=[],
-        analysis_results: List = [],
-        mealplan=[],
-        symptom_analysis: Dict[str, Any] = {}
+        medication: Optional[List[str]] = None,
+        diet: Optional[List[str]] = None,
+        existing_conditions: Optional[List[str]] = None,
+        allergies: Optional[List[str]] = None,
+        saved_recipes=None,
+        analysis_results: Optional[List] = None,
+        mealplan=None,
+        symptom_analysis: Optional[Dict[str, Any]] = None
     ) -> None:
         """
         Initializes a User Profile object.
@@ -58,14 +106,15 @@ class UserProfile:
         self.weight = weight
         self.skin_color = skin_color
         self.country = country
-        self.medication = medication
-        self.diet = diet
-        self.existing_conditions = existing_conditions
-        self.allergies = allergies
-        self.saved_recipes = saved_recipes
-        self.analysis_results = analysis_results
-        self.mealplan = mealplan
-        self.symptom_analysis = symptom_analysis
+        self.medication = [] if medication is None else medication
+        self.diet = [] if diet is None else diet
+        self.existing_conditions = [] if existing_conditions is None else existing_conditions
+        self.allergies = [] if allergies is None else allergies
+        self.saved_recipes = [] if saved_recipes is None else saved_recipes
+        self.analysis_results = [] if analysis_results is None else analysis_results
+        self.mealplan = [] if mealplan is None else mealplan
+        self.symptom_analysis = {} if symptom_analysis is None else symptom_analysis
+        self.deferred_loader = None
 
         # Validates the information
         if not username:
@@ -97,41 +146,82 @@ class UserProfile:
         if not country:
             raise ValueError("Country is required")
 
-    def to_dict(self):
-        return {
-            "username": self.username,
-            "password": self.password,
-            "name": self.name,
-            "age": self.age,
-            "sex": self.sex,
-            "height": self.height,
-            "weight": self.weight,
-            "skin_color": self.skin_color,
-            "country": self.country,
-            "medication": self.medication,
-            "diet": self.diet,
-            "existing_conditions": self.existing_conditions,
-            "allergies": self.allergies,
-            "saved_recipes": self.saved_recipes,
-            "analysis_results": self.analysis_results,
-            "mealplan": self.mealplan,
-            "symptom_analysis": self.symptom_analysis
-        }
+    @classmethod
+    def from_dict(cls, record: Dict[str, Any]) -> "UserProfile":
+        """
+        Creates a user profile from a stored record without validating it again, which makes loading cheaper.
+        Fields that are missing in the record get their default value, unknown keys are ignored.
+        :param record (Dict[str, Any]): The stored record of the user profile.
+        :return (UserProfile): The user profile.
+        """
+        user_profile = cls.__new__(cls)
+        for field in cls.FIELDS:
+            if field in record:
+                setattr(user_profile, field, record[field])
+            elif field in cls.DEFAULTS:
+                setattr(user_profile, field, cls.DEFAULTS[field]())
+        user_profile.deferred_loader = None
+        return user_profile
+
+    def __getattr__(self, name: str) -> Any:
+        """
+        Loads a deferred blob field the first time it is accessed.
+        Python only calls this method when the attribute is not set on the object.
+        :param name (str): The name of the attribute.
+        :return (Any): The loaded value of the blob field.
+        """
+        if name not in self.BLOB_FIELDS or self.deferred_loader is None:
+            raise AttributeError(name)
+        value = self.deferred_loader(self.username, name)
+        setattr(self, name, value)
+        return value
+
+    def is_loaded(self, field: str) -> bool:
+        """
+        Checks whether a field is set on the object, without loading a deferred blob field.
+        :param field (str): The name of the field.
+        :return (bool): True if the field is loaded, False if it is deferred.
+        """
+        try:
+            object.__getattribute__(self, field)
+            return True
+        except AttributeError:
+            return False
+
+    def to_dict(self, exclude: Tuple[str, ...] = ()) -> Dict[str, Any]:
+        """
+        Returns the fields of the user profile as a dictionary.
+        :param exclude (Tuple[str, ...]): Fields to leave out, they are not loaded if they are deferred.
+        :return (Dict[str, Any]): The fields and their values.
+        """
+        return {field: getattr(self, field) for field in self.FIELDS if field not in exclude}
 
 
 class UsersData:
     """
     Class managing the data storage of the user profiles.
     Stores user profiles in a JSON file.
+    The file is locked while it is read or written and replaced atomically, so several processes can share it.
     """
 
-    def __init__(self, file_path="backend/user_data/users.json") -> None:
+    def __init__(
+        self, file_path=USERS_FILE, blob_store=None, codec=None
+    ) -> None:
         """
         Initializes a Userdata object. Loads user profiles from the users.json file if it exists.
         :param file_path (str): The path to the JSON file where user profiles are stored.
+        :param blob_store (BlobStore): Optional store that keeps the heavy fields of every profile in separate files.
+        :param codec: The format the file is written in (see storage_codec), pretty-printed JSON by default.
+            Files in any supported format are detected and read.
         """
         self.users = {}
         self.file_path = file_path
+        self.blob_store = blob_store
+        self.codec = codec or get_codec("json")
+        # The persisted state of every profile and the signature of the file when it was last read or written,
+        # used to find out what other processes changed.
+        self.tracker = ChangeTracker()
+        self.signature = None
         self.load_from_file()
 
     def add_user(self, user_profile: UserProfile) -> None:
@@ -149,21 +239,129 @@ class UsersData:
     def save_to_file(self):
         """
         Saves user profiles to the JSON file where the data will be stored.
+        If another process changed the file in the meantime, its changes are merged in first so they are not lost.
+        """
+        with locked(self.file_path):
+            if file_signature(self.file_path) != self.signature:
+                self.merge_records(self._read_records())
+            records = {u: self.to_record(p) for u, p in self.users.items()}
+            data = self.codec.encode(records)
+            write_atomic(self.file_path, data)
+            self.signature = file_signature(self.file_path)
+        # The written file is only decoded again if another process changes it before the next save
+        self.tracker.track_all(lambda: decode_any(data))
+
+    def refresh(self) -> None:
+        """
+        Reloads the user profiles that other processes changed since the file was last read or written.
+        Only costs a stat call when the file did not change, and one per loaded blob with a blob store.
+        """
+        self._refresh_blobs()
+        if file_signature(self.file_path) == self.signature:
+            return
+        with locked(self.file_path, shared=True):
+            self.merge_records(self._read_records())
+
+    def _refresh_blobs(self) -> None:
         """
-        with open(self.file_path, "w") as file:
-            json.dump({u: p.to_dict() for u, p in self.users.items()}, file, indent=2)
+        Unloads the blob fields of the loaded profiles that other processes rewrote, see BlobStore.refresh.
+        """
+        if self.blob_store is not None:
+            self.blob_store.refresh(getattr(self.users, "loaded", self.users))
+
+    def merge_records(self, records: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Merges stored records that were changed by another process into the loaded user profiles.
+        Only the fields that changed in storage are updated, in place, and unsaved local changes of a field win.
+        Profiles that are not loaded yet are created.
+        :param records (Dict[str, Dict[str, Any]]): The stored records by username.
+        """
+        exclude = UserProfile.BLOB_FIELDS if self.blob_store is not None else ()
+        for username, record in records.items():
+            user_profile = self.users.get(username)
+            if user_profile is None:
+                self.users[username] = self.from_record(record)
+            else:
+                stored_changes = self.tracker.changes(username, record)
+                if not stored_changes:
+                    continue
+                local_changes = self.tracker.changes(
+                    username, user_profile.to_dict(exclude=exclude)
+                )
+                for field, value in stored_changes.items():
+                    if field not in local_changes:
+                        setattr(user_profile, field, value)
+            self.tracker.track(username, record)
+
+    def to_record(self, user_profile: UserProfile) -> Dict[str, Any]:
+        """
+        Returns the record of a user profile that is written to the storage file.
+        With a blob store the heavy fields are left out of the record and saved to the blob store if they changed.
+        :param user_profile (UserProfile): The user profile to store.
+        :return (Dict[str, Any]): The record of the user profile.
+        """
+        if self.blob_store is None:
+            return user_profile.to_dict()
+        return self.blob_store.split(user_profile)
+
+    def from_record(self, record: Dict[str, Any]) -> UserProfile:
+        """
+        Creates a user profile from a record of the storage file.
+        With a blob store the heavy fields that are not in the record are loaded on their first access.
+        :param record (Dict[str, Any]): The record of the user profile.
+        :return (UserProfile): The user profile.
+        """
+        user_profile = UserProfile.from_dict(record)
+        if self.blob_store is not None:
+            self.blob_store.defer(user_profile, record)
+        return user_profile
+
+    def save_user(self, user_profile: UserProfile) -> None:
+        """
+        Saves the changes made to a single user profile.
+        The JSON file can only be rewritten as a whole, other storage engines override this to write less.
+        :param user_profile (UserProfile): The user profile that has been changed.
+        """
+        self.save_to_file()
+
+    def save_users(self, user_profiles: List[UserProfile]) -> None:
+        """
+        Saves the changes made to several user profiles in one write.
+        :param user_profiles (List[UserProfile]): The user profiles that have been changed.
+        """
+        self.save_to_file()
 
     def load_from_file(self):
         """
         Loads user profiles from the JSON file.
-        Raises an FileNotFoundError if the file does not exist."""
+        Nothing is loaded if the file does not exist."""
+        with locked(self.file_path, shared=True):
+            data = self._read_data()
+        for username, user_profile in decode_any(data).items():
+            self.users[username] = self.from_record(user_profile)
+        # The profiles share the containers of the decoded records, so the file is decoded again when needed
+        self.tracker.track_all(lambda: decode_any(data))
+
+    def _read_records(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Reads all records of the storage file and remembers the signature of the file that was read.
+        Must be called while the file is locked.
+        :return (Dict[str, Dict[str, Any]]): The records by username, empty if the file does not exist.
+        """
+        return decode_any(self._read_data())
+
+    def _read_data(self) -> bytes:
+        """
+        Reads the content of the storage file and remembers the signature of the file that was read.
+        Must be called while the file is locked.
+        :return (bytes): The content of the file, empty if the file does not exist.
+        """
+        self.signature = file_signature(self.file_path)
         try:
-            with open(self.file_path, "r") as file:
-                user_data = json.load(file)
-                for username, user_profile in user_data.items():
-                    self.users[username] = UserProfile(**user_profile)
+            with open(self.file_path, "rb") as file:
+                return file.read()
         except FileNotFoundError:
-            pass
+            return b""
 
     def get_user(self, username: str) -> UserProfile:
         """
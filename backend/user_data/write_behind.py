@@ -0,0 +1,179 @@
+from typing import Any, Dict, List
+import atexit
+import threading
+import time
+
+from .user_profile import UserProfile, UsersData
+
+
+class WriteBehindUsersData:
+    """
+    Wraps a UsersData storage engine so that saves only mark the changed profiles as dirty and return immediately.
+    A background thread writes the dirty profiles once no save happened for `debounce` seconds,
+    but never later than `max_delay` seconds after the first unwritten save.
+    All other attributes and methods are passed on to the wrapped storage engine.
+    """
+
+    def __init__(
+        self, storage: UsersData, debounce: float = 0.5, max_delay: float = 2.0
+    ) -> None:
+        """
+        Initializes a WriteBehindUsersData object and starts the background flusher.
+        :param storage (UsersData): The storage engine that performs the actual writes.
+        :param debounce (float): Seconds without saves after which the dirty profiles are written.
+        :param max_delay (float): Maximum number of seconds a save may wait before it is written.
+        """
+        self.storage = storage
+        self.debounce = debounce
+        self.max_delay = max_delay
+
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.dirty: Dict[str, UserProfile] = {}
+        self.full_save = False
+        self.pending_saves = 0
+        self.first_save_at = 0.0
+        self.last_save_at = 0.0
+        self.closed = False
+
+        # Counters to tune the debounce window: how many logical saves were merged into each physical write.
+        self.stats: Dict[str, Any] = {
+            "logical_saves": 0,
+            "physical_writes": 0,
+            "last_batch": 0,
+            "largest_batch": 0,
+            "failed_writes": 0,
+        }
+
+        self.thread = threading.Thread(
+            target=self._run, name="users-data-flusher", daemon=True
+        )
+        self.thread.start()
+        atexit.register(self.close)
+
+    def __getattr__(self, name: str) -> Any:
+        """
+        Passes every attribute that is not defined here on to the wrapped storage engine.
+        """
+        return getattr(self.storage, name)
+
+    def add_user(self, user_profile: UserProfile) -> None:
+        """
+        Add's a new user profile and marks it to be written.
+        If the username already exists in the database, it raises a ValueError.
+        :param user_profile (UserProfile): A user profile object that will be added to the storage.
+        """
+        username: str = user_profile.username
+        if username in self.storage.users:
+            raise ValueError(f"User with username '{username}' already exists.")
+        self.storage.users[username] = user_profile
+        self.save_user(user_profile)
+
+    def save_user(self, user_profile: UserProfile) -> None:
+        """
+        Marks a single user profile to be written by the background flusher.
+        :param user_profile (UserProfile): The user profile that has been changed.
+        """
+        with self.condition:
+            self.dirty[user_profile.username] = user_profile
+            self._mark_saved()
+
+    def save_users(self, user_profiles: List[UserProfile]) -> None:
+        """
+        Marks several user profiles to be written by the background flusher.
+        :param user_profiles (List[UserProfile]): The user profiles that have been changed.
+        """
+        with self.condition:
+            for user_profile in user_profiles:
+                self.dirty[user_profile.username] = user_profile
+            self._mark_saved()
+
+    def save_to_file(self) -> None:
+        """
+        Marks all user profiles to be written by the background flusher.
+        """
+        with self.condition:
+            self.full_save = True
+            self._mark_saved()
+
+    def flush(self) -> None:
+        """
+        Writes all dirty user profiles now, with one call to the wrapped storage engine.
+        Profiles that fail to be written stay dirty and are tried again on the next flush.
+        """
+        with self.write_lock:
+            with self.condition:
+                user_profiles = list(self.dirty.values())
+                full_save = self.full_save
+                merged = self.pending_saves
+                self.dirty = {}
+                self.full_save = False
+                self.pending_saves = 0
+            if not user_profiles and not full_save:
+                return
+
+            try:
+                if full_save:
+                    self.storage.save_to_file()
+                else:
+                    self.storage.save_users(user_profiles)
+            except Exception as e:
+                # A request thread might have changed a profile while it was being written, try again later
+                print("Writing user data failed:", e)
+                with self.condition:
+                    for user_profile in user_profiles:
+                        self.dirty.setdefault(user_profile.username, user_profile)
+                    self.full_save = self.full_save or full_save
+                    self.pending_saves += merged
+                    self.first_save_at = self.last_save_at = time.monotonic()
+                    self.stats["failed_writes"] += 1
+                return
+
+            self.stats["physical_writes"] += 1
+            self.stats["last_batch"] = merged
+            self.stats["largest_batch"] = max(self.stats["largest_batch"], merged)
+
+    def close(self) -> None:
+        """
+        Stops the background flusher and writes everything that is still dirty.
+        Called automatically when the interpreter exits.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.flush()
+
+    def _mark_saved(self) -> None:
+        """
+        Registers a logical save and wakes up the background flusher. Must be called with the condition held.
+        """
+        now = time.monotonic()
+        if not self.pending_saves:
+            self.first_save_at = now
+        self.last_save_at = now
+        self.pending_saves += 1
+        self.stats["logical_saves"] += 1
+        self.condition.notify_all()
+
+    def _run(self) -> None:
+        """
+        Loop of the background flusher. Waits for saves, waits for the debounce window and then flushes.
+        """
+        while True:
+            with self.condition:
+                while not self.pending_saves and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                while not self.closed:
+                    deadline = min(
+                        self.last_save_at + self.debounce,
+                        self.first_save_at + self.max_delay,
+                    )
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+            self.flush()